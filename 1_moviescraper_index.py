@@ -1,9 +1,12 @@
 import requests
 import csv
+import os
 from bs4 import BeautifulSoup
 
-BASE_URL = "https://imsdb.com/alphabetical/"
-SCRIPT_URL = "https://imsdb.com/scripts/"
+# IMSDB_URL points both stages at another host, e.g. the local stand-in in benchmarks/imsdb_standin.py
+IMSDB_URL = os.environ.get("IMSDB_URL", "https://imsdb.com").rstrip("/")
+BASE_URL = f"{IMSDB_URL}/alphabetical/"
+SCRIPT_URL = f"{IMSDB_URL}/scripts/"
 
 def get_movie_links(start_letter, end_letter):
     """Scrapes movie titles and script links from A to B and returns a list"""
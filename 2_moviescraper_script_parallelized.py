@@ -1,63 +1,40 @@
-import requests
-import os
-from bs4 import BeautifulSoup
+import argparse
 import csv
-from joblib import Parallel, delayed
-from tqdm import tqdm
-from tqdm_joblib import tqdm_joblib  # Fixes tqdm with joblib
-
-SCRIPT_FOLDER = "movie_scripts"
-NUM_WORKERS = 32
-
-# Ensure the folder exists
-os.makedirs(SCRIPT_FOLDER, exist_ok=True)
-
-def scrape_script(title, script_url):
-    """Scrapes an individual script and saves it as a text file."""
-    try:
-        response = requests.get(script_url, timeout=10)
-        if response.status_code != 200:
-            return f"Failed: {title}"
-
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # Extract script content
-        script_content = soup.find_all('pre')
-        if script_content:
-            script_text = str(script_content[0])
-
-            # Define filename (Replace invalid characters in title)
-            safe_title = "".join(c if c.isalnum() or c in " _-" else "_" for c in title)
-            filename = os.path.join(SCRIPT_FOLDER, f"{safe_title}.txt")
-
-            # Save script to file
-            with open(filename, "w", encoding="utf-8") as file:
-                file.write(script_text)
-
-            return f"Saved: {title}"
-        else:
-            return f"Not Found: {title}"
-
-    except requests.exceptions.RequestException as e:
-        return f"Error: {title}"
-
-def process_csv(filename="index.csv"):
-    """Reads movie titles and script links from CSV and scrapes scripts in parallel."""
+from script_scraper import SCRIPT_FOLDER, MANIFEST_DB, MAX_CONNECTIONS, PER_HOST_LIMIT, scrape
+from script_store import SCRIPT_STORE_DIR, import_folder
+
+def process_csv(filename="index.csv", script_folder=SCRIPT_FOLDER, manifest_db=MANIFEST_DB, pack=False, **options):
+    """
+    Reads movie titles and script links from CSV and scrapes scripts concurrently.
+    With pack=True the downloads are moved into the packed script store afterwards.
+    """
     with open(filename, mode="r", encoding="utf-8") as file:
         reader = csv.reader(file)
         next(reader)  # Skip header row
 
         movies = [(title, script_url) for title, script_url in reader]
 
-    # Use tqdm_joblib for proper progress tracking
-    with tqdm_joblib(tqdm(desc="Scraping Scripts", total=len(movies), ncols=100)):
-        results = Parallel(n_jobs=NUM_WORKERS, backend="threading")(
-            delayed(scrape_script)(title, script_url) for title, script_url in movies
-        )
+    # Unchanged scripts are skipped with conditional GETs; an interrupted run resumes where it stopped
+    outcomes = scrape(movies, script_folder, manifest_db, store_dir=SCRIPT_STORE_DIR if pack else None, **options)
 
     # Print summary
-    for res in results:
-        print(res)
+    print(f"Saved: {outcomes['saved']} | Unchanged: {outcomes['unchanged']} | "
+          f"Not Found: {outcomes['not_found'] + outcomes['no_script']} | Failed: {outcomes['failed']} | "
+          f"Retries: {outcomes['retries']}")
+
+    if pack:
+        packed = import_folder(script_folder, SCRIPT_STORE_DIR, remove=True)
+        print(f"📦 Packed {packed['added'] + packed['updated']} new scripts into {SCRIPT_STORE_DIR}")
+    return outcomes
 
 if __name__ == "__main__":
-    process_csv("index.csv")  # Read from index.csv and scrape scripts
+    parser = argparse.ArgumentParser(description="Download every script listed in index.csv.")
+    parser.add_argument("--index", default="index.csv")
+    parser.add_argument("--out", default=SCRIPT_FOLDER, help="folder the scripts are saved in")
+    parser.add_argument("--manifest", default=MANIFEST_DB, help="SQLite file with validators and retry state")
+    parser.add_argument("--connections", type=int, default=MAX_CONNECTIONS)
+    parser.add_argument("--per-host", type=int, default=PER_HOST_LIMIT)
+    parser.add_argument("--pack", action="store_true", help="move downloads into the packed script store")
+    args = parser.parse_args()
+
+    process_csv(args.index, args.out, args.manifest, args.pack, max_connections=args.connections, per_host_limit=args.per_host)
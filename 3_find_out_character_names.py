@@ -1,35 +1,38 @@
 import os
+import argparse
 import csv
 import requests
-from google import genai
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 import re
 import json
-import time
+from collections import Counter
 from joblib import Parallel, delayed
+from llm_backend import GeminiBackend, api_keys_from_env
+from script_store import SCRIPT_STORE_DIR, ScriptSource
+from bold_cues import classify_cues, estimate_tokens, iter_bold_cues, print_savings
+from prompts import build_character_names_batch_prompt, build_character_names_prompt
 
 load_dotenv()
 
 SCRIPT_FOLDER = "movie_scripts"
 OUTPUT_CSV = "character_names.csv"
-API_KEYS = [os.environ["API_KEY_1"], os.environ["API_KEY_2"]]  # Use multiple API keys
-MAX_RETRIES = 3  # Number of times to retry API requests on failure
-RETRY_DELAY = 5  # Delay (in seconds) between retries
-NUM_WORKERS = 2  # Number of parallel processes (adjust based on API keys)
+API_KEYS = api_keys_from_env("API_KEY_1", "API_KEY_2")  # Use multiple API keys
+MAX_RETRIES = 3  # Attempts per API request, on whichever key has quota
+NUM_WORKERS = 8  # Concurrent Gemini calls; the scheduler keeps every key within its RPM/TPM quota
+BATCH_TOKEN_BUDGET = 6000  # Estimated prompt tokens per batched request
+BATCH_MAX_SCRIPTS = 40  # Scripts per batched request, whatever their size
 
-# Create Gemini client instances BEFORE parallel processing
-clients = {key: genai.Client(api_key=key) for key in API_KEYS}
+# Scripts come from movie_scripts/ or the packed store (see script_store.py)
+script_source = ScriptSource(SCRIPT_FOLDER, SCRIPT_STORE_DIR)
+
+# One Gemini backend for all workers (they are threads), so every call is scheduled
+# on the least-loaded key and backs off when Gemini says a key is over quota
+llm = GeminiBackend(API_KEYS, attempts=MAX_RETRIES)
 
 def extract_bold_names(script_text):
     """Extracts unique names from <b> tags in the script."""
-    soup = BeautifulSoup(script_text, "html.parser")
-    bold_tags = soup.find_all("b")
-
-    # Extract text, strip spaces, remove empty strings
-    names = list(set(tag.get_text(strip=True) for tag in bold_tags if tag.get_text(strip=True)))
-
-    return names
+    # Streaming scan of the <b> spans, no DOM needed
+    return sorted({cue for cue, _, _ in iter_bold_cues(script_text)})
 
 def clean_and_parse_json(text):
     """Cleans and parses JSON response from Gemini."""
@@ -42,31 +45,23 @@ def clean_and_parse_json(text):
         print("❌ Failed to parse JSON response.")
         return {}
 
-def check_character_names(script_name, names, client):
+def check_character_names(script_name, names):
     """Sends names to Gemini API to filter out character names, respecting rate limits."""
-    prompt = f"""
-    Hey Gemini! I am building a project that requires extracting character names from movie scripts.
-    The script's filename is {script_name} and the character names are:
-    {names}
-    Return strictly in JSON format with the key being 'characters' and the value being the names of the characters in a list.
-    DO NOT RETURN ANYTHING ELSE OTHER THAN THE CHARACTER NAMES. STRICTLY FOLLOW ALL MY INSTRUCTIONS.
-    Please return only the names that belong to characters in the script. Exclude any non-character words.
-    """
+    prompt = build_character_names_prompt(script_name, names)
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            response = client.models.generate_content(model="gemini-2.0-flash", contents=prompt)
-            response = clean_and_parse_json(response.text)
-            time.sleep(0.5)  # Ensure 2 requests per second
-            return response.get("characters", [])
-        except Exception as e:
-            print(f"⚠️ API request failed for {script_name} (Attempt {attempt}/{MAX_RETRIES}): {e}")
-            if attempt < MAX_RETRIES:
-                print(f"🔄 Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
-            else:
-                print(f"❌ Max retries reached for {script_name}. Skipping.")
-                return []  # Return empty list if all retries fail
+    # Pacing and retries (MAX_RETRIES, with backoff) happen in the key scheduler
+    try:
+        response = clean_and_parse_json(llm.generate(prompt))
+        return response.get("characters", [])
+    except Exception as e:
+        print(f"❌ API request failed for {script_name} after {MAX_RETRIES} attempts: {e}. Skipping.")
+        return []  # Return empty list if all retries fail
+
+def print_key_stats():
+    """How the Gemini calls were spread over the API keys."""
+    for key, stats in llm.stats().items():
+        print(f"🔑 {key}: {stats['successes']} ok, {stats['rate_limited']} rate limited, "
+              f"{stats['errors']} errors, breaker {stats['breaker']}")
 
 def get_processed_scripts():
     """Reads the existing CSV file to determine which scripts have already been processed."""
@@ -78,33 +73,192 @@ def get_processed_scripts():
             processed_scripts = {row[0] for row in reader}  # Collect script names
     return processed_scripts
 
-def process_script(filename, client):
-    """Processes a single script: extracts names, validates with Gemini, and returns results."""
-    try:
-        filepath = os.path.join(SCRIPT_FOLDER, filename)
-        print(f"📄 Processing: {filename}")
+def prepare_script(filename):
+    """
+    Reads a script and settles its obvious cues locally.
+    Returns (speakers, ambiguous, usage): the names already accepted, the ones
+    Gemini still has to judge, and counters for the savings report.
+    """
+    usage = {"scripts": 1, "calls_before": 1, "calls_after": 0, "tokens_before": 0, "tokens_after": 0}
+
+    # Read script text
+    script_text = script_source.read(filename)
+
+    # Extract names from <b> tags; this is what used to be sent to Gemini in full
+    extracted_names = extract_bold_names(script_text)
+    usage["tokens_before"] = estimate_tokens(build_character_names_prompt(filename, extracted_names))
 
-        # Read script text
-        with open(filepath, "r", encoding="utf-8") as script_file:
-            script_text = script_file.read()
+    # Obvious speakers and non-speakers (scene headings, transitions...) are settled locally
+    speakers, non_speakers, ambiguous = classify_cues(script_text)
+    usage.update(speakers=len(speakers), non_speakers=len(non_speakers), ambiguous=len(ambiguous))
+    return speakers, ambiguous, usage
 
-        # Extract names from <b> tags
-        extracted_names = extract_bold_names(script_text)
+def process_script(filename):
+    """
+    Processes a single script: extracts names, validates the doubtful ones with Gemini.
+    Returns the CSV row and the Gemini usage counters for the savings report.
+    """
+    usage = {"scripts": 1, "calls_before": 1}
+    try:
+        print(f"📄 Processing: {filename}")
+        speakers, ambiguous, usage = prepare_script(filename)
 
-        # Validate character names using Gemini API
-        character_names = check_character_names(filename, extracted_names, client)
+        # Validate only the remaining character names using Gemini API
+        character_names = list(speakers)
+        if ambiguous:
+            usage["calls_after"] = 1
+            usage["tokens_after"] = estimate_tokens(build_character_names_prompt(filename, ambiguous))
+            confirmed = check_character_names(filename, ambiguous)
+            character_names += [name for name in confirmed if name not in speakers]
 
-        return [filename, ", ".join(character_names)]
+        return [filename, ", ".join(character_names)], usage
     
     except Exception as e:
         print(f"❌ Error processing {filename}: {e}")
-        return [filename, ""]
+        return [filename, ""], usage
+
+def pack_batches(pending, token_budget=BATCH_TOKEN_BUDGET, max_scripts=BATCH_MAX_SCRIPTS):
+    """Groups (filename, speakers, ambiguous) entries into batches whose prompt stays within the token budget."""
+    batches, batch = [], []
+    for entry in pending:
+        candidate = batch + [entry]
+        prompt = build_character_names_batch_prompt({filename: ambiguous for filename, _, ambiguous in candidate})
+        if batch and (estimate_tokens(prompt) > token_budget or len(candidate) > max_scripts):
+            batches.append(batch)
+            batch = [entry]
+        else:
+            batch = candidate
+    if batch:
+        batches.append(batch)
+    return batches
+
+def validate_batch_entry(value, candidates):
+    """
+    The names Gemini accepted for one script, restricted to that script's candidates.
+    None when the entry is missing or malformed, so the script gets retried.
+    """
+    if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        return None
+    by_upper = {candidate.upper(): candidate for candidate in candidates}
+    return [by_upper[name.strip().upper()] for name in value if name.strip().upper() in by_upper]
+
+def check_character_names_batch(batch, usage):
+    """
+    Resolves a batch of (filename, speakers, ambiguous) entries with as few Gemini calls as possible.
+    Scripts whose part of the reply is missing or malformed are split off and retried
+    in smaller batches, down to a single-script request. Returns {filename: confirmed names}.
+    """
+    confirmed = {}
+    parts = [batch]
+    while parts:
+        part = parts.pop()
+        if len(part) == 1:
+            filename, _, ambiguous = part[0]
+            usage["calls_after"] += 1
+            usage["tokens_after"] += estimate_tokens(build_character_names_prompt(filename, ambiguous))
+            confirmed[filename] = check_character_names(filename, ambiguous)
+            continue
+
+        prompt = build_character_names_batch_prompt({filename: ambiguous for filename, _, ambiguous in part})
+        usage["calls_after"] += 1
+        usage["tokens_after"] += estimate_tokens(prompt)
+        try:
+            replies = clean_and_parse_json(llm.generate(prompt))
+        except Exception as e:
+            print(f"⚠️ Batched request for {len(part)} scripts failed: {e}")
+            replies = {}
+        if not isinstance(replies, dict):
+            replies = {}
+
+        failed = []
+        for filename, speakers, ambiguous in part:
+            names = validate_batch_entry(replies.get(filename), ambiguous)
+            if names is None:
+                failed.append((filename, speakers, ambiguous))
+            else:
+                confirmed[filename] = names
+
+        if failed:
+            print(f"🔄 Splitting {len(failed)} unanswered scripts into smaller batches")
+            middle = len(failed) // 2
+            parts += [failed[:middle], failed[middle:]] if middle else [failed]
+    return confirmed
+
+def resolve_batch(batch):
+    """Worker thread: CSV rows for one batch plus its Gemini usage counters."""
+    usage = Counter()
+    try:
+        confirmed = check_character_names_batch(batch, usage)
+    except Exception as e:
+        print(f"❌ Error processing batch of {len(batch)} scripts: {e}")
+        confirmed = {}
+
+    rows = []
+    for filename, speakers, _ in batch:
+        names = list(speakers) + [name for name in confirmed.get(filename, []) if name not in speakers]
+        rows.append([filename, ", ".join(names)])
+    return rows, usage
+
+def process_scripts_batched(token_budget=BATCH_TOKEN_BUDGET):
+    """
+    Like process_scripts_parallel, but packs several scripts' doubtful names into each Gemini
+    request. Rows are appended to the CSV as each batch finishes, so an interrupted run resumes.
+    """
+    processed_scripts = get_processed_scripts()
+    remaining_files = [f for f in script_source.names() if f not in processed_scripts]
+
+    if not remaining_files:
+        print("✅ All scripts have already been processed!")
+        return
+
+    print(f"Resuming from {remaining_files[0]}... ({len(remaining_files)} scripts left)")
+
+    with open(OUTPUT_CSV, mode="a", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+
+        # If the file is new, add the header row
+        if os.stat(OUTPUT_CSV).st_size == 0:
+            writer.writerow(["Script Name", "Character Names"])
+
+        totals = Counter()
+        pending = []
+        for filename in remaining_files:
+            try:
+                speakers, ambiguous, usage = prepare_script(filename)
+            except Exception as e:
+                print(f"❌ Error processing {filename}: {e}")
+                writer.writerow([filename, ""])
+                continue
+            totals.update(usage)
+
+            # Nothing doubtful: no Gemini call needed at all
+            if ambiguous:
+                pending.append((filename, speakers, ambiguous))
+            else:
+                writer.writerow([filename, ", ".join(speakers)])
+        file.flush()
+
+        batches = pack_batches(pending, token_budget)
+        print(f"📦 {len(pending)} scripts need Gemini, packed into {len(batches)} requests")
+
+        # Threads share llm, which picks a key per call; rows are saved as batches complete
+        results = Parallel(n_jobs=NUM_WORKERS, prefer="threads", return_as="generator")(
+            delayed(resolve_batch)(batch) for batch in batches
+        )
+        for rows, usage in results:
+            writer.writerows(rows)
+            file.flush()  # Ensure data is written immediately
+            totals.update(usage)
+
+        print(f"🎉 All scripts have been processed and saved to {OUTPUT_CSV}")
+        print_savings(totals)
+        print_key_stats()
 
 def process_scripts_parallel():
     """Processes all scripts in parallel and saves results to CSV."""
     processed_scripts = get_processed_scripts()
-    all_files = sorted(os.listdir(SCRIPT_FOLDER))
-    remaining_files = [f for f in all_files if f.endswith(".txt") and f not in processed_scripts]
+    all_files = script_source.names()
+    remaining_files = [f for f in all_files if f not in processed_scripts]
 
     if not remaining_files:
         print("✅ All scripts have already been processed!")
@@ -119,18 +273,29 @@ def process_scripts_parallel():
         if os.stat(OUTPUT_CSV).st_size == 0:
             writer.writerow(["Script Name", "Character Names"])
 
-        # Assign clients to processes (round robin distribution)
-        results = Parallel(n_jobs=NUM_WORKERS)(
-            delayed(process_script)(filename, clients[API_KEYS[i % len(API_KEYS)]])
-            for i, filename in enumerate(remaining_files)
+        # Threads share llm, which picks a key per call
+        results = Parallel(n_jobs=NUM_WORKERS, prefer="threads")(
+            delayed(process_script)(filename) for filename in remaining_files
         )
 
         # Save results immediately to CSV
-        for result in results:
-            writer.writerow(result)
+        totals = Counter()
+        for row, usage in results:
+            writer.writerow(row)
             file.flush()  # Ensure data is written immediately
+            totals.update(usage)
 
         print(f"🎉 All scripts have been processed and saved to {OUTPUT_CSV}")
+        print_savings(totals)
+        print_key_stats()
 
 if __name__ == "__main__":
-    process_scripts_parallel()
+    parser = argparse.ArgumentParser(description="Find the character names in every script with Gemini.")
+    parser.add_argument("--batch", action="store_true", help="send several scripts per Gemini request")
+    parser.add_argument("--token-budget", type=int, default=BATCH_TOKEN_BUDGET, help="estimated prompt tokens per batched request")
+    args = parser.parse_args()
+
+    if args.batch:
+        process_scripts_batched(args.token_budget)
+    else:
+        process_scripts_parallel()
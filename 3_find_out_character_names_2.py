@@ -3,16 +3,20 @@ import csv
 import requests
 import google.generativeai as genai
 from bs4 import BeautifulSoup
-from google import genai
 from dotenv import load_dotenv
 import re
 import json
+from llm_backend import GeminiBackend, api_keys_from_env
+from script_store import SCRIPT_STORE_DIR, ScriptSource
 
 load_dotenv()
 
 SCRIPT_FOLDER = "movie_scripts"
 OUTPUT_CSV = "character_names.csv"
 
+# Calls are paced per key like in stage 3 and the servers (see rate_limiter.py)
+llm = GeminiBackend(api_keys_from_env("API_KEY_2"))
+
 def extract_bold_names(script_text):
     """Extracts unique names from <b> tags in the script."""
     soup = BeautifulSoup(script_text, "html.parser")
@@ -36,9 +40,6 @@ def clean_and_parse_json(text):
 
 def check_character_names(script_name,names):
     """Sends names to Gemini API to filter out character names."""
-    client = genai.Client(api_key=os.environ["API_KEY_2"])
-   
-    
     prompt = f"""
 
     Hey Gemini! I am building a project that requires extracting character names from movie scripts.
@@ -52,10 +53,8 @@ def check_character_names(script_name,names):
 
     
     try:
-        response = client.models.generate_content(
-        model="gemini-2.0-flash", contents=prompt
-    )
-        response=clean_and_parse_json(response.text)
+        response = llm.generate(prompt)
+        response=clean_and_parse_json(response)
         
     
          
@@ -67,17 +66,15 @@ def check_character_names(script_name,names):
 def process_scripts():
     """Processes all scripts in the folder, extracts character names, and saves them to CSV."""
     data = []
-    all_files=os.listdir(SCRIPT_FOLDER)
-    all_files.sort()
+    script_source = ScriptSource(SCRIPT_FOLDER, SCRIPT_STORE_DIR)  # movie_scripts/ or the packed store
+    all_files=script_source.names()
     all_files=all_files[len(all_files)//2:]
     for filename in all_files:
         if filename.endswith(".txt"):
-            filepath = os.path.join(SCRIPT_FOLDER, filename)
             print(f"Processing: {filename}")
 
             # Read script text
-            with open(filepath, "r", encoding="utf-8") as file:
-                script_text = file.read()
+            script_text = script_source.read(filename)
 
             # Extract names from <b> tags
             extracted_names = extract_bold_names(script_text)
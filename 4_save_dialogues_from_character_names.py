@@ -1,125 +1,158 @@
-import os
+import argparse
 import csv
-import re
 import sqlite3
+import time
 from collections import defaultdict
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+from dialogue_schema import create_dialogue_tables
+from screenplay_parser import parse_screenplay
+from script_store import SCRIPT_STORE_DIR, ScriptSource
+from shards import BULK_COMMIT_SCRIPTS, ShardRouter, ShardWriter, storage_files
 
 SCRIPT_FOLDER = "movie_scripts"
 CHARACTER_CSV = "character_names.csv"
-DB_FILE = "movie_dialogues.db"
+DB_FILE = "movie_dialogues.db"  # Or a shard manifest, see shards.py
 
-def clean_dialogue(dialogue):
-    """Removes unwanted tags, excessive spaces, and strange formatting."""
-    dialogue = re.sub(r"</?b>", "", dialogue)  # Remove <b> tags
-    dialogue = re.sub(r"\s+", " ", dialogue)  # Normalize spaces
-    dialogue = dialogue.replace("\n", " ").strip()  # Remove newlines
-    return dialogue
+script_source = None
 
-def extract_dialogues(script_file, character_names):
+def read_script(script_name):
+    """Script text from movie_scripts/ or the packed script store, or None if neither has it."""
+    global script_source
+    if script_source is None:
+        script_source = ScriptSource(SCRIPT_FOLDER, SCRIPT_STORE_DIR)
+    return script_source.read(script_name)
+
+def extract_dialogue_lines(script_text, character_names):
     """
-    Extracts all dialogues for each character in a script file.
-    Returns a dictionary {character: [list of dialogues]}.
+    Extracts every dialogue line in a script, in script order.
+    Returns a list of (character, line_no, dialogue) tuples.
     """
-    dialogues = defaultdict(list)
-
-    with open(script_file, "r", encoding="utf-8") as file:
-        script_text = file.read()
-
-    # Parse the script with BeautifulSoup to remove HTML-like tags
-    soup = BeautifulSoup(script_text, "html.parser")
-    cleaned_text = soup.get_text()
-
-    # Regex pattern to match character dialogues
-    dialogue_pattern = re.compile(r"\b(" + "|".join(re.escape(name) for name in character_names) + r")\b\s*(.*?)(?=\n\n|\n<b>|$)", re.DOTALL)
-
-    # Find all matches
-    matches = dialogue_pattern.findall(cleaned_text)
-
-    for character, dialogue in matches:
-        cleaned_dialogue = clean_dialogue(dialogue)
-        if cleaned_dialogue:
-            dialogues[character].append(cleaned_dialogue)
+    # Speaker blocks are found from the <b> cues in one pass, see screenplay_parser
+    return list(parse_screenplay(script_text, character_names))
 
-    return dialogues
+def extract_dialogues(script_text, character_names):
+    """
+    Extracts all dialogues for each character in a script.
+    Returns a dictionary {character: [list of dialogues]}.
+    """
+    return group_by_character(extract_dialogue_lines(script_text, character_names))
 
 def create_database():
-    """Creates SQLite database and table if not exists."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS movie_dialogues (
-        script_name TEXT NOT NULL,
-        character_name TEXT NOT NULL,
-        dialogues TEXT NOT NULL,
-        PRIMARY KEY (script_name, character_name)
-    )
-    """)
-    
-    conn.commit()
-    conn.close()
-
-def insert_into_database(script_name, character_name, dialogues):
-    """Inserts or updates character dialogues into SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    # Convert list of dialogues into a single text entry
-    dialogues_text = " | ".join(dialogues)
-
-    cursor.execute("""
-    INSERT INTO movie_dialogues (script_name, character_name, dialogues) 
-    VALUES (?, ?, ?)
-    ON CONFLICT(script_name, character_name) DO UPDATE SET dialogues=excluded.dialogues
-    """, (script_name, character_name, dialogues_text))
-
-    conn.commit()
-    conn.close()
-
-def process_scripts():
-    """Reads character names from CSV, extracts dialogues from scripts, and stores results in SQLite DB."""
-    create_database()
-
-    # Read character names from CSV
+    """Creates the SQLite tables (in every shard of a sharded store) if they don't exist."""
+    for path in storage_files(DB_FILE):
+        conn = sqlite3.connect(path)
+        # The per-character blobs, plus one row per spoken line with an FTS5 index for lookups
+        create_dialogue_tables(conn)
+        conn.commit()
+        conn.close()
+
+def read_script_jobs():
+    """Yields (script_name, character_names) for every row of the character CSV."""
     with open(CHARACTER_CSV, mode="r", encoding="utf-8") as file:
         reader = csv.reader(file)
         next(reader)  # Skip header row
 
         for row in reader:
             script_name, character_list = row
-            character_names = character_list.split(", ")
+            yield script_name, character_list.split(", ")
+
+def group_by_character(lines):
+    """{character: [dialogues]} from (character, line_no, dialogue) tuples."""
+    dialogues = defaultdict(list)
+    for character, _, dialogue in lines:
+        dialogues[character].append(dialogue)
+    return dialogues
 
-            script_file = os.path.join(SCRIPT_FOLDER, script_name)
-            if os.path.exists(script_file):
+def report_throughput(scripts, rows, start_time):
+    elapsed = time.perf_counter() - start_time
+    print(f"✅ {scripts} scripts, {rows} rows in {elapsed:.2f}s "
+          f"({scripts / elapsed:.1f} scripts/sec, {rows / elapsed:.0f} rows/sec)")
+
+def process_scripts():
+    """Reads character names from CSV, extracts dialogues from scripts, and stores results in SQLite DB."""
+    create_database()
+    start_time = time.perf_counter()
+    scripts = rows = 0
+
+    # Each script is committed on its own, as soon as its shards have written it
+    with ShardWriter(DB_FILE) as writer:
+        for script_name, character_names in read_script_jobs():
+            script_text = read_script(script_name)
+            if script_text is not None:
                 print(f"Processing {script_name}...")
-                dialogues = extract_dialogues(script_file, character_names)
+                lines = extract_dialogue_lines(script_text, character_names)
+                writer.write_script(script_name, lines)
 
-                # Insert into database
-                for character, dialogue_list in dialogues.items():
-                    insert_into_database(script_name, character, dialogue_list)
+                scripts += 1
+                rows += len(group_by_character(lines)) + len(lines)
             else:
                 print(f"Script file {script_name} not found.")
 
-def search_dialogue(keyword):
-    """Searches for a keyword in dialogues across all scripts and characters."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    report_throughput(scripts, rows, start_time)
+
+def parse_script(job):
+    """Process-pool worker: (script_name, lines), with lines None if the file is missing or unreadable."""
+    script_name, character_names = job
+    try:
+        script_text = read_script(script_name)
+        if script_text is None:
+            return script_name, None
+        return script_name, extract_dialogue_lines(script_text, character_names)
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"⚠️ Could not parse {script_name}: {e}")
+        return script_name, None
+
+def bulk_ingest(workers=None, commit_every=BULK_COMMIT_SCRIPTS):
+    """
+    Same result as process_scripts, built for a full load: scripts are parsed
+    on a process pool and stored by one writer thread per shard (see
+    shards.ShardWriter) with executemany, committing every commit_every
+    scripts. Each shard's FTS index is rebuilt once at the end instead of
+    being updated row by row. synchronous=OFF is only safe because a crashed
+    load is simply re-run.
+    """
+    create_database()
+    start_time = time.perf_counter()
+    scripts = rows = 0
+
+    with ShardWriter(DB_FILE, bulk=True, commit_every=commit_every) as writer, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        # Results arrive in CSV order while later scripts are still being parsed
+        for script_name, lines in executor.map(parse_script, read_script_jobs(), chunksize=8):
+            if lines is None:
+                print(f"Script file {script_name} not found.")
+                continue
+
+            writer.write_script(script_name, lines)
 
-    keyword = f"%{keyword}%"  # Prepare for SQL LIKE query
-    cursor.execute("""
-    SELECT script_name, character_name, dialogues 
-    FROM movie_dialogues 
-    WHERE dialogues LIKE ?
-    """, (keyword,))
+            scripts += 1
+            rows += len(group_by_character(lines)) + len(lines)
+            if scripts % commit_every == 0:
+                print(f"Stored {scripts} scripts...")
+        print("Rebuilding the full-text index...")
 
-    results = cursor.fetchall()
-    conn.close()
+    report_throughput(scripts, rows, start_time)
 
-    return results
+def search_dialogue(keyword):
+    """Searches for a keyword in dialogues across all scripts, characters and shards."""
+    router = ShardRouter(DB_FILE, persistent=False)
+    try:
+        return router.search_dialogue(keyword)
+    finally:
+        router.close()
 
 if __name__ == "__main__":
-    process_scripts()
+    parser = argparse.ArgumentParser(description="Store character dialogues from the downloaded scripts in SQLite.")
+    parser.add_argument("--bulk", action="store_true", help="parse on all cores and write in large transactions")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes for --bulk (default: CPU count)")
+    parser.add_argument("--db", default=DB_FILE, help="DB file, or a shard manifest from `python shards.py create`")
+    args = parser.parse_args()
+    DB_FILE = args.db
+
+    if args.bulk:
+        bulk_ingest(args.workers)
+    else:
+        process_scripts()
 
     # Example: Search for dialogues containing a specific word
     search_word = "truth"
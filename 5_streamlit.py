@@ -1,81 +1,77 @@
 import streamlit as st
-import sqlite3
-import os
-from google import genai
 from dotenv import load_dotenv
+import os
 import time
-import re
-from rapidfuzz import process, fuzz
+from dialogue_lookup import ensure_configured, fetch_dialogue, resolve_character, retrieve_context
+from llm_backend import create_backend
+from metrics import register_snapshot, start_metrics_server, track_llm, track_request
+from prompts import PROMPT_VERSION, build_prompt
+from response_cache import ResponseCache
+from singleflight import SingleFlight
+from startup import Warmup
 
 # Load environment variables
 load_dotenv()
 
-# Google Gemini AI Client
-client = genai.Client(api_key=os.environ['API_KEY'])
-
-# SQLite Database File
-DB_FILE = "movie_dialogues.db"
-
-def clean_text(text):
-    """Removes unwanted characters and formatting from dialogues."""
-    text = re.sub(r"\s+", " ", text)  # Replace multiple spaces/newlines with single space
-    text = text.strip()  # Trim leading/trailing spaces
-    return text
-
-def fetch_dialogue(character, user_message):
-    """Fetches the closest matching dialogue for the character from SQLite."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    # Try to find an **exact** dialogue match first
-    cursor.execute("""
-        SELECT dialogues FROM movie_dialogues
-        WHERE character_name = ? AND dialogues LIKE ?
-        ORDER BY LENGTH(dialogues) ASC
-        LIMIT 1
-    """, (character, f"% {user_message} %"))  # Space-padding ensures better matching
-
-    result = cursor.fetchone()
-
-    # If exact match found, return it
-    if result:
-        conn.close()
-        return clean_text(result[0])
-
-    # If no exact match, perform fuzzy search
-    cursor.execute("SELECT dialogues FROM movie_dialogues WHERE character_name = ?", (character,))
-    all_dialogues = [row[0] for row in cursor.fetchall()]
-    conn.close()
-
-    if all_dialogues:
-        # Use fuzzy matching to find the best match
-        best_match, score, _ = process.extractOne(user_message, all_dialogues, scorer=fuzz.partial_ratio)
-
-        # If match confidence is high enough, return it
-        if score > 80:
-            return clean_text(best_match)
-
-    return None  # No suitable match found
-
-def generate_gemini_response(character, user_message):
+GEMINI_ERROR_RESPONSE = "Sorry, I couldn't generate a response."
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))  # Streamlit has no API of its own to put /metrics on
+
+@st.cache_resource(show_spinner=False)
+def get_llm():
+    """Google Gemini AI Client, created once per Streamlit server so every session shares its per-key quota (LLM_BACKEND=stub for a local fake)."""
+    return create_backend()
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    """Shares the reply cache (and its SQLite tier) with chat.py workers."""
+    return ResponseCache()
+
+@st.cache_resource(show_spinner=False)
+def get_llm_flight():
+    """Sessions asking the same thing at the same time share one Gemini call."""
+    return SingleFlight()
+
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    """Loads the indexes and Gemini clients in the background, so the first page renders without waiting on them."""
+    return Warmup(("dialogue_indexes", ensure_configured), ("llm_clients", getattr(get_llm(), "warm_up", lambda: None)))
+
+@st.cache_resource(show_spinner=False)
+def start_metrics():
+    """Serves the same Prometheus metrics as chat.py on METRICS_PORT, once per Streamlit server."""
+    register_snapshot("startup", start_warmup().snapshot)
+    register_snapshot("response_cache", get_response_cache().snapshot)
+    register_snapshot("singleflight", get_llm_flight().snapshot)
+    if hasattr(get_llm(), "stats"):
+        register_snapshot("llm_key", get_llm().stats, label="key")
+    start_metrics_server(METRICS_PORT)
+
+llm = get_llm()
+response_cache = get_response_cache()
+warmup = start_warmup()
+start_metrics()
+
+def generate_gemini_response(character, user_message, bypass_cache=False):
     """Generates a realistic response using Gemini AI if no exact or close match is found."""
+    response = response_cache.get_or_generate(
+        character, user_message, llm.model, PROMPT_VERSION,
+        lambda: call_gemini(character, user_message),
+        bypass=bypass_cache, flight=get_llm_flight(),
+    )
+    return response if response is not None else GEMINI_ERROR_RESPONSE
+
+def call_gemini(character, user_message):
+    """Calls the Gemini API directly. Returns None on failure so errors are never cached."""
     print(f"⚡ No match found for '{user_message}'. Using Gemini AI...")
 
-    prompt = f"""
-    Act exactly like {character} from the movie script. 
-    Stay in character and respond naturally, as if you were in the scene. 
-    Given this line from another character: "{user_message}", 
-    how would {character} realistically reply based on their personality and speaking style?
-    """
+    prompt = build_prompt(character, user_message, retrieve_context(character, user_message))
 
     try:
-        gemini_api_response = client.models.generate_content(
-            model="gemini-2.0-flash", contents=prompt
-        )
-        return gemini_api_response.text
+        with track_llm():
+            return llm.generate(prompt)
     except Exception as e:
         print(f"❌ Error with Gemini API: {e}")
-        return "Sorry, I couldn't generate a response."
+        return None
 
 # Streamlit UI
 st.set_page_config(page_title="🎭 Movie Character Chatbot", layout="centered")
@@ -90,7 +86,8 @@ or a **realistic AI-generated** response if no match is found.
 
 # Sidebar for character selection
 st.sidebar.header("🎬 Choose Your Character")
-character = st.sidebar.text_input("Enter Character Name", value="JESSEP")
+character = st.sidebar.text_input("Enter Character Name", value="JESSEP", help='Any case; add "in <movie>" if the name is shared')
+bypass_cache = st.sidebar.checkbox("Always generate a fresh AI reply", value=False)
 
 # User message input
 user_message = st.text_input("💬 Your Message")
@@ -100,17 +97,30 @@ if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
 if st.button("Send"):
+    if not warmup.ready.is_set():
+        with st.spinner("Loading the dialogue index..."):
+            warmup.wait()
+    resolution = resolve_character(character) if character else None
     if not character or not user_message:
         st.warning("⚠️ Please enter both a character name and a message!")
+    elif resolution.ambiguous:
+        # No Gemini call for a character we can't pin down
+        report = resolution.ambiguity_report()
+        st.warning(f"⚠️ {report['error']}")
+        for candidate in report["candidates"]:
+            st.markdown(f"- **{candidate['character']}**: {', '.join(candidate['scripts'])}")
     else:
         start_time = time.time()
-        
-        # Check SQLite for stored dialogue
-        response = fetch_dialogue(character, user_message)
+        # A typo's closest stored name is only used for the DB lookup; Gemini plays the name as typed
+        stored_name, character = resolution.character or resolution.query, resolution.reply_name
+
+        with track_request():
+            # Check SQLite for stored dialogue
+            response = fetch_dialogue(stored_name, user_message, resolution.script)
 
-        if not response:
-            # Use Gemini AI if no exact or close match found
-            response = generate_gemini_response(character, user_message)
+            if not response:
+                # Use Gemini AI if no exact or close match found
+                response = generate_gemini_response(character, user_message, bypass_cache)
 
         end_time = time.time()
         response_time = round((end_time - start_time) * 1000, 2)
@@ -0,0 +1,297 @@
+"""
+Maps the character name a client sends ("Jessep", "col. jessep",
+"JESSEP in A Few Good Men") to the character_name stored in the DB.
+
+Stored names are upper case as they appear in the scripts, and every lookup
+tier filters on them exactly. An unresolved "Jessep" therefore missed every
+tier and went to Gemini.
+
+The index is built at startup from all (script, character) pairs. Resolution
+tries, in order:
+
+1. the normalized full name, ignoring case, punctuation and extensions like
+   (V.O.): one dict lookup;
+2. single-word aliases, e.g. "Smith" for AGENT SMITH and MR. SMITH;
+3. a bounded edit-distance search over a trie of all those keys, for typos.
+
+A name that fits several different characters is reported as ambiguous,
+together with the scripts each of them appears in. The client can then scope
+it, as "SMITH in The Matrix" or with a separate "script" field.
+
+    python alias_index.py "agent smith" "Smith in The Matrix"
+"""
+import argparse
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from db_pool import connect_readonly
+from dialogue_schema import has_line_index
+from shards import storage_files
+from screenplay_parser import EXTENSION_PATTERN
+
+DB_FILE = "movie_dialogues.db"
+
+MIN_ALIAS_LENGTH = 3
+# Honorifics and qualifiers that never identify a character on their own
+ALIAS_STOPWORDS = {
+    "mr", "mrs", "ms", "miss", "dr", "doc", "sir", "lady", "lord", "the", "young", "old", "older", "little",
+    "big", "agent", "officer", "detective", "det", "sgt", "sergeant", "lt", "lieutenant", "capt", "captain",
+    "col", "colonel", "gen", "general", "major", "judge", "father", "mother", "uncle", "aunt", "man", "woman",
+}
+MAX_REPORTED_SCRIPTS = 5  # Scripts listed per candidate in an ambiguity report
+
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+SCOPE_PATTERN = re.compile(r"\s+(?:in|from)\s+", re.IGNORECASE)
+TRIE_END = ""  # Child key marking a complete entry; real keys never contain ""
+
+
+def normalize_name(name):
+    """Case-, punctuation- and extension-insensitive key: 'Col. Jessep (V.O.)' -> 'col jessep'."""
+    name = EXTENSION_PATTERN.sub("", name)
+    return NON_WORD_PATTERN.sub(" ", name).strip().casefold()
+
+
+def normalize_script(script_name):
+    """'A Few Good Men.txt' and 'a few good men' share a key."""
+    if script_name.lower().endswith(".txt"):
+        script_name = script_name[:-4]
+    return normalize_name(script_name)
+
+
+def max_edit_distance(key):
+    """Typos tolerated for a key: none for very short names, where one edit is a different name."""
+    if len(key) < 4:
+        return 0
+    return 1 if len(key) <= 6 else 2
+
+
+class NameTrie:
+    """Character trie over normalized keys, searched with a row-by-row Levenshtein DP."""
+
+    def __init__(self, keys=()):
+        self.root = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node[TRIE_END] = key
+
+    def search(self, word, max_distance):
+        """(distance, key) for every key within max_distance edits of word, closest first."""
+        results = []
+        first_row = list(range(len(word) + 1))
+        for char, child in self.root.items():
+            if char != TRIE_END:
+                self._search(child, char, word, first_row, max_distance, results)
+        return sorted(results)
+
+    def _search(self, node, char, word, previous_row, max_distance, results):
+        row = [previous_row[0] + 1]
+        for i in range(1, len(word) + 1):
+            row.append(min(row[i - 1] + 1, previous_row[i] + 1, previous_row[i - 1] + (word[i - 1] != char)))
+
+        if row[-1] <= max_distance and TRIE_END in node:
+            results.append((row[-1], node[TRIE_END]))
+        # No key below this node can get closer than the row's best cell
+        if min(row) <= max_distance:
+            for next_char, child in node.items():
+                if next_char != TRIE_END:
+                    self._search(child, next_char, word, row, max_distance, results)
+
+
+def load_character_scripts(db_file=DB_FILE):
+    """Every distinct (script_name, character_name) pair, from dialogue_lines or the legacy blobs, on every shard."""
+    pairs = {}  # A dict keeps the first-seen order, as DISTINCT does on a single file
+    for path in storage_files(db_file):
+        conn = connect_readonly(path)
+        try:
+            table = "dialogue_lines" if has_line_index(conn) else "movie_dialogues"
+            pairs.update(dict.fromkeys(conn.execute(f"SELECT DISTINCT script_name, character_name FROM {table}")))
+        finally:
+            conn.close()
+    return list(pairs)
+
+
+@dataclass
+class Resolution:
+    """What a requested name resolved to. character is None when it is ambiguous or unknown."""
+    query: str
+    match: str  # exact, alias, fuzzy, ambiguous or unknown
+    character: str = None
+    script: str = None
+    candidates: dict = field(default_factory=dict)  # {stored name: set of scripts}
+
+    @property
+    def ambiguous(self):
+        return self.match == "ambiguous"
+
+    @property
+    def reply_name(self):
+        """
+        The name to play and report: the stored one, but the name as asked after a
+        typo match, which is only a guess that is good enough for the DB tiers.
+        """
+        return self.character if self.match in ("exact", "alias") else self.query
+
+    def ambiguity_report(self):
+        """Client-facing error listing each candidate and a few of its scripts."""
+        candidates = [
+            {"character": character, "scripts": sorted(scripts)[:MAX_REPORTED_SCRIPTS], "num_scripts": len(scripts)}
+            for character, scripts in sorted(self.candidates.items(), key=lambda item: (-len(item[1]), item[0]))
+        ]
+        return {
+            "error": f"'{self.query}' matches {len(candidates)} characters; name one, or add the script "
+                     f"(\"{candidates[0]['character']} in <script>\" or a \"script\" field)",
+            "character": self.query,
+            "candidates": candidates,
+        }
+
+
+class AliasIndex:
+    """Normalized name, alias and typo lookup over every stored character. Call reload() after the DB changes."""
+
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        self.reload()
+
+    def reload(self):
+        """Rebuilds every table from the DB and swaps them in at once."""
+        try:
+            pairs = load_character_scripts(self.db_file)
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Alias index not built from {self.db_file}: {e}")
+            pairs = []
+
+        names = defaultdict(lambda: defaultdict(set))  # key -> {stored name: scripts}
+        aliases = defaultdict(lambda: defaultdict(set))
+        scripts = {}
+        for script_name, character in pairs:
+            key = normalize_name(character)
+            if not key:
+                continue
+            names[key][character].add(script_name)
+            words = key.split()
+            if len(words) > 1:
+                for word in words:
+                    if len(word) >= MIN_ALIAS_LENGTH and word not in ALIAS_STOPWORDS:
+                        aliases[word][character].add(script_name)
+            scripts[normalize_script(script_name)] = script_name
+
+        self._tables = (
+            dict(names), dict(aliases), NameTrie(names.keys() | aliases.keys()), scripts, NameTrie(scripts),
+        )
+
+    def find_script(self, text):
+        """The stored script name a title refers to, allowing for typos, or None."""
+        _, _, _, scripts, script_trie = self._tables
+        key = normalize_script(text)
+        if key in scripts:
+            return scripts[key]
+        matches = script_trie.search(key, max_edit_distance(key))
+        # Only a single closest title counts, otherwise "Alien" could pick "Aliens"
+        if matches and (len(matches) == 1 or matches[0][0] < matches[1][0]):
+            return scripts[matches[0][1]]
+        return None
+
+    def split_scope(self, text):
+        """'JESSEP in A Few Good Men' -> ('JESSEP', 'A Few Good Men.txt'); (text, None) when no script matches."""
+        for separator in SCOPE_PATTERN.finditer(text):
+            script = self.find_script(text[separator.end():])
+            if script is not None:
+                return text[:separator.start()], script
+        return text, None
+
+    def resolve(self, name, script=None):
+        """
+        Resolves a requested name, optionally scoped to a script (a title or stored
+        script name). Without a script, a trailing "in <title>" is used as the scope,
+        unless the whole text already is a stored name or alias ("MAN IN BLACK").
+        """
+        names, aliases, trie, _, _ = self._tables
+        scope = self.find_script(script) if script else None
+        if scope is None:
+            # Stored names can contain " in " or " from " themselves ("MAN IN BLACK"), so the whole text goes first
+            resolution = self._lookup(name, normalize_name(name), None)
+            if resolution is not None:
+                return resolution
+            name, scope = self.split_scope(name)
+        key = normalize_name(name)
+        if not key:
+            return Resolution(name, "unknown", script=scope)
+
+        resolution = self._lookup(name, key, scope)
+        if resolution is not None:
+            return resolution
+
+        # Widen one edit at a time: a distance-1 search only visits a small part of the trie.
+        # All keys at the same distance compete with each other.
+        for distance in range(1, max_edit_distance(key) + 1):
+            found = [other for other_distance, other in trie.search(key, distance) if other_distance == distance]
+            # Like above, a full name beats an alias at the same distance
+            for table in (names, aliases):
+                candidates = defaultdict(set)
+                for other in found:
+                    for character, scripts in self._scoped(table.get(other), scope).items():
+                        candidates[character] |= scripts
+                if candidates:
+                    return self._result(name, "fuzzy", dict(candidates), scope)
+
+        return Resolution(name, "unknown", script=scope)
+
+    def _lookup(self, name, key, scope):
+        """Exact full-name, then alias resolution of a normalized key, or None if neither knows it."""
+        names, aliases, _, _, _ = self._tables
+        for match, table in (("exact", names), ("alias", aliases)):
+            candidates = self._scoped(table.get(key), scope)
+            if candidates:
+                return self._result(name, match, candidates, scope)
+        return None
+
+    @staticmethod
+    def _scoped(candidates, scope):
+        """{stored name: scripts} restricted to one script when scoped."""
+        if not candidates:
+            return {}
+        if scope is None:
+            return candidates
+        return {character: {scope} for character, scripts in candidates.items() if scope in scripts}
+
+    @staticmethod
+    def _result(query, match, candidates, scope):
+        # "Jessep" and "JESSEP" stored separately are one character: use the spelling found in most scripts
+        spellings = {normalize_name(character) for character in candidates}
+        if len(spellings) > 1:
+            return Resolution(query, "ambiguous", script=scope, candidates=candidates)
+        character = min(candidates, key=lambda character: (-len(candidates[character]), character))
+        return Resolution(query, match, character, scope, candidates)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve character names the way /chat does.")
+    parser.add_argument("names", nargs="+")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--script", help="scope every name to this script")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = AliasIndex(args.db)
+    print(f"📦 Built the alias index in {(time.perf_counter() - start) * 1000:.1f}ms")
+    for name in args.names:
+        start = time.perf_counter()
+        resolution = index.resolve(name, args.script)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        if resolution.ambiguous:
+            print(f"⚠️ {name!r}: {resolution.ambiguity_report()['error']} ({elapsed_us:.0f}µs)")
+            for candidate in resolution.ambiguity_report()["candidates"]:
+                print(f"     {candidate['character']}: {', '.join(candidate['scripts'])}")
+        elif resolution.character is None:
+            print(f"❓ {name!r}: no stored character ({elapsed_us:.0f}µs)")
+        else:
+            print(f"✅ {name!r} -> {resolution.character!r} [{resolution.match}]"
+                  f"{f' in {resolution.script}' if resolution.script else ''} ({elapsed_us:.0f}µs)")
@@ -0,0 +1,90 @@
+"""
+Character name resolution latency per tier (exact, case/punctuation variant,
+single-word alias, typo, unknown) on a synthetic cast, plus the index build time.
+Each script has one lead whose surname no other character shares, so "alias"
+queries resolve to one character; "ambiguous" queries use a common surname.
+
+    python benchmarks/bench_alias_index.py --scripts 1000 --queries 2000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from fixtures import percentile
+from alias_index import AliasIndex
+from dialogue_schema import create_schema
+
+FIRST_NAMES = ["JOHN", "MARY", "NEO", "SARAH", "KAFFEE", "RIPLEY", "DALLAS", "MARTY", "ELLIS", "VINCENT", "MIA", "JULES"]
+LAST_NAMES = ["SMITH", "JESSEP", "CONNOR", "MCFLY", "BROWN", "WALLACE", "DEMPSEY", "MARKINSON", "VEGA", "KENDRICK"]
+TITLES = ["", "", "", "MR. ", "DR. ", "COL. ", "AGENT "]
+
+
+def build_cast_db(path, num_scripts, characters_per_script, seed=11):
+    """A dialogue_lines table holding one line per (script, character). Returns the stored names and the leads."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    rows, names, leads = [], set(), []
+    for s in range(num_scripts):
+        lead = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}SON{s}"
+        leads.append(lead)
+        rows.append((f"Synthetic Movie {s:04d}.txt", lead, 0, "A line."))
+        for c in range(1, characters_per_script):
+            name = f"{rng.choice(TITLES)}{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{s % 37 or ''}"
+            names.add(name)
+            rows.append((f"Synthetic Movie {s:04d}.txt", name, c, "A line."))
+    conn.executemany(
+        "INSERT OR IGNORE INTO dialogue_lines (script_name, character_name, line_no, text) VALUES (?, ?, ?, ?)", rows
+    )
+    conn.commit()
+    conn.close()
+    return sorted(names | set(leads)), leads
+
+
+def typo(rng, name):
+    position = rng.randrange(len(name))
+    return name[:position] + name[position + 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scripts", type=int, default=1000)
+    parser.add_argument("--characters", type=int, default=20, help="characters per script")
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "movie_dialogues.db")
+        names, leads = build_cast_db(db_file, args.scripts, args.characters)
+
+        start = time.perf_counter()
+        index = AliasIndex(db_file)
+        print(f"📦 {len(names)} distinct names over {args.scripts} scripts, "
+              f"index built in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+        workloads = {
+            "exact": (names, lambda name: name),
+            "variant": (names, lambda name: name.title().replace(".", "")),
+            "alias": (leads, lambda name: name.split()[-1].lower()),
+            "ambiguous": ([name for name in names if name not in set(leads)], lambda name: name.split()[-1].lower()),
+            "typo": (names, lambda name: typo(rng, name.lower())),
+            "unknown": (names, lambda name: "Nobody Atall"),
+        }
+        print(f"{'tier':<10} {'p50 µs':>8} {'p99 µs':>8}   outcomes")
+        for label, (pool, make_query) in workloads.items():
+            timings, outcomes = [], {}
+            for _ in range(args.queries):
+                query = make_query(rng.choice(pool))
+                start = time.perf_counter()
+                resolution = index.resolve(query)
+                timings.append((time.perf_counter() - start) * 1e6)
+                outcomes[resolution.match] = outcomes.get(resolution.match, 0) + 1
+            print(f"{label:<10} {percentile(timings, 50):8.1f} {percentile(timings, 99):8.1f}   {outcomes}")
+
+
+if __name__ == "__main__":
+    main()
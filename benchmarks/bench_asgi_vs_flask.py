@@ -0,0 +1,112 @@
+"""
+Closed-loop throughput of the Flask app (chat.py) vs the ASGI app
+(chat_asgi.py), both serving a synthetic DB with the stub LLM backend so the
+run is offline and the LLM latency is controlled.
+
+    python benchmarks/bench_asgi_vs_flask.py --concurrency 64 --duration 10 --llm-latency-ms 500
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from fixtures import REPO_ROOT, build_fixture_db, percentile
+
+
+def server_command(kind, port, workers=2):
+    if kind == "flask":
+        command = [sys.executable, "-m", "flask", "--app", os.path.join(REPO_ROOT, "chat.py"),
+                   "run", "--port", str(port), "--no-reload", "--no-debugger"]
+    elif kind == "prefork":
+        command = [sys.executable, os.path.join(REPO_ROOT, "prefork.py"), "--host", "127.0.0.1",
+                   "--port", str(port), "--workers", str(workers), "--report-interval", "0"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "chat_asgi:app", "--app-dir", REPO_ROOT,
+                   "--port", str(port), "--log-level", "warning", "--no-access-log"]
+    return command
+
+
+def start_server(kind, port, cwd, env, workers=2):
+    """Starts a server and returns once its /ready answers 200."""
+    process = subprocess.Popen(server_command(kind, port, workers), cwd=cwd, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not come up on port {port}")
+
+
+def closed_loop(url, workload, concurrency, duration):
+    """Each client sends its next request as soon as the previous one returns."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.time() < stop_at:
+            payload = rng.choice(workload)
+            start = time.perf_counter()
+            try:
+                ok = session.post(url, json=payload, timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--llm-latency-ms", type=float, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = build_fixture_db(os.path.join(tmp, "movie_dialogues.db"), num_scripts=10)
+        # Every request misses the DB and the cache, so each one waits on the (stub) LLM
+        workload = [
+            {"character": character, "user_message": f"zzz unmatched question {i}", "cache": False}
+            for i, (_, character, _) in enumerate(corpus[:200])
+        ]
+        env = dict(os.environ, LLM_BACKEND="stub", STUB_LLM_LATENCY_MS=str(args.llm_latency_ms),
+                   STUB_LLM_JITTER_MS="0", API_KEY="unused", MAX_INFLIGHT_LLM=str(args.concurrency * 2))
+
+        for kind, port in (("flask", 5301), ("asgi", 5302)):
+            server = start_server(kind, port, tmp, env)
+            try:
+                latencies, errors = closed_loop(f"http://127.0.0.1:{port}/chat", workload, args.concurrency, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{kind:>5}: {len(latencies) / args.duration:7.1f} req/s | p50 {percentile(latencies, 50):7.1f} ms | "
+                  f"p99 {percentile(latencies, 99):7.1f} ms | errors {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Compares fetch_dialogue latency with a fresh connection per call vs the pooled
+read-only connections, then checks that chat.py behind a threaded werkzeug
+server (a new thread per request) keeps the pool bounded.
+
+    python benchmarks/bench_db_pool.py --requests 2000
+    python benchmarks/bench_db_pool.py --requests 2000 --clients 16
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from fixtures import build_fixture_db, percentile
+
+import dialogue_lookup
+from db_pool import POOL_SIZE
+from shards import ShardRouter
+
+
+def build_workload(corpus, num_requests, seed=11):
+    """Half exact hits (a word run from a stored line), half misses that fall through to fuzzy."""
+    rng = random.Random(seed)
+    workload = []
+    for i in range(num_requests):
+        _, character, lines = rng.choice(corpus)
+        if i % 2 == 0:
+            words = rng.choice(lines).rstrip(".").split()
+            start = rng.randrange(1, max(2, len(words) - 2))
+            message = " ".join(words[start:start + 2])
+        else:
+            message = "completely unrelated question about the weather"
+        workload.append((character, message))
+    return workload
+
+
+def run(router, workload):
+    dialogue_lookup.router = router
+    timings = []
+    for character, message in workload:
+        start = time.perf_counter()
+        dialogue_lookup.fetch_dialogue(character, message)
+        timings.append((time.perf_counter() - start) * 1000)
+    router.close()
+    return timings
+
+
+def check_threaded_server(tmp, workload, clients):
+    """Sends the workload through chat.app on a threaded server; returns the pool's connection count."""
+    from werkzeug.serving import make_server
+
+    os.environ.setdefault("LLM_BACKEND", "stub")
+    os.environ.setdefault("STUB_LLM_LATENCY_MS", "0")
+    os.environ.setdefault("STUB_LLM_JITTER_MS", "0")
+    # chat.py keeps its response cache in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    try:
+        import chat
+
+        server = make_server("127.0.0.1", 0, chat.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/chat"
+
+        def post(pair):
+            body = json.dumps({"character": pair[0], "user_message": pair[1]}).encode()
+            request = urllib.request.Request(url, body, {"Content-Type": "application/json"})
+            with urllib.request.urlopen(request) as response:
+                response.read()
+
+        with ThreadPoolExecutor(clients) as executor:
+            list(executor.map(post, workload))
+        server.shutdown()
+    finally:
+        os.chdir(cwd)
+    return sum(pool.open_connections() for pool in dialogue_lookup.router.pools)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--scripts", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients against the threaded server")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "movie_dialogues.db")
+        corpus = build_fixture_db(db_file, num_scripts=args.scripts)
+        workload = build_workload(corpus, args.requests)
+        dialogue_lookup.configure(db_file, vector_index_dir=None)
+
+        for label, persistent in (("connect per call", False), ("pooled", True)):
+            timings = run(ShardRouter(db_file, persistent=persistent), workload)
+            print(f"{label:>17}: p50 {percentile(timings, 50):7.3f} ms | p99 {percentile(timings, 99):7.3f} ms")
+
+        dialogue_lookup.router = ShardRouter(db_file)
+        opened = check_threaded_server(tmp, workload, args.clients)
+        print(f"  threaded server: {len(workload)} requests held {opened} connections (limit {POOL_SIZE})")
+        dialogue_lookup.router.close()
+        assert opened <= POOL_SIZE, f"pool grew to {opened} connections, limit is {POOL_SIZE}"
+
+
+if __name__ == "__main__":
+    main()
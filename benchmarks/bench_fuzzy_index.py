@@ -0,0 +1,104 @@
+"""
+Fuzzy-path latency: the old per-request scan (SELECT every blob for the
+character, then extractOne over the raw blobs) vs the preloaded FuzzyIndex,
+with and without the token prefilter, as the per-character corpus grows.
+Two workloads: garbled copies of stored lines, and messages made only of the
+corpus's most common words, whose prefiltered candidates cover much of the
+corpus (the case the index falls back to a full scan for).
+
+    python benchmarks/bench_fuzzy_index.py --queries 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+
+from rapidfuzz import fuzz, process
+
+from fixtures import build_fixture_db, percentile
+from fuzzy_index import FuzzyIndex
+
+
+def legacy_fuzzy(db_file, character, user_message):
+    """The fuzzy half of fetch_dialogue before the index existed."""
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute("SELECT dialogues FROM movie_dialogues WHERE character_name = ?", (character,))
+    all_dialogues = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    if all_dialogues:
+        best_match, score, _ = process.extractOne(user_message, all_dialogues, scorer=fuzz.partial_ratio)
+        if score > 80:
+            return best_match
+    return None
+
+
+def build_queries(corpus, num_queries, seed=5):
+    """Slightly garbled copies of stored lines, so they miss the exact path but should fuzzy-match."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        _, character, lines = rng.choice(corpus)
+        words = rng.choice(lines).rstrip(".").split()
+        words[rng.randrange(len(words))] = "umm"
+        queries.append((character, " ".join(words[:8])))
+    return queries
+
+
+def build_common_queries(corpus, num_queries, seed=6, vocabulary=8):
+    """Messages made of the most common words, so even their rarest tokens match a large share of the lines."""
+    rng = random.Random(seed)
+    counts = Counter(word.strip(".,!?").lower() for _, _, lines in corpus for line in lines for word in line.split())
+    common = [word for word, _ in counts.most_common() if len(word) >= 3][:vocabulary]
+    queries = []
+    for _ in range(num_queries):
+        _, character, _ = rng.choice(corpus)
+        queries.append((character, " ".join(rng.choice(common) for _ in range(rng.randrange(3, 8)))))
+    return queries
+
+
+def time_calls(fn, queries):
+    timings = []
+    for character, message in queries:
+        start = time.perf_counter()
+        fn(character, message)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "movie_dialogues.db")
+        for num_scripts in args.sizes:
+            corpus = build_fixture_db(db_file, num_scripts=num_scripts, characters_per_script=10)
+            lines_per_character = num_scripts * len(corpus[0][2])
+
+            indexed = FuzzyIndex(db_file)
+            unfiltered = FuzzyIndex(db_file, prefilter=False)
+
+            for workload, queries in (
+                ("garbled lines", build_queries(corpus, args.queries)),
+                ("common words", build_common_queries(corpus, args.queries)),
+            ):
+                candidates = [indexed.num_candidates(c, m) for c, m in queries]
+                print(f"\n{lines_per_character} lines per character, {workload}: "
+                      f"{sum(candidates) / len(candidates):.0f} prefiltered candidates on average")
+                for label, fn in (
+                    ("legacy DB scan", lambda c, m: legacy_fuzzy(db_file, c, m)),
+                    ("index, no prefilter", unfiltered.search),
+                    ("index + prefilter", indexed.search),
+                ):
+                    timings = time_calls(fn, queries)
+                    print(f"{label:>20}: p50 {percentile(timings, 50):8.3f} ms | p99 {percentile(timings, 99):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
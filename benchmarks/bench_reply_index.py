@@ -0,0 +1,118 @@
+"""
+Cue -> reply lookup: the MinHash-LSH ReplyIndex vs a rapidfuzz scan over
+all of the character's cues (preloaded and preprocessed, the way the fuzzy
+tier scans lines), as the per-character corpus grows.
+
+Scripts are synthetic screenplays with one small cast, parsed and stored by
+the stage 4 code, so every character collects cues from every script.
+Queries are stored cues with one word changed; both lookups should return
+the reply to the original cue. Reported per size: the LSH candidate set
+against the character's full cue count, p50/p99 latency of each lookup,
+how often each found the intended reply, and how often LSH agreed with the
+scan.
+
+    python benchmarks/bench_reply_index.py --sizes 20 80 320 --queries 300
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+
+from rapidfuzz import fuzz, process, utils
+
+from fixtures import VOCABULARY, build_screenplay, percentile
+from dialogue_schema import create_dialogue_tables, store_script
+from reply_index import SCORE_CUTOFF, ReplyIndex, build_index, load_pairs
+from screenplay_parser import parse_screenplay
+
+CAST = [f"CHARACTER{c:02d}" for c in range(8)]
+
+
+def build_db(db_file, num_scripts, blocks_per_script=300, seed=7):
+    rng = random.Random(seed)
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    conn = sqlite3.connect(db_file)
+    create_dialogue_tables(conn)
+    with conn:
+        for s in range(num_scripts):
+            script_name = f"Synthetic Script {s:04d}.txt"
+            store_script(conn, script_name, list(parse_screenplay(build_screenplay(rng, CAST, blocks_per_script), CAST)))
+    conn.close()
+
+
+def build_queries(pairs, num_queries, seed=5):
+    """(character, garbled cue, reply id of the original cue)."""
+    rng = random.Random(seed)
+    queries = []
+    for character, cue, reply_id in rng.sample(pairs, num_queries):
+        words = cue.split()
+        words[rng.randrange(len(words))] = rng.choice(VOCABULARY)
+        queries.append((character, " ".join(words), reply_id))
+    return queries
+
+
+class FullScan:
+    """Every cue per character, preprocessed once; a query scores all of them."""
+
+    def __init__(self, pairs):
+        self.cues = defaultdict(list)
+        self.reply_ids = defaultdict(list)
+        for character, cue, reply_id in pairs:
+            self.cues[character].append(utils.default_process(cue))
+            self.reply_ids[character].append(reply_id)
+
+    def search(self, user_message, character):
+        best = process.extractOne(utils.default_process(user_message), self.cues[character],
+                                  scorer=fuzz.token_sort_ratio, processor=None, score_cutoff=SCORE_CUTOFF)
+        return None if best is None else (self.reply_ids[character][best[2]], best[1])
+
+
+def time_lookups(search, queries):
+    timings, results = [], []
+    for character, message, _ in queries:
+        start = time.perf_counter()
+        results.append(search(message, character))
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 80, 320], help="scripts per run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "movie_dialogues.db")
+        index_dir = os.path.join(tmp, "reply_index")
+        for num_scripts in args.sizes:
+            build_db(db_file, num_scripts)
+            build_index(db_file, index_dir)
+            pairs = load_pairs(db_file)
+            queries = build_queries(pairs, min(args.queries, len(pairs)))
+            index, scan = ReplyIndex(index_dir), FullScan(pairs)
+
+            candidates = [len(index.candidates(message, character)) for character, message, _ in queries]
+            cues_per_character = [len(index.character_rows(character)) for character, _, _ in queries]
+            print(f"\n{num_scripts} scripts: {len(pairs)} pairs, {sum(cues_per_character) / len(queries):.0f} cues "
+                  f"per character | LSH candidates p50 {percentile(candidates, 50):.0f}, "
+                  f"p99 {percentile(candidates, 99):.0f}")
+
+            results = {}
+            for label, search in (("rapidfuzz full scan", scan.search), ("MinHash-LSH", index.search)):
+                timings, results[label] = time_lookups(search, queries)
+                found = sum(result is not None and result[0] == reply_id
+                            for result, (_, _, reply_id) in zip(results[label], queries))
+                print(f"{label:>20}: p50 {percentile(timings, 50):8.3f} ms | p99 {percentile(timings, 99):8.3f} ms | "
+                      f"intended reply {found / len(queries):6.1%}")
+            agree = sum((a[0] if a else None) == (b[0] if b else None)
+                        for a, b in zip(results["rapidfuzz full scan"], results["MinHash-LSH"]))
+            print(f"{'agreement':>20}: {agree / len(queries):.1%} of lookups return the same reply")
+
+
+if __name__ == "__main__":
+    main()
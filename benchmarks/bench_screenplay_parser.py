@@ -0,0 +1,94 @@
+"""
+Script parsing throughput: the BeautifulSoup + name-alternation regex that
+stage 4 used to run vs the single-pass screenplay_parser, in MB/s.
+
+Runs over movie_scripts/ and character_names.csv when they exist (run from
+the repo root after stage 3), otherwise over synthetic scripts.
+
+    python benchmarks/bench_screenplay_parser.py
+    python benchmarks/bench_screenplay_parser.py --synthetic 100
+"""
+import argparse
+import csv
+import os
+import random
+import re
+import time
+
+from bs4 import BeautifulSoup
+
+from fixtures import build_screenplay
+from screenplay_parser import parse_screenplay
+
+
+def legacy_extract_dialogue_lines(script_text, character_names):
+    """extract_dialogue_lines as it was before screenplay_parser."""
+    soup = BeautifulSoup(script_text, "html.parser")
+    cleaned_text = soup.get_text()
+    dialogue_pattern = re.compile(r"\b(" + "|".join(re.escape(name) for name in character_names) + r")\b\s*(.*?)(?=\n\n|\n<b>|$)", re.DOTALL)
+
+    lines = []
+    for character, dialogue in dialogue_pattern.findall(cleaned_text):
+        dialogue = re.sub(r"</?b>", "", dialogue)
+        dialogue = re.sub(r"\s+", " ", dialogue)
+        dialogue = dialogue.replace("\n", " ").strip()
+        if dialogue:
+            lines.append((character, len(lines), dialogue))
+    return lines
+
+
+def load_scripts(script_folder, character_csv, limit):
+    """[(script_text, character_names)] for the scraped scripts that have a cast list."""
+    scripts = []
+    with open(character_csv, mode="r", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        next(reader)
+        for script_name, character_list in reader:
+            script_file = os.path.join(script_folder, script_name)
+            names = [name for name in character_list.split(", ") if name]
+            if names and os.path.exists(script_file):
+                with open(script_file, "r", encoding="utf-8") as script:
+                    scripts.append((script.read(), names))
+            if limit and len(scripts) >= limit:
+                break
+    return scripts
+
+
+def synthetic_scripts(count, seed=11):
+    rng = random.Random(seed)
+    scripts = []
+    for s in range(count):
+        names = [f"CHARACTER{s:03d}{c:02d}" for c in range(rng.randint(10, 60))]
+        scripts.append((build_screenplay(rng, names), names))
+    return scripts
+
+
+def measure(label, parse, scripts):
+    megabytes = sum(len(text.encode("utf-8")) for text, _ in scripts) / 1e6
+    start = time.perf_counter()
+    records = sum(len(list(parse(text, names))) for text, names in scripts)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>20}: {megabytes / elapsed:7.2f} MB/s | {records} records | {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scripts", default="movie_scripts")
+    parser.add_argument("--characters", default="character_names.csv")
+    parser.add_argument("--limit", type=int, default=0, help="parse at most this many real scripts")
+    parser.add_argument("--synthetic", type=int, default=0, help="use this many synthetic scripts instead")
+    args = parser.parse_args()
+
+    if not args.synthetic and os.path.isdir(args.scripts) and os.path.exists(args.characters):
+        scripts = load_scripts(args.scripts, args.characters, args.limit)
+    else:
+        scripts = synthetic_scripts(args.synthetic or 50)
+
+    size = sum(len(text) for text, _ in scripts) / 1e6
+    print(f"{len(scripts)} scripts, {size:.1f} MB")
+    measure("legacy regex", legacy_extract_dialogue_lines, scripts)
+    measure("screenplay_parser", parse_screenplay, scripts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Cold-start cost of the servers, on a loadgen fixture DB with the stub LLM.
+
+- import: `python -X importtime -c "import chat"`, total and the heaviest
+  modules chat.py imports directly;
+- per server: time until the port accepts connections, until /ready answers
+  200, and until the first /chat reply (sent as soon as the port is open, so
+  it waits on the warm-up). "cold" runs start with no corpus snapshot on
+  disk, "warm" runs map the one the previous run left.
+
+    python benchmarks/bench_startup.py --servers flask asgi --runs 3 --scripts 200
+    python benchmarks/bench_startup.py --json startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench_asgi_vs_flask import server_command
+from fixtures import REPO_ROOT
+from loadgen import SERVER_PORTS, prepare_fixture
+
+STARTUP_TIMEOUT = 120.0
+POLL_INTERVAL = 0.01
+
+
+def import_profile(module, env, top=8):
+    """(total ms, [(module, cumulative ms), ...]) for importing module, heaviest direct imports first."""
+    # The warm-up's own imports would interleave with (and shift the nesting of) the ones measured here
+    code = f"import startup; startup.Warmup._run = lambda self: None; import {module}"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    total, children, pending = None, [], []
+    # "import time: self [us] | cumulative | imported package", nested two spaces per level.
+    # A module's line comes after its imports', so the depth 1 lines since the last top-level one are its own
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                total, children = int(cumulative) / 1000, pending
+            pending = []
+        elif depth == 1:
+            pending.append((name.strip(), int(cumulative) / 1000))
+    return total, sorted(children, key=lambda child: -child[1])[:top]
+
+
+def port_open(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def measure_start(kind, port, cwd, env, workers, payload):
+    """{listen_ms, ready_ms, first_reply_ms, steps_ms} for one start of a server."""
+    start = time.perf_counter()
+    process = subprocess.Popen(server_command(kind, port, workers), cwd=cwd, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    timings = {}
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not port_open(port):
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"{kind} server did not start listening on port {port}")
+            time.sleep(POLL_INTERVAL)
+        timings["listen_ms"] = (time.perf_counter() - start) * 1000
+
+        def first_reply():
+            response = requests.post(f"http://127.0.0.1:{port}/chat", json=payload, timeout=STARTUP_TIMEOUT)
+            if response.status_code == 200:
+                timings["first_reply_ms"] = (time.perf_counter() - start) * 1000
+
+        chat = threading.Thread(target=first_reply)
+        chat.start()
+        while time.monotonic() < deadline:
+            try:
+                response = requests.get(f"http://127.0.0.1:{port}/ready", timeout=1)
+                if response.status_code == 200:
+                    timings["ready_ms"] = (time.perf_counter() - start) * 1000
+                    timings["steps_ms"] = response.json().get("steps_ms")
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(POLL_INTERVAL)
+        chat.join()
+    finally:
+        process.terminate()
+        process.wait()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", nargs="+", choices=sorted(SERVER_PORTS), default=["flask", "asgi"])
+    parser.add_argument("--workers", type=int, default=2, help="worker processes for prefork")
+    parser.add_argument("--runs", type=int, default=3, help="starts per server and mode")
+    parser.add_argument("--scripts", type=int, default=200, help="fixture size")
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args()
+
+    env = dict(os.environ, LLM_BACKEND="stub", STUB_LLM_LATENCY_MS="0", STUB_LLM_JITTER_MS="0", API_KEY="unused")
+    env.pop("CORPUS_SNAPSHOT_ROOT", None)
+
+    total, heaviest = import_profile("chat", env)
+    print(f"📦 import chat: {total:.0f}ms")
+    for name, ms in heaviest:
+        print(f"   {name:<24} {ms:7.1f}ms")
+
+    results = {"import_ms": total, "heaviest_imports_ms": dict(heaviest), "servers": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = prepare_fixture(tmp, args.scripts)
+        _, character, lines = corpus[0]
+        payload = {"character": character, "user_message": lines[0]}  # Answered from the DB, not the LLM
+
+        for kind in args.servers:
+            results["servers"][kind] = {}
+            for mode in ("cold", "warm"):
+                runs = []
+                for _ in range(args.runs):
+                    if mode == "cold":
+                        shutil.rmtree(os.path.join(tmp, "corpus_snapshot"), ignore_errors=True)
+                    runs.append(measure_start(kind, SERVER_PORTS[kind], tmp, env, args.workers, payload))
+                results["servers"][kind][mode] = runs
+                # Best of the runs: the least disturbed by whatever else the machine was doing
+                best = {key: min(run.get(key, float("inf")) for run in runs)
+                        for key in ("listen_ms", "ready_ms", "first_reply_ms")}
+                print(f"{kind:>7} {mode}: listen {best['listen_ms']:7.0f}ms | ready {best['ready_ms']:7.0f}ms | "
+                      f"first reply {best['first_reply_ms']:7.0f}ms | steps {runs[-1].get('steps_ms')}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"✅ Saved results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
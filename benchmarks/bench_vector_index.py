@@ -0,0 +1,59 @@
+"""
+Recall vs latency of IVF search against exact brute force on a synthetic corpus.
+
+    python benchmarks/bench_vector_index.py --scripts 100 --queries 200
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from fixtures import build_fixture_db, percentile, random_line
+from dialogue_schema import migrate_from_movie_dialogues
+from vector_index import VectorIndex, build_index
+
+
+def timed_search(index, queries, k, **kwargs):
+    results, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append({line_id for line_id, _ in index.search(query, k=k, **kwargs)})
+        timings.append((time.perf_counter() - start) * 1000)
+    return results, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scripts", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    rng = random.Random(19)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "movie_dialogues.db")
+        build_fixture_db(db_file, num_scripts=args.scripts)
+        conn = sqlite3.connect(db_file)
+        num_lines = migrate_from_movie_dialogues(conn)
+        conn.close()
+
+        index_dir = os.path.join(tmp, "vector_index")
+        build_index(db_file, index_dir, nlist=int(math.sqrt(num_lines)))
+        index = VectorIndex(index_dir)
+        queries = [random_line(rng) for _ in range(args.queries)]
+
+        truth, timings = timed_search(index, queries, args.k, exact=True)
+        print(f"{'brute force':>12}: recall@{args.k} 1.000 | p50 {percentile(timings, 50):7.3f} ms | p99 {percentile(timings, 99):7.3f} ms")
+
+        for nprobe in args.nprobe:
+            found, timings = timed_search(index, queries, args.k, nprobe=nprobe)
+            recall = sum(len(f & t) for f, t in zip(found, truth)) / max(1, sum(len(t) for t in truth))
+            print(f"{'nprobe ' + str(nprobe):>12}: recall@{args.k} {recall:.3f} | p50 {percentile(timings, 50):7.3f} ms | p99 {percentile(timings, 99):7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
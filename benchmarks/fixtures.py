@@ -0,0 +1,102 @@
+import os
+import random
+import sqlite3
+import sys
+
+# Benchmarks import the top-level modules (chat.py, db_pool.py, ...) directly
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+WORDS = (
+    "truth handle you can't the we live in a world that has walls and those walls "
+    "have to be guarded by men with guns who's gonna do it lieutenant weinberg "
+    "I have a greater responsibility than you could possibly fathom colonel order "
+    "code red did you sir court marine base cuba santiago sleep under blanket "
+    "freedom provide then question manner which provide rather just said thank"
+).split()
+
+
+SYLLABLES = ["ka", "ro", "mi", "ten", "sha", "lu", "ver", "do", "qui", "na", "bel", "tor", "ex", "pa", "gri"]
+
+
+def build_vocabulary(size=3000, seed=3):
+    """Real script words first, then pronounceable filler, so frequencies follow a Zipf-like curve."""
+    rng = random.Random(seed)
+    vocabulary = list(dict.fromkeys(WORDS))
+    while len(vocabulary) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in vocabulary:
+            vocabulary.append(word)
+    return vocabulary
+
+
+VOCABULARY = build_vocabulary()
+ZIPF_WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+
+def random_line(rng, min_words=4, max_words=18):
+    """Builds one synthetic dialogue line from the shared vocabulary."""
+    words = rng.choices(VOCABULARY, weights=ZIPF_WEIGHTS, k=rng.randint(min_words, max_words))
+    return " ".join(words).capitalize() + "."
+
+
+def build_fixture_db(path, num_scripts=50, characters_per_script=20, lines_per_character=40, seed=7):
+    """
+    Writes a synthetic movie_dialogues.db in the same shape stage 4 produces.
+    Returns a list of (script_name, character_name, [lines]) for building workloads.
+    """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("""
+    CREATE TABLE movie_dialogues (
+        script_name TEXT NOT NULL,
+        character_name TEXT NOT NULL,
+        dialogues TEXT NOT NULL,
+        PRIMARY KEY (script_name, character_name)
+    )
+    """)
+
+    corpus = []
+    for s in range(num_scripts):
+        script_name = f"Synthetic Script {s:04d}.txt"
+        for c in range(characters_per_script):
+            character_name = f"CHARACTER{c:02d}"
+            lines = [random_line(rng) for _ in range(lines_per_character)]
+            corpus.append((script_name, character_name, lines))
+
+    conn.executemany(
+        "INSERT INTO movie_dialogues (script_name, character_name, dialogues) VALUES (?, ?, ?)",
+        ((script, character, " | ".join(lines)) for script, character, lines in corpus),
+    )
+    conn.commit()
+    conn.close()
+    return corpus
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def build_screenplay(rng, character_names, num_blocks=2000):
+    """A synthetic script page in the <pre>/<b> layout stage 2 saves, with action lines that mention the cast."""
+    parts = ["<html><head><title>Synthetic Script</title></head><body>\n<pre>\n"]
+    for block in range(num_blocks):
+        if block % 12 == 0:
+            parts.append(f"<b>                          INT. {rng.choice(VOCABULARY).upper()} - NIGHT</b>\n\n")
+            parts.append(f"          {rng.choice(character_names).title()} waits while {random_line(rng).lower()}\n\n")
+        parts.append(f"<b>                    {rng.choice(character_names)}</b>\n")
+        if rng.random() < 0.15:
+            parts.append("               (beat)\n")
+        for _ in range(rng.randint(1, 4)):
+            parts.append(f"          {random_line(rng, 3, 9)}\n")
+        parts.append("\n")
+    parts.append("</pre>\n</body></html>\n")
+    return "".join(parts)
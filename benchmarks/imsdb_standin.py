@@ -0,0 +1,149 @@
+"""
+Local stand-in for imsdb.com, for exercising stages 1 and 2 without the network.
+
+Serves the two layouts the scrapers parse:
+- /alphabetical/<letter>: the index table. The links sit in the 74th cell of
+  the 4th row, as stage 1 expects.
+- /scripts/<Title>.html: a script page whose <pre> block is a synthetic
+  screenplay.
+
+Script pages carry an ETag and Last-Modified and answer conditional GETs with
+304. Latency and a rate of transient 503s can be injected. GET /_stats
+returns request counters.
+
+    python benchmarks/imsdb_standin.py --port 8800 --titles 200
+    IMSDB_URL=http://127.0.0.1:8800 python 1_moviescraper_index.py
+    python 2_moviescraper_script_parallelized.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from fixtures import build_screenplay
+
+LAST_MODIFIED = formatdate(1700000000, usegmt=True)
+
+
+def build_catalog(num_titles, seed=13):
+    """{url slug: (title, page html, etag)} for num_titles synthetic movies spread over A-Z."""
+    rng = random.Random(seed)
+    catalog = {}
+    for i in range(num_titles):
+        title = f"{chr(ord('A') + i % 26)} Synthetic Movie {i:04d}"
+        names = [f"SPEAKER{i:04d}{c:02d}" for c in range(rng.randint(5, 25))]
+        page = (
+            "<html><head><title>" + title + " Script at IMSDb.</title></head><body>\n"
+            "<table><tr><td class=\"scrtext\">\n"
+            + build_screenplay(rng, names, num_blocks=rng.randint(200, 800)).split("<body>\n", 1)[1].split("</body>", 1)[0]
+            + "</td></tr></table>\n</body></html>\n"
+        )
+        etag = '"' + hashlib.md5(page.encode("utf-8")).hexdigest() + '"'
+        catalog["-".join(title.split(" "))] = (title, page, etag)
+    return catalog
+
+
+def alphabetical_page(catalog, letter):
+    """Index page for one letter, with the same table shape imsdb uses."""
+    links = "".join(
+        f'<p><a href="/Movie Scripts/{title} Script.html" title="{title} Script">{title}</a> (2020-01-01)<br></p>\n'
+        for title, _, _ in catalog.values() if title.startswith(letter)
+    )
+    filler_rows = "".join(f"<tr><td>row {i}</td></tr>" for i in range(3))
+    cells = "".join(f"<td>{i}</td>" for i in range(73))
+    return f"<html><body><table>{filler_rows}<tr>{cells}<td>{links}</td></tr></table></body></html>"
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real site
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        path = unquote(self.path)
+        with server.stats_lock:
+            server.stats["requests"] += 1
+
+        if path == "/_stats":
+            with server.stats_lock:
+                body = json.dumps(server.stats).encode("utf-8")
+            return self._send(200, body, [("Content-Type", "application/json")])
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if path.startswith("/alphabetical/"):
+            page = alphabetical_page(server.catalog, path.rsplit("/", 1)[1][:1].upper())
+            return self._send(200, page.encode("utf-8"), [("Content-Type", "text/html; charset=utf-8")])
+
+        if path.startswith("/scripts/") and path.endswith(".html"):
+            entry = server.catalog.get(path[len("/scripts/"):-len(".html")])
+            if entry is None:
+                return self._send(404, b"Not Found")
+            if server.rng.random() < server.fail_rate:
+                with server.stats_lock:
+                    server.stats["failures"] += 1
+                return self._send(503, b"Busy", [("Retry-After", "0")])
+
+            _, page, etag = entry
+            validators = [("ETag", etag), ("Last-Modified", LAST_MODIFIED)]
+            if self.headers.get("If-None-Match") == etag:
+                with server.stats_lock:
+                    server.stats["not_modified"] += 1
+                return self._send(304, headers=validators)
+
+            with server.stats_lock:
+                server.stats["full_responses"] += 1
+            return self._send(200, page.encode("utf-8"), [("Content-Type", "text/html; charset=utf-8")] + validators)
+
+        self._send(404, b"Not Found")
+
+
+def start_standin(num_titles=100, port=0, latency_ms=0, fail_rate=0.0):
+    """Starts the stand-in on a background thread. Returns (server, base_url); stop with server.shutdown()."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandinHandler)
+    server.daemon_threads = True
+    server.catalog = build_catalog(num_titles)
+    server.latency = latency_ms / 1000
+    server.fail_rate = fail_rate
+    server.rng = random.Random(17)
+    server.stats = {"requests": 0, "full_responses": 0, "not_modified": 0, "failures": 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--titles", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of script requests answered with 503")
+    args = parser.parse_args()
+
+    server, base_url = start_standin(args.titles, args.port, args.latency_ms, args.fail_rate)
+    print(f"✅ imsdb stand-in with {args.titles} scripts at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
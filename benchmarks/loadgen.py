@@ -0,0 +1,301 @@
+"""
+Offline load generator for the /chat API. It replays a mix of requests that
+hit the exact tier, hit the fuzzy tier, or miss the DB and go to the LLM. The
+server runs on a synthetic fixture DB with the stub LLM backend, so runs are
+repeatable and cost no quota.
+
+- closed loop: --concurrency clients, each sending its next request as soon
+  as the previous one returns (measures capacity);
+- open loop: requests arrive as a Poisson process at --rate req/s whether or
+  not earlier ones finished. Latency counts from the scheduled send time, so
+  queueing shows up in the percentiles instead of silently lowering the
+  offered load.
+
+Reports throughput and p50/p95/p99 per request kind. --json saves the run;
+--compare prints the change against a saved run.
+
+    python benchmarks/loadgen.py --server asgi --mode closed --concurrency 32 --duration 10
+    python benchmarks/loadgen.py --server flask --mode open --rate 200 --json after.json --compare before.json
+    python benchmarks/loadgen.py --server prefork --workers 4    (also reports each worker's RSS/PSS)
+    python benchmarks/loadgen.py --url http://127.0.0.1:5000/chat     (an already running server)
+    python benchmarks/loadgen.py --server asgi --latency-mode --llm-slow-rate 0.05 --llm-slow-ms 2000 --llm-keys 2
+                                 (speculative and hedged LLM calls against a stub with a slow tail)
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_asgi_vs_flask import start_server
+from bench_fuzzy_index import build_queries
+from fixtures import build_fixture_db, percentile
+from dialogue_schema import migrate_from_movie_dialogues
+
+DEFAULT_MIX = "exact=0.5,fuzzy=0.3,llm=0.2"
+SERVER_PORTS = {"flask": 5311, "asgi": 5312, "prefork": 5313}
+
+
+def parse_mix(text):
+    """'exact=0.5,fuzzy=0.3,llm=0.2' -> {kind: weight}."""
+    mix = {}
+    for part in text.split(","):
+        kind, weight = part.split("=")
+        if kind not in ("exact", "fuzzy", "llm"):
+            raise ValueError(f"Unknown request kind {kind!r}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def build_workload(corpus, size=2000, seed=9):
+    """{kind: [request body, ...]} drawn from the fixture corpus."""
+    rng = random.Random(seed)
+    exact = []
+    for _ in range(size):
+        _, character, lines = rng.choice(corpus)
+        words = rng.choice(lines).rstrip(".").split()
+        start = rng.randrange(max(1, len(words) - 4))
+        # A run of words from the middle of a stored line: found word for word
+        exact.append({"character": character, "user_message": " ".join(words[start:start + 5])})
+    fuzzy = [{"character": character, "user_message": message} for character, message in build_queries(corpus, size, seed)]
+    # Nothing stored looks like this, and cache=false keeps every one of them going to the LLM
+    llm = [
+        {"character": rng.choice(corpus)[1], "user_message": f"zzz unmatched question {i}", "cache": False}
+        for i in range(size)
+    ]
+    return {"exact": exact, "fuzzy": fuzzy, "llm": llm}
+
+
+class Recorder:
+    """Latencies and errors per request kind, shared by the client threads."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, elapsed_ms, ok):
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(kind, []).append(elapsed_ms)
+            else:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def send(session, url, payload):
+    try:
+        return session.post(url, json=payload, timeout=60).status_code == 200
+    except requests.RequestException:
+        return False
+
+
+def closed_loop(url, workload, mix, concurrency, duration, seed=1):
+    recorder = Recorder()
+    stop_at = time.perf_counter() + duration
+    kinds, weights = list(mix), list(mix.values())
+
+    def client(client_seed):
+        rng = random.Random(client_seed)
+        session = requests.Session()
+        while time.perf_counter() < stop_at:
+            kind = rng.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            ok = send(session, url, rng.choice(workload[kind]))
+            recorder.record(kind, (time.perf_counter() - start) * 1000, ok)
+
+    threads = [threading.Thread(target=client, args=(seed + i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder
+
+
+def open_loop(url, workload, mix, rate, duration, max_outstanding, seed=1):
+    rng = random.Random(seed)
+    recorder = Recorder()
+    kinds, weights = list(mix), list(mix.values())
+    local = threading.local()
+
+    def fire(kind, payload, scheduled):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        ok = send(session, url, payload)
+        recorder.record(kind, (time.perf_counter() - scheduled) * 1000, ok)
+
+    with ThreadPoolExecutor(max_workers=max_outstanding) as executor:
+        start = time.perf_counter()
+        scheduled = start
+        while True:
+            scheduled += rng.expovariate(rate)
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            kind = rng.choices(kinds, weights)[0]
+            executor.submit(fire, kind, rng.choice(workload[kind]), scheduled)
+    return recorder
+
+
+def summarize(recorder, duration):
+    """{kind or 'all': {requests, errors, throughput, p50, p95, p99}}."""
+    summary = {}
+    everything = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    groups = dict(recorder.latencies, all=everything)
+    for kind, latencies in groups.items():
+        errors = sum(recorder.errors.values()) if kind == "all" else recorder.errors.get(kind, 0)
+        summary[kind] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / duration, 2),
+            **{f"p{pct}_ms": round(percentile(latencies, pct), 2) if latencies else None for pct in (50, 95, 99)},
+        }
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    print(f"{'kind':<6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for kind, stats in summary.items():
+        line = (f"{kind:<6} {stats['throughput_rps']:8.1f} {stats['p50_ms'] or math.nan:9.1f} "
+                f"{stats['p95_ms'] or math.nan:9.1f} {stats['p99_ms'] or math.nan:9.1f} {stats['errors']:7d}")
+        before = (baseline or {}).get(kind)
+        if before and before.get("p99_ms") and stats["p99_ms"]:
+            throughput_change = (stats["throughput_rps"] / before["throughput_rps"] - 1) * 100 if before["throughput_rps"] else math.nan
+            p99_change = (stats["p99_ms"] / before["p99_ms"] - 1) * 100
+            line += f"   vs baseline: req/s {throughput_change:+.1f}%, p99 {p99_change:+.1f}%"
+        print(line)
+
+
+def fetch_worker_stats(url):
+    """Per-worker memory and request counts from a prefork.py server, None for the other servers."""
+    try:
+        response = requests.get(url.rsplit("/chat", 1)[0] + "/workers/stats", timeout=5)
+    except requests.RequestException:
+        return None
+    return response.json() if response.status_code == 200 else None
+
+
+def fetch_latency_stats(url):
+    """Speculation and hedging counters from chat_asgi.py in latency mode, None otherwise."""
+    try:
+        response = requests.get(url.rsplit("/chat", 1)[0] + "/latency/stats", timeout=5)
+    except requests.RequestException:
+        return None
+    stats = response.json() if response.status_code == 200 else None
+    return stats if stats and stats.get("latency_mode") else None
+
+
+def print_latency_stats(stats):
+    speculation, hedging = stats["speculation"], stats["hedging"]
+    print(f"   speculative LLM calls: {speculation['started']}, cancelled by a DB answer {speculation['cancel_rate']:.1%}")
+    print(f"   hedged {hedging['hedge_rate']:.1%} of generations after {hedging['hedge_delay_ms']}ms "
+          f"(hedge won {hedging['hedge_win_rate']:.1%}, {hedging['hedges_skipped']} skipped for quota)")
+    print(f"   quota overhead {hedging['quota_overhead']:.1%}: {hedging['wasted_calls']} of {hedging['calls']} LLM requests unused")
+
+
+def print_worker_stats(stats):
+    for worker in stats["workers"]:
+        print(f"   worker {worker['pid']}: {worker['requests']} requests, "
+              f"rss {worker['rss_mb']}MB, pss {worker['pss_mb']}MB")
+    print(f"   total pss {stats['total_pss_mb']}MB over {len(stats['workers'])} workers")
+
+
+def prepare_fixture(directory, num_scripts):
+    """Builds the fixture DB with the per-line FTS index, as a current stage 4 run would."""
+    db_file = os.path.join(directory, "movie_dialogues.db")
+    corpus = build_fixture_db(db_file, num_scripts=num_scripts)
+    conn = sqlite3.connect(db_file)
+    migrate_from_movie_dialogues(conn)
+    conn.close()
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=sorted(SERVER_PORTS), default="asgi", help="which app to start")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes for --server prefork")
+    parser.add_argument("--url", help="load an already running server instead (its DB must be the fixture's shape)")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=32, help="clients in closed-loop mode")
+    parser.add_argument("--rate", type=float, default=100, help="arrivals per second in open-loop mode")
+    parser.add_argument("--max-outstanding", type=int, default=512, help="open loop: requests in flight at most")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="request kind weights")
+    parser.add_argument("--scripts", type=int, default=20, help="fixture size")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="share of stub LLM calls in the slow tail")
+    parser.add_argument("--llm-slow-ms", type=float, default=0, help="extra latency of a slow stub LLM call")
+    parser.add_argument("--llm-keys", type=int, default=1, help="fake API keys on the stub (hedging needs 2)")
+    parser.add_argument("--latency-mode", action="store_true", help="asgi only: speculative and hedged LLM calls")
+    parser.add_argument("--hedge-delay-ms", default="p95", help="latency mode: p95, a number of ms, or off")
+    parser.add_argument("--json", help="write the run's config and results here")
+    parser.add_argument("--compare", help="a previous --json file to compare against")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = prepare_fixture(tmp, args.scripts)
+        workload = build_workload(corpus)
+
+        server = None
+        url = args.url
+        if url is None:
+            port = SERVER_PORTS[args.server]
+            env = dict(os.environ, LLM_BACKEND="stub", STUB_LLM_LATENCY_MS=str(args.llm_latency_ms),
+                       STUB_LLM_JITTER_MS="0", API_KEY="unused", MAX_INFLIGHT_LLM="1024",
+                       STUB_LLM_SLOW_RATE=str(args.llm_slow_rate), STUB_LLM_SLOW_MS=str(args.llm_slow_ms),
+                       STUB_LLM_KEYS=str(args.llm_keys), LATENCY_MODE="1" if args.latency_mode else "0",
+                       HEDGE_DELAY_MS=args.hedge_delay_ms)
+            server = start_server(args.server, port, tmp, env, args.workers)
+            url = f"http://127.0.0.1:{port}/chat"
+
+        print(f"📊 {args.mode}-loop load on {url} for {args.duration:g}s, mix {args.mix}")
+        try:
+            if args.mode == "closed":
+                recorder = closed_loop(url, workload, mix, args.concurrency, args.duration)
+            else:
+                recorder = open_loop(url, workload, mix, args.rate, args.duration, args.max_outstanding)
+            worker_stats = fetch_worker_stats(url)
+            latency_stats = fetch_latency_stats(url)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    summary = summarize(recorder, args.duration)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+    print_summary(summary, baseline)
+    if worker_stats:
+        print_worker_stats(worker_stats)
+    if latency_stats:
+        print_latency_stats(latency_stats)
+
+    if args.json:
+        run = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+            "environment": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": summary,
+            "workers": worker_stats,
+            "latency_mode": latency_stats,
+        }
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(run, file, indent=2)
+        print(f"✅ Saved results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
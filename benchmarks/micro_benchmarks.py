@@ -0,0 +1,101 @@
+"""
+pytest-benchmark micro-benchmarks for the hot functions: fetch_dialogue per
+tier, extract_dialogues, extract_bold_names and clean_text. They run on the
+synthetic fixture DB and screenplays, offline.
+
+Not collected by a plain `pytest`; run the file explicitly, and save or compare
+runs with pytest-benchmark's JSON:
+
+    pytest benchmarks/micro_benchmarks.py --benchmark-json=before.json
+    pytest benchmarks/micro_benchmarks.py --benchmark-json=after.json
+    pytest-benchmark compare before.json after.json
+"""
+import importlib
+import os
+import random
+import sqlite3
+
+import pytest
+
+from bench_fuzzy_index import build_queries
+from fixtures import build_fixture_db, build_screenplay
+from dialogue_schema import migrate_from_movie_dialogues
+
+# Stage 3 builds its Gemini backend at import; no call is made here
+os.environ.setdefault("API_KEY_1", "unused")
+os.environ.setdefault("API_KEY_2", "unused")
+
+import dialogue_lookup
+
+character_names_stage = importlib.import_module("3_find_out_character_names")
+dialogues_stage = importlib.import_module("4_save_dialogues_from_character_names")
+
+CAST = ["JESSEP", "KAFFEE", "GALLOWAY", "ROSS", "MARKINSON", "DAWSON", "DOWNEY", "RANDOLPH"]
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    """Fixture DB with the per-line index, loaded into dialogue_lookup's pool and indexes."""
+    db_file = str(tmp_path_factory.mktemp("fixture") / "movie_dialogues.db")
+    corpus = build_fixture_db(db_file, num_scripts=20)
+    conn = sqlite3.connect(db_file)
+    migrate_from_movie_dialogues(conn)
+    conn.close()
+    dialogue_lookup.configure(db_file, None)
+    yield corpus
+    dialogue_lookup.close()
+
+
+@pytest.fixture(scope="module")
+def screenplay():
+    return build_screenplay(random.Random(1), CAST)
+
+
+def cycle(items):
+    """Calls argument source for benchmark(): a different item on every round."""
+    position = [0]
+
+    def next_item():
+        position[0] = (position[0] + 1) % len(items)
+        return items[position[0]]
+
+    return next_item
+
+
+def test_fetch_dialogue_exact(benchmark, corpus):
+    rng = random.Random(2)
+    queries = []
+    for _ in range(200):
+        _, character, lines = rng.choice(corpus)
+        words = rng.choice(lines).rstrip(".").split()
+        queries.append((character, " ".join(words[1:5])))
+    next_query = cycle(queries)
+
+    result = benchmark.pedantic(dialogue_lookup.fetch_dialogue, setup=lambda: (next_query(), {}), rounds=2000, warmup_rounds=1)
+    assert result is not None
+
+
+def test_fetch_dialogue_fuzzy(benchmark, corpus):
+    next_query = cycle(build_queries(corpus, 200))
+    benchmark.pedantic(dialogue_lookup.fetch_dialogue, setup=lambda: (next_query(), {}), rounds=500, warmup_rounds=1)
+
+
+def test_fetch_dialogue_miss(benchmark, corpus):
+    # Falls through every tier, as a request that ends up at the LLM does
+    result = benchmark(dialogue_lookup.fetch_dialogue, "CHARACTER00", "zzz unmatched question")
+    assert result is None
+
+
+def test_extract_dialogues(benchmark, screenplay):
+    dialogues = benchmark(dialogues_stage.extract_dialogues, screenplay, CAST)
+    assert set(dialogues) <= set(CAST)
+
+
+def test_extract_bold_names(benchmark, screenplay):
+    names = benchmark(character_names_stage.extract_bold_names, screenplay)
+    assert set(CAST) <= set(names)
+
+
+def test_clean_text(benchmark):
+    text = "  Son, we live in a world\n\n   that has walls,\tand those walls  have to be guarded.  " * 4
+    assert benchmark(dialogue_lookup.clean_text, text).startswith("Son, we live")
@@ -0,0 +1,200 @@
+"""
+In-process stand-in for Gemini's per-key quotas, for exercising rate_limiter.py
+without spending real quota.
+
+QuotaServer hands out fake google-genai clients (client(api_key)) that enforce
+a requests- and tokens-per-window limit per key over a sliding window. Calls
+over the limit raise a 429 RESOURCE_EXHAUSTED error carrying a retry delay,
+worded like Gemini's. Keys listed in broken_keys fail every call with a 500,
+which exercises the circuit breaker. Pass server.client as the client_factory
+of llm_backend.GeminiBackend.
+
+The benchmark runs the same workload twice against it:
+- the old stage 3 pattern: keys assigned round-robin, a fixed pause after
+  each call and a fixed retry delay;
+- the shared KeyScheduler.
+
+Windows are scaled down (--window seconds instead of 60) so a run takes
+seconds.
+
+    python benchmarks/quota_standin.py --calls 300 --keys 3 --rpm 20 --window 2
+    python benchmarks/quota_standin.py --broken-keys 1
+"""
+import argparse
+import asyncio
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import fixtures  # noqa: F401  (puts the repo root on sys.path)
+from llm_backend import GeminiBackend
+from rate_limiter import KeyScheduler, estimate_tokens
+
+
+class QuotaExceeded(Exception):
+    """429 as google-genai raises it: code, status and a retryDelay in the message."""
+
+    def __init__(self, retry_after):
+        self.code = 429
+        self.status = "RESOURCE_EXHAUSTED"
+        super().__init__(f'429 RESOURCE_EXHAUSTED. Quota exceeded. {{"retryDelay": "{retry_after:.2f}s"}}')
+
+
+class BackendError(Exception):
+    def __init__(self):
+        self.code = 500
+        super().__init__("500 INTERNAL. An internal error has occurred.")
+
+
+class QuotaServer:
+    """Sliding-window RPM/TPM accounting per key, shared by every client it hands out."""
+
+    def __init__(self, rpm=15, tpm=1_000_000, window=60.0, latency_ms=50, broken_keys=()):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self.latency = latency_ms / 1000
+        self.broken_keys = set(broken_keys)
+        self.history = defaultdict(deque)  # key -> (time, tokens) of accepted calls
+        self.stats = defaultdict(lambda: {"accepted": 0, "rejected": 0, "errors": 0})
+        self._lock = threading.Lock()
+
+    def admit(self, api_key, tokens):
+        """Records a call or raises the error the real service would."""
+        with self._lock:
+            if api_key in self.broken_keys:
+                self.stats[api_key]["errors"] += 1
+                raise BackendError()
+
+            now = time.monotonic()
+            history = self.history[api_key]
+            while history and history[0][0] <= now - self.window:
+                history.popleft()
+
+            used_tokens = sum(used for _, used in history)
+            if len(history) >= self.rpm or (history and used_tokens + tokens > self.tpm):
+                self.stats[api_key]["rejected"] += 1
+                raise QuotaExceeded(history[0][0] + self.window - now)
+            history.append((now, tokens))
+            self.stats[api_key]["accepted"] += 1
+
+    def respond(self, api_key, contents):
+        tokens = estimate_tokens(contents)
+        self.admit(api_key, tokens)
+        return SimpleNamespace(
+            text='{"characters": []}',
+            usage_metadata=SimpleNamespace(total_token_count=tokens),
+        )
+
+    def client(self, api_key):
+        """A fake genai.Client for api_key: .models.generate_content and .aio.models.generate_content(_stream)."""
+        server = self
+
+        def generate_content(model, contents):
+            time.sleep(server.latency)
+            return server.respond(api_key, contents)
+
+        async def agenerate_content(model, contents):
+            await asyncio.sleep(server.latency)
+            return server.respond(api_key, contents)
+
+        async def agenerate_content_stream(model, contents):
+            response = await agenerate_content(model, contents)
+
+            async def chunks():
+                yield response
+            return chunks()
+
+        return SimpleNamespace(
+            models=SimpleNamespace(generate_content=generate_content),
+            aio=SimpleNamespace(models=SimpleNamespace(
+                generate_content=agenerate_content, generate_content_stream=agenerate_content_stream,
+            )),
+        )
+
+
+def run_round_robin(server, api_keys, prompts, workers, pause, retry_delay, attempts=3):
+    """Stage 3 before the scheduler: key i % n, a pause after every call, a fixed retry delay."""
+    clients = [server.client(key) for key in api_keys]
+
+    def call(i, prompt):
+        client = clients[i % len(clients)]
+        for attempt in range(1, attempts + 1):
+            try:
+                client.models.generate_content(model="gemini-2.0-flash", contents=prompt)
+                time.sleep(pause)
+                return True
+            except Exception:
+                if attempt < attempts:
+                    time.sleep(retry_delay)
+        return False
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(call, range(len(prompts)), prompts))
+
+
+def run_scheduled(server, api_keys, prompts, workers, breaker_timeout, attempts=3):
+    """The same workload through GeminiBackend and a KeyScheduler sized to the server's quota."""
+    scheduler = KeyScheduler(
+        [f"key-{i + 1}" for i in range(len(api_keys))], rpm=server.rpm, tpm=server.tpm,
+        window=server.window, breaker_timeout=breaker_timeout, base_backoff=server.window / 60,
+    )
+    llm = GeminiBackend(api_keys, scheduler=scheduler, client_factory=server.client, attempts=attempts)
+
+    def call(prompt):
+        try:
+            llm.generate(prompt)
+            return True
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(call, prompts))
+    return results, llm.stats()
+
+
+def report(label, server, results, elapsed):
+    accepted = sum(stats["accepted"] for stats in server.stats.values())
+    rejected = sum(stats["rejected"] for stats in server.stats.values())
+    errors = sum(stats["errors"] for stats in server.stats.values())
+    print(f"{label:<12} {sum(results):>5}/{len(results)} ok   {elapsed:6.2f}s   "
+          f"{accepted / elapsed:6.1f} calls/s   {rejected:>5} 429s   {errors:>4} 500s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--keys", type=int, default=3)
+    parser.add_argument("--broken-keys", type=int, default=0, help="how many of the keys fail every call")
+    parser.add_argument("--rpm", type=int, default=20, help="requests per window per key")
+    parser.add_argument("--window", type=float, default=2.0, help="seconds standing in for a minute")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    api_keys = [f"fake-key-{i}" for i in range(args.keys)]
+    broken = api_keys[:args.broken_keys]
+    prompts = [f"Which of these are characters? {'NAME ' * (i % 50)}" for i in range(args.calls)]
+    scale = args.window / 60  # Stage 3's 0.5s pause and 5s retry delay, in simulated minutes
+    capacity = (args.keys - args.broken_keys) * args.rpm / args.window
+    print(f"📊 {args.calls} calls, {args.keys} keys ({args.broken_keys} broken), "
+          f"quota {args.rpm}/{args.window:g}s per key = {capacity:.1f} calls/s in total")
+
+    server = QuotaServer(args.rpm, window=args.window, latency_ms=args.latency_ms, broken_keys=broken)
+    start = time.perf_counter()
+    results = run_round_robin(server, api_keys, prompts, args.workers, 0.5 * scale, 5 * scale)
+    report("round-robin", server, results, time.perf_counter() - start)
+
+    server = QuotaServer(args.rpm, window=args.window, latency_ms=args.latency_ms, broken_keys=broken)
+    start = time.perf_counter()
+    results, key_stats = run_scheduled(server, api_keys, prompts, args.workers, breaker_timeout=args.window * 5)
+    report("scheduled", server, results, time.perf_counter() - start)
+    for key, stats in key_stats.items():
+        print(f"   {key}: {stats['successes']} ok, {stats['rate_limited']} rate limited, "
+              f"{stats['errors']} errors, breaker {stats['breaker']} ({stats['breaker_trips']} trips)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Stage 3 helpers: pull the <b> cues out of a script without building a DOM,
+and settle the obvious cases locally so only doubtful cues go to Gemini.
+
+A cue is scored on what surrounds it:
+- How often it is followed by an indented dialogue block.
+- How many times it occurs.
+- Whether it looks like a scene heading or transition (INT., CUT TO:, ...).
+- Whether it only ever appears on the title page.
+- How long it is and its casing.
+
+High scores are speakers, low scores are not, and the middle band is left
+for the LLM.
+
+    python bold_cues.py          (corpus-wide report of the Gemini calls and tokens saved)
+"""
+import argparse
+import html
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+
+from screenplay_parser import EXTENSION_PATTERN, normalize_cue
+
+SPEAKER_SCORE = 3  # At or above: a speaker without asking Gemini
+NON_SPEAKER_SCORE = -2  # At or below: never a speaker
+TITLE_PAGE_SHARE = 0.03  # Leading share of the script treated as the title page
+MAX_NAME_WORDS = 4
+
+HEADING_PATTERN = re.compile(
+    r"^(INT\b|EXT\b|INT\./|I/E\b|INTERIOR\b|EXTERIOR\b|FADE\b|CUT\b|DISSOLVE\b|SMASH\b|MATCH CUT\b|"
+    r"BACK TO\b|ANGLE\b|CLOSE\b|WIDE\b|INSERT\b|POV\b|MONTAGE\b|FLASHBACK\b|SUPER\b|TITLE\b|"
+    r"THE END\b|END\b|CONTINUED\b|MORE\b|LATER\b|MOMENTS LATER\b|SERIES OF SHOTS\b)"
+    r"|TO:$|^\(?CONT(INUED|'D)\)?$|^\d+\.?$"
+)
+WORD_PATTERN = re.compile(r"[A-Za-z0-9'#.\-]+")
+SPACES_PATTERN = re.compile(r"\s+")
+TAG_PATTERN = re.compile(r"<[^>]*>")
+
+
+def iter_bold_cues(text):
+    """
+    Yields (cue, offset, has_dialogue) for every <b>...</b> span, in order, with a
+    plain str.find scan. has_dialogue is True when the next line after the span
+    starts an indented, non-bold block of text.
+    """
+    lower = text.lower()
+    position = 0
+    while True:
+        start = lower.find("<b>", position)
+        if start == -1:
+            return
+        end = lower.find("</b>", start + 3)
+        if end == -1:
+            return
+        cue = SPACES_PATTERN.sub(" ", html.unescape(TAG_PATTERN.sub("", text[start + 3:end]))).strip()
+        position = end + 4
+
+        # The block that follows: everything up to the next blank line, if it is not another cue
+        line_end = text.find("\n", position)
+        following = text[line_end + 1:text.find("\n", line_end + 1)] if line_end != -1 else ""
+        has_dialogue = bool(following.strip()) and following[:1].isspace() and "<b>" not in following.lower()
+        if cue:
+            yield cue, start, has_dialogue
+
+
+def base_name(cue):
+    """Cue without extensions: 'KAFFEE (CONT'D)' -> 'KAFFEE'."""
+    name = normalize_cue(cue)
+    while True:
+        stripped = EXTENSION_PATTERN.sub("", name)
+        if stripped == name:
+            return name
+        name = stripped
+
+
+@dataclass
+class CueStats:
+    count: int = 0
+    with_dialogue: int = 0
+    first_offset: int = 0
+    last_offset: int = 0
+    lowercase: bool = False
+    forms: Counter = field(default_factory=Counter)  # Raw spellings seen for this name
+
+
+def collect_cue_stats(text):
+    """{base name: CueStats} for every bold cue in a script."""
+    stats = {}
+    for cue, offset, has_dialogue in iter_bold_cues(text):
+        name = base_name(cue)
+        if not name:
+            continue
+        entry = stats.get(name)
+        if entry is None:
+            entry = stats[name] = CueStats(first_offset=offset)
+        entry.count += 1
+        entry.with_dialogue += has_dialogue
+        entry.last_offset = offset
+        entry.lowercase |= any(c.islower() for c in EXTENSION_PATTERN.sub("", cue))
+        entry.forms[cue] += 1
+    return stats
+
+
+def score_cue(name, entry, text_length):
+    """Positive for speaker-like cues, negative for headings, transitions and title-page text."""
+    score = 0
+    dialogue_ratio = entry.with_dialogue / entry.count
+    if dialogue_ratio >= 0.8:
+        score += 2
+    elif dialogue_ratio >= 0.5:
+        score += 1
+    if entry.with_dialogue == 0:
+        score -= 2
+    if entry.count >= 3:
+        score += 1
+    if HEADING_PATTERN.search(name):
+        score -= 3
+    if len(WORD_PATTERN.findall(name)) > MAX_NAME_WORDS:
+        score -= 1
+    if entry.lowercase:
+        score -= 1
+    if text_length and entry.last_offset < text_length * TITLE_PAGE_SHARE:
+        score -= 1
+    return score
+
+
+def classify_cues(text):
+    """Splits a script's bold cues into (speakers, non_speakers, ambiguous) lists of base names."""
+    speakers, non_speakers, ambiguous = [], [], []
+    for name, entry in collect_cue_stats(text).items():
+        score = score_cue(name, entry, len(text))
+        if score >= SPEAKER_SCORE:
+            speakers.append(name)
+        elif score <= NON_SPEAKER_SCORE:
+            non_speakers.append(name)
+        else:
+            ambiguous.append(name)
+    return sorted(speakers), sorted(non_speakers), sorted(ambiguous)
+
+
+def estimate_tokens(text):
+    """Rough Gemini token count (~4 characters per token), for savings reports."""
+    return (len(text) + 3) // 4
+
+
+def savings_report(script_source, prompt_builder):
+    """
+    Compares sending every distinct bold cue to Gemini (the old stage 3) with
+    sending only the ambiguous residue. Returns a dict of totals.
+    """
+    totals = Counter()
+    for script_name in script_source.names():
+        text = script_source.read(script_name)
+        # The old stage 3 sent each distinct stripped <b> text
+        raw_cues = sorted({cue for cue, _, _ in iter_bold_cues(text)})
+        speakers, non_speakers, ambiguous = classify_cues(text)
+
+        totals["scripts"] += 1
+        totals["calls_before"] += 1
+        totals["tokens_before"] += estimate_tokens(prompt_builder(script_name, raw_cues))
+        totals["cues_before"] += len(raw_cues)
+        totals["speakers"] += len(speakers)
+        totals["non_speakers"] += len(non_speakers)
+        totals["ambiguous"] += len(ambiguous)
+        if ambiguous:
+            totals["calls_after"] += 1
+            totals["tokens_after"] += estimate_tokens(prompt_builder(script_name, ambiguous))
+    return dict(totals)
+
+
+def print_savings(totals):
+    calls_saved = totals.get("calls_before", 0) - totals.get("calls_after", 0)
+    tokens_saved = totals.get("tokens_before", 0) - totals.get("tokens_after", 0)
+    share = tokens_saved / totals["tokens_before"] if totals.get("tokens_before") else 0
+    print(f"📊 {totals.get('scripts', 0)} scripts: {totals.get('speakers', 0)} speakers and "
+          f"{totals.get('non_speakers', 0)} non-speakers settled locally, {totals.get('ambiguous', 0)} cues left for Gemini")
+    print(f"📉 Gemini calls {totals.get('calls_before', 0)} -> {totals.get('calls_after', 0)} (saved {calls_saved}), "
+          f"prompt tokens ~{totals.get('tokens_before', 0)} -> ~{totals.get('tokens_after', 0)} (saved {share:.0%})")
+
+
+if __name__ == "__main__":
+    from prompts import build_character_names_prompt
+    from script_store import SCRIPT_FOLDER, SCRIPT_STORE_DIR, ScriptSource
+
+    parser = argparse.ArgumentParser(description="Report how many Gemini calls and tokens the local cue filter saves.")
+    parser.add_argument("--folder", default=SCRIPT_FOLDER)
+    parser.add_argument("--store", default=SCRIPT_STORE_DIR)
+    args = parser.parse_args()
+
+    print_savings(savings_report(ScriptSource(args.folder, args.store), build_character_names_prompt))
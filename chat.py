@@ -1,11 +1,16 @@
-from flask import Flask, request, jsonify
-import sqlite3
-import os
-from google import genai
+from flask import Flask, Response, request, jsonify, stream_with_context
 from dotenv import load_dotenv
+import json
+import os
 import time
-import re
-from rapidfuzz import process, fuzz
+from concurrent.futures import ThreadPoolExecutor
+from dialogue_lookup import ensure_configured, fetch_dialogue, fetch_dialogues_batch, resolve_character, retrieve_context
+from llm_backend import create_backend
+from metrics import register_snapshot, render, track_llm, track_request
+from prompts import PROMPT_VERSION, build_prompt
+from response_cache import ResponseCache
+from singleflight import SingleFlight
+from startup import Warmup
 
 # Load environment variables
 load_dotenv()
@@ -14,71 +19,52 @@ print("✅ Environment Loaded")
 # Initialize Flask
 app = Flask(__name__)
 
-# Google Gemini AI Client
-client = genai.Client(api_key=os.environ['API_KEY'])
-
-DB_FILE = "movie_dialogues.db"
-
-def clean_text(text):
-    """Removes unwanted characters and formatting from dialogues."""
-    text = re.sub(r"\s+", " ", text)  # Replace multiple spaces/newlines with a single space
-    text = text.strip()  # Trim leading/trailing spaces
-    return text
+# Google Gemini AI Client (LLM_BACKEND=stub for a local fake); its clients are created on first use or by the warm-up
+llm = create_backend()
 
-def fetch_dialogue(character, user_message):
-    """Fetches the closest matching dialogue for the character from SQLite."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+GEMINI_ERROR_RESPONSE = "Sorry, I couldn't generate a response."
 
-    # Try to find an **exact** dialogue match first
-    cursor.execute("""
-        SELECT dialogues FROM movie_dialogues
-        WHERE character_name = ? AND dialogues LIKE ?
-        ORDER BY LENGTH(dialogues) ASC
-        LIMIT 1
-    """, (character, f"% {user_message} %"))  # Space-padding ensures better matching
+# Generated replies: in-process LRU in front of a SQLite table shared by all workers
+response_cache = ResponseCache()
 
-    result = cursor.fetchone()
+# Identical concurrent Gemini calls share one request; SINGLEFLIGHT_LOCK_DIR extends this across worker processes
+llm_flight = SingleFlight(os.environ.get("SINGLEFLIGHT_LOCK_DIR"))
 
-    # If exact match found, return it
-    if result:
-        conn.close()
-        return clean_text(result[0])
+# Indexes and Gemini clients load in the background while the server starts listening; see /ready
+warmup = Warmup(("dialogue_indexes", ensure_configured), ("llm_clients", getattr(llm, "warm_up", lambda: None)))
 
-    # If no exact match, perform fuzzy search
-    cursor.execute("SELECT dialogues FROM movie_dialogues WHERE character_name = ?", (character,))
-    all_dialogues = [row[0] for row in cursor.fetchall()]
-    conn.close()
+# Cache, single-flight, warm-up and per-key quota stats, read whenever /metrics is scraped
+register_snapshot("startup", warmup.snapshot)
+register_snapshot("response_cache", response_cache.snapshot)
+register_snapshot("singleflight", llm_flight.snapshot)
+if hasattr(llm, "stats"):
+    register_snapshot("llm_key", llm.stats, label="key")
 
-    if all_dialogues:
-        # Use fuzzy matching to find the best match
-        best_match, score, _ = process.extractOne(user_message, all_dialogues, scorer=fuzz.partial_ratio)
+BATCH_MAX_ITEMS = 10000  # Pairs accepted per /chat/batch request
+BATCH_LLM_CONCURRENCY = 8  # Gemini calls in flight for batch misses, across all batches
+batch_llm_executor = ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY, thread_name_prefix="batch-llm")
 
-        # If match confidence is high enough, return it
-        if score > 80:
-            return clean_text(best_match)
-
-    return None  # No suitable match found
-
-def generate_gemini_response(character, user_message):
+def generate_gemini_response(character, user_message, bypass_cache=False):
     """Generates a realistic response using Gemini AI if no exact or close match is found."""
+    response = response_cache.get_or_generate(
+        character, user_message, llm.model, PROMPT_VERSION,
+        lambda: call_gemini(character, user_message),
+        bypass=bypass_cache, flight=llm_flight,
+    )
+    return response if response is not None else GEMINI_ERROR_RESPONSE
+
+def call_gemini(character, user_message):
+    """Calls the Gemini API directly. Returns None on failure so errors are never cached."""
     print(f"⚡ No match found for '{user_message}'. Using Gemini AI...")
 
-    prompt = f"""
-    Act exactly like {character} from the movie script. 
-    Stay in character and respond naturally, as if you were in the scene. 
-    Given this line from another character: "{user_message}", 
-    how would {character} realistically reply based on their personality and speaking style?
-    """
+    prompt = build_prompt(character, user_message, retrieve_context(character, user_message))
 
     try:
-        gemini_api_response = client.models.generate_content(
-            model="gemini-2.0-flash", contents=prompt
-        )
-        return gemini_api_response.text
+        with track_llm():
+            return llm.generate(prompt)
     except Exception as e:
         print(f"❌ Error with Gemini API: {e}")
-        return "Sorry, I couldn't generate a response."
+        return None
 
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -90,19 +76,127 @@ def chat():
     if not character or not user_message:
         return jsonify({"error": "Missing required fields"}), 400
 
+    # Clients can force a fresh generation with {"cache": false} or Cache-Control: no-cache
+    bypass_cache = data.get("cache") is False or "no-cache" in request.headers.get("Cache-Control", "")
+
     start_time = time.time()
 
-    # Check SQLite for stored dialogue
-    response = fetch_dialogue(character, user_message)
+    # "Jessep" or "JESSEP in A Few Good Men" -> the stored name; an ambiguous name is
+    # reported back instead of asking Gemini to play a character we can't pin down
+    resolution = resolve_character(character, data.get("script"))
+    if resolution.ambiguous:
+        return jsonify(resolution.ambiguity_report()), 409
+    stored_name, character = resolution.character or resolution.query, resolution.reply_name
+
+    with track_request():
+        # Check SQLite for stored dialogue (a typo's closest stored name is good enough here),
+        # from the named script only when the request was scoped
+        response = fetch_dialogue(stored_name, user_message, resolution.script)
 
-    if not response:
-        # Use Gemini AI if no exact or close match found
-        response = generate_gemini_response(character, user_message)
+        if not response:
+            # Use Gemini AI if no exact or close match found
+            response = generate_gemini_response(character, user_message, bypass_cache)
 
     end_time = time.time()
     print(f"Response Time: {round((end_time - start_time) * 1000, 2)}ms")
 
     return jsonify({"character": character, "response": response})
 
+def generate_batch_reply(character, user_message, bypass_cache):
+    """Cached Gemini reply for one batch miss; real API calls wait on the backend's per-key quota."""
+    return response_cache.get_or_generate(
+        character, user_message, llm.model, PROMPT_VERSION,
+        lambda: call_gemini(character, user_message), bypass=bypass_cache, flight=llm_flight,
+    )
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """
+    Answers many {"character", "user_message", "script"?} items in one request.
+    Results stream back as NDJSON lines in input order; a failed or ambiguous
+    item gets an "error" line instead of failing the whole batch.
+    """
+    data = request.json
+    items = data.get("items") if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty list of items"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} items per batch"}), 413
+
+    bypass_cache = (isinstance(data, dict) and data.get("cache") is False) or "no-cache" in request.headers.get("Cache-Control", "")
+
+    # pairs: what the DB tiers look up; prompts: who Gemini plays (see /chat) and the reply is attributed to
+    pairs, prompts, ambiguous = [], [], {}
+    for index, item in enumerate(items):
+        valid = isinstance(item, dict) and item.get("character") and item.get("user_message")
+        resolution = resolve_character(item["character"], item.get("script")) if valid else None
+        if resolution is not None and resolution.ambiguous:
+            ambiguous[index] = resolution.ambiguity_report()
+            valid = False
+        pairs.append((resolution.character or resolution.query, item["user_message"], resolution.script) if valid else None)
+        prompts.append((resolution.reply_name, item["user_message"]) if valid else None)
+
+    # Identical items are looked up (and generated) once
+    unique_pairs = list(dict.fromkeys(pair for pair in pairs if pair is not None))
+    stored = dict(zip(unique_pairs, fetch_dialogues_batch(unique_pairs)))
+
+    # Every DB miss goes to Gemini concurrently, bounded by the executor and the per-key Gemini quota
+    misses = dict.fromkeys(prompt for pair, prompt in zip(pairs, prompts) if pair is not None and not stored[pair])
+    pending = {prompt: batch_llm_executor.submit(generate_batch_reply, *prompt, bypass_cache) for prompt in misses}
+
+    def results():
+        try:
+            for index, pair in enumerate(pairs):
+                if index in ambiguous:
+                    result = {"index": index, **ambiguous[index]}
+                elif pair is None:
+                    result = {"index": index, "error": "Missing required fields"}
+                elif stored[pair]:
+                    result = {"index": index, "character": prompts[index][0], "response": stored[pair], "source": "db"}
+                else:
+                    try:
+                        response = pending[prompts[index]].result()
+                    except Exception as e:
+                        print(f"❌ Batch item {index} failed: {e}")
+                        response = None
+                    if response is None:
+                        result = {"index": index, "character": prompts[index][0], "error": GEMINI_ERROR_RESPONSE}
+                    else:
+                        result = {"index": index, "character": prompts[index][0], "response": response, "source": "llm"}
+                yield json.dumps(result) + "\n"
+        finally:
+            # Client went away: don't start Gemini calls nobody will read
+            for future in pending.values():
+                future.cancel()
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Hit/miss counters for the response cache."""
+    return jsonify(response_cache.snapshot())
+
+@app.route("/singleflight/stats", methods=["GET"])
+def singleflight_stats():
+    """How many Gemini calls were coalesced into an in-flight one."""
+    return jsonify(llm_flight.snapshot())
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics: per-stage latency histograms, tier hit/miss counters, in-flight gauges."""
+    body, content_type = render()
+    return Response(body, content_type=content_type)
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """200 once the indexes and Gemini clients are loaded, 503 before (for load balancer readiness checks)."""
+    return jsonify(warmup.snapshot()), 200 if warmup.ready.is_set() else 503
+
+@app.route("/llm/stats", methods=["GET"])
+def llm_stats():
+    """Per-key Gemini quota, load and circuit breaker state."""
+    return jsonify(llm.stats() if hasattr(llm, "stats") else {})
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,567 @@
+"""
+Asyncio-native server for the /chat API, for when most request time is spent
+waiting on the LLM. Same contract as chat.py:
+
+    POST /chat          {"character": ..., "user_message": ..., "script": ...?, "cache": false?}
+    GET  /cache/stats
+    GET  /singleflight/stats  identical concurrent LLM calls that were coalesced
+    GET  /llm/stats     per-key Gemini quota, load and circuit breaker state
+    GET  /metrics       Prometheus metrics (see metrics.py)
+    GET  /ready         200 once the indexes and Gemini clients are loaded, 503 until then
+
+plus token streaming for LLM replies (stored dialogue is sent in one event):
+
+    POST /chat/stream   same body, answered as Server-Sent Events
+    WS   /chat/ws       one JSON request per message, {"type": "cancel"} stops the current reply
+    GET  /stream/stats  time-to-first-token percentiles and stream outcomes
+
+SQLite lookups run on a bounded thread pool, Gemini is called through its
+asyncio client within each API key's quota (rate_limiter.py), and at most
+MAX_INFLIGHT_LLM generations run at once.
+
+LATENCY_MODE=1 trades quota for latency on /chat. The LLM call starts
+alongside the DB lookup and is cancelled if the DB answers. A call still
+running after HEDGE_DELAY_MS ("p95" of recent calls by default, a number,
+or "off") is duplicated on another API key, and the first reply wins
+(hedging.py).
+
+    GET  /latency/stats  speculation cancel rate, hedge rate and quota overhead
+
+    uvicorn chat_asgi:app --port 8000          (or: python chat_asgi.py)
+    LLM_BACKEND=stub python chat_asgi.py       (offline, fake LLM latency)
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import dialogue_lookup
+from dialogue_lookup import ensure_configured, fetch_dialogue, resolve_character, retrieve_context
+from llm_backend import create_backend
+from metrics import register_snapshot, render, track_llm, track_request
+from prompts import PROMPT_VERSION, build_prompt
+from hedging import Hedger, parse_hedge_delay
+from response_cache import ResponseCache, cache_key
+from singleflight import SingleFlight
+from startup import Warmup
+
+# Load environment variables
+load_dotenv()
+
+DB_WORKERS = int(os.environ.get("ASGI_DB_WORKERS", "8"))  # Threads for SQLite and index lookups
+MAX_INFLIGHT_LLM = int(os.environ.get("MAX_INFLIGHT_LLM", "64"))  # Concurrent LLM generations
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "30"))  # Seconds to wait for a free slot before 503
+LATENCY_MODE = os.environ.get("LATENCY_MODE", "0") == "1"  # Speculative and hedged LLM calls, see above
+
+GEMINI_ERROR_RESPONSE = "Sorry, I couldn't generate a response."
+
+llm = create_backend()
+response_cache = ResponseCache()
+llm_flight = SingleFlight(os.environ.get("SINGLEFLIGHT_LOCK_DIR"))  # Coalesces identical concurrent generations
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="chat-db")
+llm_slots = asyncio.Semaphore(MAX_INFLIGHT_LLM)
+hedger = Hedger(llm, parse_hedge_delay(os.environ.get("HEDGE_DELAY_MS"))) if LATENCY_MODE else None
+
+# Indexes and Gemini clients load on a background thread, so uvicorn starts accepting right away
+warmup = Warmup(("dialogue_indexes", ensure_configured), ("llm_clients", getattr(llm, "warm_up", lambda: None)))
+
+
+class Overloaded(Exception):
+    """Raised when no LLM slot frees up within LLM_QUEUE_TIMEOUT."""
+
+
+class NotReady(Exception):
+    """Raised when the warm-up failed, so the indexes a request needs never loaded."""
+
+
+class AmbiguousCharacter(Exception):
+    """Raised when a requested name fits several stored characters; report is the client-facing error."""
+
+    def __init__(self, resolution):
+        super().__init__(resolution.query)
+        self.report = resolution.ambiguity_report()
+
+
+class StreamStats:
+    """Rolling time-to-first-token samples plus counters per stream outcome."""
+
+    def __init__(self, window=1000):
+        self.ttft_ms = deque(maxlen=window)
+        self.counts = {"db": 0, "cache": 0, "llm": 0, "cancelled": 0, "errors": 0}
+
+    def record(self, outcome, ttft_ms=None):
+        self.counts[outcome] += 1
+        if ttft_ms is not None:
+            self.ttft_ms.append(ttft_ms)
+
+    def snapshot(self):
+        samples = sorted(self.ttft_ms)
+        pick = lambda pct: round(samples[min(len(samples) - 1, int(pct / 100 * len(samples)))], 2) if samples else None
+        return {**self.counts, "ttft_ms_p50": pick(50), "ttft_ms_p95": pick(95), "ttft_samples": len(samples)}
+
+
+class SpeculationStats:
+    """How often a speculative LLM call was needed, or cancelled because the DB answered."""
+
+    def __init__(self):
+        self.counts = {"started": 0, "used": 0, "cancelled": 0}
+
+    def record(self, outcome):
+        self.counts["started"] += 1
+        self.counts[outcome] += 1
+
+    def snapshot(self):
+        started = self.counts["started"]
+        return {**self.counts, "cancel_rate": round(self.counts["cancelled"] / started, 4) if started else 0.0}
+
+
+stream_stats = StreamStats()
+speculation_stats = SpeculationStats()
+
+# Cache, single-flight, stream, warm-up and per-key quota stats, read whenever /metrics is scraped
+register_snapshot("startup", warmup.snapshot)
+register_snapshot("response_cache", response_cache.snapshot)
+register_snapshot("singleflight", llm_flight.snapshot)
+register_snapshot("stream", stream_stats.snapshot)
+if LATENCY_MODE:
+    register_snapshot("speculation", speculation_stats.snapshot)
+    register_snapshot("hedging", hedger.snapshot)
+if hasattr(llm, "stats"):
+    register_snapshot("llm_key", llm.stats, label="key")
+
+
+async def run_db(fn, *args):
+    """Runs blocking DB/index work on the bounded executor."""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, fn, *args)
+
+
+async def wait_warm():
+    """Waits off the event loop for the warm-up, which the name resolution in parse_chat_request needs."""
+    if not warmup.ready.is_set() and not await asyncio.to_thread(warmup.wait):
+        raise NotReady()
+
+
+async def acquire_llm_slot():
+    """Waits for one of the MAX_INFLIGHT_LLM generation slots; release with llm_slots.release()."""
+    try:
+        await asyncio.wait_for(llm_slots.acquire(), LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise Overloaded() from None
+
+
+async def generate_and_store(character, user_message):
+    """Asks Gemini (hedged in latency mode) and caches the reply. None on failure, so errors are never cached."""
+    context_lines = await run_db(retrieve_context, character, user_message)
+    prompt = build_prompt(character, user_message, context_lines)
+
+    await acquire_llm_slot()
+    try:
+        print(f"⚡ No match found for '{user_message}'. Using Gemini AI...")
+        with track_llm():
+            response = await (hedger.generate(prompt) if hedger is not None else llm.agenerate(prompt))
+    except Exception as e:
+        print(f"❌ Error with Gemini API: {e}")
+        return None
+    finally:
+        llm_slots.release()
+
+    await run_db(response_cache.set, character, user_message, llm.model, PROMPT_VERSION, response)
+    return response
+
+
+async def generate_gemini_response(character, user_message, bypass_cache=False, speculative=False):
+    """
+    Async twin of chat.generate_gemini_response, sharing the same reply cache.
+    A speculative call is not coalesced: it has to stay cancellable by its own request.
+    """
+    if bypass_cache:
+        response_cache.note_bypass()
+    else:
+        cached = await run_db(response_cache.get, character, user_message, llm.model, PROMPT_VERSION)
+        if cached is not None:
+            return cached
+
+    if speculative:
+        response = await generate_and_store(character, user_message)
+    else:
+        # Concurrent misses for the same character and message wait on one generation
+        response = await llm_flight.ado(
+            cache_key(character, user_message, llm.model, PROMPT_VERSION),
+            lambda: generate_and_store(character, user_message),
+            recheck=lambda: response_cache.get(character, user_message, llm.model, PROMPT_VERSION),
+        )
+    return response if response is not None else GEMINI_ERROR_RESPONSE
+
+
+def lookup_dialogue(character, user_message, lookup=None):
+    """fetch_dialogue for the (stored name, script) parse_chat_request resolved, or for character as given."""
+    stored_name, script = lookup or (character, None)
+    return fetch_dialogue(stored_name, user_message, script)
+
+
+async def answer_speculatively(character, user_message, bypass_cache=False, lookup=None):
+    """Latency mode: the LLM call runs alongside the DB lookup and is cancelled if the DB answers."""
+    generation = asyncio.ensure_future(generate_gemini_response(character, user_message, bypass_cache, speculative=True))
+    try:
+        response = await run_db(lookup_dialogue, character, user_message, lookup)
+    except BaseException:
+        generation.cancel()
+        raise
+    if response:
+        generation.cancel()
+        # Already finished (a cache hit, or an Overloaded nobody will see): collect it so asyncio doesn't warn
+        if generation.done() and not generation.cancelled():
+            generation.exception()
+        speculation_stats.record("cancelled")
+        return response
+    speculation_stats.record("used")
+    return await generation
+
+
+async def stream_reply(character, user_message, bypass_cache=False, lookup=None):
+    """
+    Yields {"type": "token", "delta": ...} events and then one {"type": "done", ...} event.
+    DB and cache hits arrive as a single token; Gemini replies stream chunk by chunk.
+    """
+    start = time.perf_counter()
+    elapsed_ms = lambda: round((time.perf_counter() - start) * 1000, 2)
+
+    try:
+        source = "db"
+        response = await run_db(lookup_dialogue, character, user_message, lookup)
+
+        if not response:
+            source = "cache"
+            if bypass_cache:
+                response_cache.note_bypass()
+            else:
+                response = await run_db(response_cache.get, character, user_message, llm.model, PROMPT_VERSION)
+
+        if response:
+            ttft_ms = elapsed_ms()
+            stream_stats.record(source, ttft_ms)
+            yield {"type": "token", "delta": response}
+            yield {"type": "done", "source": source, "response": response, "ttft_ms": ttft_ms, "total_ms": elapsed_ms()}
+            return
+
+        context_lines = await run_db(retrieve_context, character, user_message)
+        prompt = build_prompt(character, user_message, context_lines)
+
+        chunks, ttft_ms = [], None
+        await acquire_llm_slot()
+        try:
+            with track_llm():
+                async for delta in llm.astream(prompt):
+                    if ttft_ms is None:
+                        ttft_ms = elapsed_ms()
+                    chunks.append(delta)
+                    yield {"type": "token", "delta": delta}
+        except Exception as e:
+            print(f"❌ Error with Gemini API: {e}")
+            stream_stats.record("errors")
+            yield {"type": "error", "error": GEMINI_ERROR_RESPONSE}
+            return
+        finally:
+            llm_slots.release()
+
+        response = "".join(chunks)
+        stream_stats.record("llm", ttft_ms)
+        await run_db(response_cache.set, character, user_message, llm.model, PROMPT_VERSION, response)
+        yield {"type": "done", "source": "llm", "response": response, "ttft_ms": ttft_ms, "total_ms": elapsed_ms()}
+
+    except asyncio.CancelledError:
+        # Client went away (or sent a cancel); the upstream Gemini stream is dropped with this task
+        stream_stats.record("cancelled")
+        raise
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def load_json(raw):
+    """Decodes a request body, raising ValueError with the client-facing error."""
+    try:
+        return json.loads(raw or b"{}")
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON") from None
+
+
+def parse_chat_request(data, headers=None):
+    """
+    Returns (character, user_message, bypass_cache, lookup): character is the name to reply
+    as (Resolution.reply_name), lookup the (stored name, script) the DB tiers search, script
+    being None unless the request was scoped. Raises ValueError with the client-facing
+    error, or AmbiguousCharacter.
+    """
+    if not isinstance(data, dict) or not data.get("character") or not data.get("user_message"):
+        raise ValueError("Missing required fields")
+
+    # "Jessep" or "JESSEP in A Few Good Men" -> the stored name, without leaving the event loop
+    resolution = resolve_character(data["character"], data.get("script"))
+    if resolution.ambiguous:
+        raise AmbiguousCharacter(resolution)
+
+    # Clients can force a fresh generation with {"cache": false} or Cache-Control: no-cache
+    headers = headers or {}
+    bypass_cache = data.get("cache") is False or b"no-cache" in headers.get(b"cache-control", b"")
+    lookup = (resolution.character or resolution.query, resolution.script)
+    return resolution.reply_name, data["user_message"], bypass_cache, lookup
+
+
+async def chat(scope, receive, send):
+    """Handles character-based dialogue lookup and AI response."""
+    try:
+        await wait_warm()
+        character, user_message, bypass_cache, lookup = parse_chat_request(
+            load_json(await read_body(receive)), dict(scope.get("headers", []))
+        )
+    except ValueError as e:
+        return await send_json(send, 400, {"error": str(e)})
+    except AmbiguousCharacter as e:
+        return await send_json(send, 409, e.report)
+    except NotReady:
+        return await send_json(send, 503, {"error": "Server failed to start", **warmup.snapshot()})
+
+    start_time = time.time()
+
+    with track_request():
+        try:
+            if LATENCY_MODE:
+                response = await answer_speculatively(character, user_message, bypass_cache, lookup)
+            else:
+                # Check SQLite for stored dialogue, from the named script only when the request was scoped
+                response = await run_db(lookup_dialogue, character, user_message, lookup)
+
+                if not response:
+                    # Use Gemini AI if no exact or close match found
+                    response = await generate_gemini_response(character, user_message, bypass_cache)
+        except Overloaded:
+            return await send_json(send, 503, {"error": "Too many requests in flight, try again shortly"})
+
+    end_time = time.time()
+    print(f"Response Time: {round((end_time - start_time) * 1000, 2)}ms")
+
+    await send_json(send, 200, {"character": character, "response": response})
+
+
+def sse_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8")
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def chat_stream(scope, receive, send):
+    """Streams the reply as Server-Sent Events; stops generating if the client disconnects."""
+    try:
+        await wait_warm()
+        request_args = parse_chat_request(load_json(await read_body(receive)), dict(scope.get("headers", [])))
+    except ValueError as e:
+        return await send_json(send, 400, {"error": str(e)})
+    except AmbiguousCharacter as e:
+        return await send_json(send, 409, e.report)
+    except NotReady:
+        return await send_json(send, 503, {"error": "Server failed to start", **warmup.snapshot()})
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),  # Keep reverse proxies from buffering the stream
+        ],
+    })
+
+    async def pump():
+        try:
+            async for event in stream_reply(*request_args):
+                await send({"type": "http.response.body", "body": sse_event(event), "more_body": True})
+        except Overloaded:
+            error = {"type": "error", "error": "Too many requests in flight, try again shortly"}
+            await send({"type": "http.response.body", "body": sse_event(error), "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    pump_task = asyncio.create_task(pump())
+    disconnect_task = asyncio.create_task(wait_for_disconnect(receive))
+    await asyncio.wait({pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+
+    for task in (pump_task, disconnect_task):
+        if not task.done():
+            task.cancel()
+    await asyncio.gather(pump_task, disconnect_task, return_exceptions=True)
+
+
+async def chat_ws(scope, receive, send):
+    """
+    WebSocket chat: each text message is a /chat request body and is answered with
+    {"type": "token"} messages followed by {"type": "done"}. A new request or
+    {"type": "cancel"} stops the reply in progress, as does disconnecting.
+    """
+    if (await receive())["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+
+    async def ws_send(event):
+        await send({"type": "websocket.send", "text": json.dumps(event)})
+
+    async def pump(request_args):
+        try:
+            async for event in stream_reply(*request_args):
+                await ws_send(event)
+        except Overloaded:
+            await ws_send({"type": "error", "error": "Too many requests in flight, try again shortly"})
+
+    current = None
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message["type"] != "websocket.receive":
+                continue
+
+            if current is not None and not current.done():
+                current.cancel()
+
+            try:
+                data = load_json(message.get("text") or message.get("bytes"))
+                if isinstance(data, dict) and data.get("type") == "cancel":
+                    continue
+                await wait_warm()
+                request_args = parse_chat_request(data)
+            except ValueError as e:
+                await ws_send({"type": "error", "error": str(e)})
+                continue
+            except AmbiguousCharacter as e:
+                await ws_send({"type": "error", **e.report})
+                continue
+            except NotReady:
+                await ws_send({"type": "error", "error": "Server failed to start"})
+                continue
+            current = asyncio.create_task(pump(request_args))
+    finally:
+        if current is not None and not current.done():
+            current.cancel()
+            await asyncio.gather(current, return_exceptions=True)
+
+
+async def stream_stats_view(scope, receive, send):
+    """Time-to-first-token percentiles and stream outcome counters."""
+    await send_json(send, 200, stream_stats.snapshot())
+
+
+async def cache_stats(scope, receive, send):
+    """Hit/miss counters for the response cache."""
+    await send_json(send, 200, response_cache.snapshot())
+
+
+async def singleflight_stats(scope, receive, send):
+    """How many generations were coalesced into an in-flight one."""
+    await send_json(send, 200, llm_flight.snapshot())
+
+
+async def metrics_view(scope, receive, send):
+    """Prometheus metrics: per-stage latency histograms, tier hit/miss counters, in-flight gauges."""
+    body, content_type = render()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def ready(scope, receive, send):
+    """200 once the indexes and Gemini clients are loaded, 503 before (for load balancer readiness checks)."""
+    await send_json(send, 200 if warmup.ready.is_set() else 503, warmup.snapshot())
+
+
+async def latency_stats(scope, receive, send):
+    """Latency mode: speculative calls cancelled by a DB answer, hedged calls and the quota they cost."""
+    if not LATENCY_MODE:
+        return await send_json(send, 200, {"latency_mode": False})
+    await send_json(send, 200, {"latency_mode": True, "speculation": speculation_stats.snapshot(), "hedging": hedger.snapshot()})
+
+
+async def llm_stats(scope, receive, send):
+    """Per-key Gemini quota, load and circuit breaker state."""
+    await send_json(send, 200, llm.stats() if hasattr(llm, "stats") else {})
+
+
+ROUTES = {
+    ("POST", "/chat"): chat,
+    ("POST", "/chat/stream"): chat_stream,
+    ("GET", "/cache/stats"): cache_stats,
+    ("GET", "/stream/stats"): stream_stats_view,
+    ("GET", "/singleflight/stats"): singleflight_stats,
+    ("GET", "/llm/stats"): llm_stats,
+    ("GET", "/latency/stats"): latency_stats,
+    ("GET", "/metrics"): metrics_view,
+    ("GET", "/ready"): ready,
+}
+
+WEBSOCKET_ROUTES = {
+    "/chat/ws": chat_ws,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            db_executor.shutdown(wait=True)
+            dialogue_lookup.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application."""
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "websocket":
+        handler = WEBSOCKET_ROUTES.get(scope["path"])
+        if handler is None:
+            return await send({"type": "websocket.close", "code": 4404})
+        return await handler(scope, receive, send)
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        allowed = [method for method, path in ROUTES if path == scope["path"]]
+        if allowed:
+            return await send_json(send, 405, {"error": "Method not allowed"})
+        return await send_json(send, 404, {"error": "Not found"})
+
+    await handler(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", "8000")))
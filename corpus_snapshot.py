@@ -0,0 +1,314 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
+from rapidfuzz import utils
+
+from fuzzy_index import (
+    DB_FILE, MIN_LENGTH_RATIO, MIN_TOKEN_LENGTH, PREFILTER_TOKENS, RELOAD_CHECK_INTERVAL, SCAN_CHUNK_LINES,
+    SCAN_FALLBACK_RATIO, SCORE_CUTOFF, best_match, chunk_scan, db_signature, load_character_lines, prefilter_tokens,
+)
+
+SNAPSHOT_DIR = "corpus_snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_NAME_PATTERN = re.compile(r"v\d+-[0-9a-f]+")
+
+
+def write_strings(out_dir, name, strings):
+    """Concatenated UTF-8 in <name>.bin, with <name>_offsets.npy (n + 1 byte offsets) to slice it."""
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    with open(os.path.join(out_dir, f"{name}.bin"), "wb") as file:
+        for i, text in enumerate(strings):
+            data = text.encode("utf-8")
+            file.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    np.save(os.path.join(out_dir, f"{name}_offsets.npy"), offsets)
+
+
+def map_file(path):
+    """Read-only shared mapping of a whole file (an empty file maps to b"")."""
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def map_array(path):
+    """A .npy file as a plain ndarray over a read-only mapping (np.memmap indexing is several times slower)."""
+    return np.load(path, mmap_mode="r").view(np.ndarray)
+
+
+def build_snapshot(db_file=DB_FILE, out_dir=SNAPSHOT_DIR):
+    """
+    Writes the fuzzy-match corpus to out_dir as flat files: every line grouped
+    by character (lines.bin, processed.bin and their offsets), lengths.npy, and
+    token postings over global line numbers (tokens.txt, token_offsets.npy,
+    postings.npy). meta.json maps each character to its [start, end) lines
+    and names the DB it was built from.
+    """
+    start = time.time()
+    character_lines = load_character_lines(db_file)
+
+    lines, processed, characters = [], [], {}
+    for character in sorted(character_lines):
+        characters[character] = [len(lines), len(lines) + len(character_lines[character])]
+        lines.extend(character_lines[character])
+        processed.extend(utils.default_process(line) for line in character_lines[character])
+
+    # Line numbers are appended in order, so every posting list comes out sorted
+    postings = {}
+    for i, text in enumerate(processed):
+        for token in set(text.split()):
+            if len(token) >= MIN_TOKEN_LENGTH:
+                postings.setdefault(token, []).append(i)
+    tokens = sorted(postings)
+    token_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    token_offsets[1:] = np.cumsum([len(postings[token]) for token in tokens])
+    flat_postings = np.fromiter((i for token in tokens for i in postings[token]), dtype=np.int32, count=int(token_offsets[-1]))
+
+    os.makedirs(out_dir, exist_ok=True)
+    write_strings(out_dir, "lines", lines)
+    write_strings(out_dir, "processed", processed)
+    np.save(os.path.join(out_dir, "lengths.npy"), np.array([len(text) for text in processed], dtype=np.int32))
+    np.save(os.path.join(out_dir, "token_offsets.npy"), token_offsets)
+    np.save(os.path.join(out_dir, "postings.npy"), flat_postings)
+    with open(os.path.join(out_dir, "tokens.txt"), "w", encoding="utf-8") as file:
+        file.write("\n".join(tokens))  # default_process leaves no newlines in a token
+
+    meta = {"version": SNAPSHOT_VERSION, "db_file": os.path.abspath(db_file), "count": len(lines), "characters": characters}
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+
+    print(f"✅ Snapshot of {len(lines)} lines, {len(tokens)} tokens written to {out_dir} in {time.time() - start:.1f}s")
+    return meta
+
+
+def snapshot_path(db_file=DB_FILE, root=SNAPSHOT_DIR):
+    """Directory for a snapshot of the DB as it is now: named by format version and DB signature."""
+    state = json.dumps([os.path.basename(db_file), db_signature(db_file)])
+    return os.path.join(root, f"v{SNAPSHOT_VERSION}-{hashlib.sha1(state.encode('utf-8')).hexdigest()[:16]}")
+
+
+def snapshot_source(snapshot_dir):
+    """Absolute path of the DB a snapshot was built from, or None if its meta.json can't be read."""
+    try:
+        with open(os.path.join(snapshot_dir, "meta.json"), encoding="utf-8") as file:
+            return os.path.abspath(json.load(file)["db_file"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def ensure_snapshot(db_file=DB_FILE, root=SNAPSHOT_DIR):
+    """
+    Returns the snapshot directory for the DB's current state, building it only
+    if no earlier run did. Snapshots of the same DB's older states are removed;
+    processes still using one keep their mappings. Other DBs' snapshots under
+    the same root are left alone.
+    """
+    path = snapshot_path(db_file, root)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return path
+
+    # Built under a private name and renamed into place, so a reader never sees half a snapshot
+    building = os.path.join(root, f".building-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(building, ignore_errors=True)
+    build_snapshot(db_file, building)
+    try:
+        os.rename(building, path)
+    except OSError:
+        shutil.rmtree(building, ignore_errors=True)  # Another process finished the same snapshot first
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            raise
+
+    db_path = os.path.abspath(db_file)
+    for name in os.listdir(root):
+        other = os.path.join(root, name)
+        if SNAPSHOT_NAME_PATTERN.fullmatch(name) and name != os.path.basename(path) and snapshot_source(other) == db_path:
+            shutil.rmtree(other, ignore_errors=True)
+    return path
+
+
+class SnapshotTables:
+    """The mapped files of one snapshot directory."""
+
+    __slots__ = ("snapshot_dir", "meta", "characters", "lines", "line_offsets", "processed", "processed_offsets",
+                 "lengths", "token_offsets", "postings", "token_ids")
+
+    def __init__(self, snapshot_dir):
+        with open(os.path.join(snapshot_dir, "meta.json"), encoding="utf-8") as file:
+            self.meta = json.load(file)
+        if self.meta["version"] != SNAPSHOT_VERSION:
+            raise RuntimeError(f"Snapshot in {snapshot_dir} is version {self.meta['version']}, expected {SNAPSHOT_VERSION}")
+
+        self.snapshot_dir = snapshot_dir
+        self.characters = self.meta["characters"]
+        self.lines = map_file(os.path.join(snapshot_dir, "lines.bin"))
+        self.line_offsets = map_array(os.path.join(snapshot_dir, "lines_offsets.npy"))
+        self.processed = map_file(os.path.join(snapshot_dir, "processed.bin"))
+        self.processed_offsets = map_array(os.path.join(snapshot_dir, "processed_offsets.npy"))
+        self.lengths = map_array(os.path.join(snapshot_dir, "lengths.npy"))
+        self.token_offsets = map_array(os.path.join(snapshot_dir, "token_offsets.npy"))
+        self.postings = map_array(os.path.join(snapshot_dir, "postings.npy"))
+        with open(os.path.join(snapshot_dir, "tokens.txt"), encoding="utf-8") as file:
+            tokens = file.read()
+        self.token_ids = {token: i for i, token in enumerate(tokens.split("\n"))} if tokens else {}
+
+
+class CorpusSnapshot:
+    """
+    Read-only FuzzyIndex over a snapshot written by build_snapshot().
+
+    Lines, lengths and postings stay memory-mapped, so processes that open the
+    same snapshot (or fork after opening it) share one copy of it in the page
+    cache instead of each holding millions of small Python strings. Opening one
+    takes milliseconds where building a FuzzyIndex takes seconds. Only the
+    candidate lines of a query are decoded (a full scan decodes one chunk of
+    lines per string).
+
+    A snapshot opened by directory never changes (prefork.py swaps workers
+    instead). One opened with for_db() moves to a fresh snapshot in
+    maybe_reload() when the DB changes.
+    """
+
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, prefilter=True, db_file=None, root=None):
+        self.prefilter = prefilter
+        self.db_file = db_file
+        self.root = root
+        self._tables = SnapshotTables(snapshot_dir)
+        self._last_check = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_db(cls, db_file=DB_FILE, root=SNAPSHOT_DIR, prefilter=True):
+        """The snapshot of the DB's current state, built now if no earlier run left one in root."""
+        return cls(ensure_snapshot(db_file, root), prefilter, db_file, root)
+
+    @property
+    def snapshot_dir(self):
+        return self._tables.snapshot_dir
+
+    def __len__(self):
+        return self._tables.meta["count"]
+
+    def maybe_reload(self):
+        """For for_db() snapshots: switches to a snapshot of the DB's new state if it changed, checking at most every few seconds."""
+        if self.root is None:
+            return False
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return False
+        with self._lock:
+            if now - self._last_check < RELOAD_CHECK_INTERVAL:
+                return False
+            self._last_check = now
+            path = snapshot_path(self.db_file, self.root)
+            if path == self._tables.snapshot_dir:
+                return False
+            self._tables = SnapshotTables(ensure_snapshot(self.db_file, self.root))
+            return True
+
+    @staticmethod
+    def _texts(blob, offsets, rows):
+        """Decodes the given lines, slicing the mapping with offsets fetched in one go."""
+        starts, ends = offsets[rows].tolist(), offsets[rows + 1].tolist()
+        return [blob[start:end].decode("utf-8") for start, end in zip(starts, ends)]
+
+    def _candidates(self, tables, character, query):
+        start, end = tables.characters[character]
+        min_length = len(query) * MIN_LENGTH_RATIO
+        tokens = prefilter_tokens(query)
+        if not self.prefilter or not tokens:
+            rows = np.arange(start, end)
+            return rows[tables.lengths[start:end] >= min_length]
+
+        postings = []
+        span = np.array((start, end), dtype=tables.postings.dtype)  # Same dtype, or searchsorted casts the whole posting list
+        for token in tokens:
+            token_id = tables.token_ids.get(token)
+            if token_id is None:
+                postings.append(())
+                continue
+            # The token's postings over every character, cut down to this character's line range
+            posting = tables.postings[tables.token_offsets[token_id]:tables.token_offsets[token_id + 1]]
+            low, high = posting.searchsorted(span)
+            postings.append(posting[low:high])
+
+        postings.sort(key=len)
+        rows = np.unique(np.concatenate([np.asarray(posting, dtype=np.int32) for posting in postings[:PREFILTER_TOKENS]]))
+        return rows[tables.lengths[rows] >= min_length]
+
+    def _scan(self, tables, character, query, score_cutoff):
+        """CharacterCorpus.scan() over the snapshot. A chunk is one slice of processed.bin, decoded in one go."""
+        start, end = tables.characters[character]
+        bounds = list(range(start, end, SCAN_CHUNK_LINES)) + [end]
+        offsets = tables.processed_offsets[bounds].tolist()
+        chunks = [tables.processed[low:high].decode("utf-8") for low, high in zip(offsets, offsets[1:])]
+
+        def best_rows(rows, cutoff):
+            if not len(rows):
+                return None
+            match = best_match(query, self._texts(tables.processed, tables.processed_offsets, rows), cutoff)
+            return None if match is None else (rows[match[0]:match[0] + 1], match[1])
+
+        def best_line(chunk, cutoff):
+            rows = np.arange(bounds[chunk], bounds[chunk + 1])
+            return best_rows(rows[tables.lengths[rows] >= len(query)], cutoff)
+
+        best = chunk_scan(query, chunks, best_line, score_cutoff)
+        if best is not None and best[1] == 100:
+            return best
+
+        lengths = tables.lengths[start:end]
+        rows = start + np.flatnonzero((lengths >= len(query) * MIN_LENGTH_RATIO) & (lengths < len(query)))
+        match = best_rows(rows, score_cutoff if best is None else best[1])
+        return match if match is not None and (best is None or match[1] > best[1]) else best
+
+    def candidates(self, character, query):
+        """Global line numbers worth scoring against an already preprocessed query."""
+        return self._candidates(self._tables, character, query)
+
+    def num_candidates(self, character, user_message):
+        """How many lines the prefilter leaves for this message (search() scans instead above SCAN_FALLBACK_RATIO)."""
+        if character not in self._tables.characters:
+            return 0
+        return len(self.candidates(character, utils.default_process(user_message)))
+
+    def search(self, character, user_message, score_cutoff=SCORE_CUTOFF):
+        """Returns (line, score) for the character's closest line, or None below score_cutoff."""
+        tables = self._tables  # One snapshot for the whole lookup, even if a reload swaps it meanwhile
+        query = utils.default_process(user_message)
+        if character not in tables.characters or not query:
+            return None
+
+        start, end = tables.characters[character]
+        candidates = self._candidates(tables, character, query) if self.prefilter and prefilter_tokens(query) else None
+        if candidates is None or len(candidates) > (end - start) * SCAN_FALLBACK_RATIO:
+            match = self._scan(tables, character, query, score_cutoff)
+            if match is None:
+                return None
+            rows, score = match
+            return self._texts(tables.lines, tables.line_offsets, rows)[0], score
+
+        if not len(candidates):
+            return None
+        match = best_match(query, self._texts(tables.processed, tables.processed_offsets, candidates), score_cutoff)
+        if match is None:
+            return None
+        position, score = match
+        return self._texts(tables.lines, tables.line_offsets, candidates[position:position + 1])[0], score
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the memory-mapped fuzzy-match snapshot of the dialogue corpus.")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--root", default=SNAPSHOT_DIR, help="directory holding the versioned snapshots")
+    args = parser.parse_args()
+
+    print(f"📦 {ensure_snapshot(args.db, args.root)}")
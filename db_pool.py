@@ -0,0 +1,116 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_FILE = "movie_dialogues.db"
+
+# Read-side tuning, applied once per connection
+MMAP_SIZE = 256 * 1024 * 1024  # Map up to 256 MB of the DB file into memory
+CACHE_SIZE_KB = 64 * 1024  # 64 MB page cache per connection
+STATEMENT_CACHE_SIZE = 64  # Prepared statements kept per connection
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))  # Connections kept per DB file (per shard), shared by all threads
+
+
+def connect_readonly(db_file=DB_FILE):
+    """Opens a tuned, read-only connection to the dialogue database."""
+    # mode=ro refuses writes and never creates the file by accident
+    conn = sqlite3.connect(
+        f"file:{db_file}?mode=ro",
+        uri=True,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA query_only = ON")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.close()
+    return conn
+
+
+class ReadOnlyConnectionPool:
+    """
+    Keeps up to POOL_SIZE long-lived, read-only SQLite connections and checks
+    one out per `with pool.connection()` block.
+
+    A connection belongs to one reader at a time, not to a thread, so a server
+    that starts a thread per request still holds at most POOL_SIZE connections;
+    extra readers wait for a checkin. In WAL mode each connection sees the
+    latest committed snapshot when a new read transaction starts, so the ingest
+    script can keep writing while the server is up. With persistent=False every
+    checkout opens and closes its own connection, which is the old per-request
+    behaviour (useful for benchmarks).
+    """
+
+    def __init__(self, db_file=DB_FILE, persistent=True, size=POOL_SIZE):
+        self.db_file = db_file
+        self.persistent = persistent
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()  # Most recently used first, so its page cache is warm
+        self._connections = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _checkout(self):
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            opened = len(self._connections) < self.size
+            if opened:
+                conn = connect_readonly(self.db_file)
+                self._connections.append(conn)
+        return conn if opened else self._idle.get()
+
+    def _checkin(self, conn):
+        # End the implicit read transaction so the next checkout sees fresh WAL data
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            return  # Closed by close() while checked out
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Yields a read-only connection, returned to the pool when the block exits."""
+        if not self.persistent:
+            conn = connect_readonly(self.db_file)
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    def open_connections(self):
+        """How many connections the pool currently holds (idle or checked out)."""
+        with self._lock:
+            return len(self._connections)
+
+    def close(self):
+        """Closes every connection the pool has opened. Safe to call twice."""
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass  # Connection in use during shutdown
@@ -0,0 +1,402 @@
+import atexit
+import json
+import os
+import re
+import threading
+
+from metrics import record_tier, track_stage
+from dialogue_schema import has_line_index, find_best_line, find_best_lines
+from request_log import RequestLog
+from shards import ShardRouter
+
+# Shared by every entry point (Flask, ASGI, Streamlit) so the lookup tiers behave the same everywhere.
+# A shard manifest (see shards.py) works here too
+DB_FILE = os.environ.get("DIALOGUE_DB", "movie_dialogues.db")
+VECTOR_INDEX_DIR = "vector_index"
+REPLY_INDEX_DIR = "reply_index"
+REPLY_MATCH_THRESHOLD = 80  # rapidfuzz token_sort_ratio between the message and a stored cue
+FUZZY_MATCH_THRESHOLD = 80  # rapidfuzz partial_ratio a fuzzy match must beat
+VECTOR_MATCH_THRESHOLD = 0.75  # Cosine similarity needed to answer with a stored line
+# Where the versioned fuzzy-corpus snapshots live (default: next to the DB); "" builds the corpus in memory instead
+SNAPSHOT_ROOT = os.environ.get("CORPUS_SNAPSHOT_ROOT")
+
+router = None
+fuzzy_index = None
+vector_index = None
+reply_index = None
+alias_index = None
+
+# Requests that fall through to the LLM, for warm_cache.py to mine (REQUEST_LOG=path)
+request_log = RequestLog.from_env()
+
+# Set once the indexes are loaded. Importing this module loads nothing, so a server can
+# start listening first; the first lookup (or the startup warm-up) calls ensure_configured()
+configured = threading.Event()
+_configure_lock = threading.Lock()
+
+
+def configure(db_file=DB_FILE, vector_index_dir=VECTOR_INDEX_DIR, snapshot_dir=None, reply_index_dir=REPLY_INDEX_DIR):
+    """
+    (Re)builds the connection pool and indexes for a dialogue database.
+
+    The fuzzy tier is mapped from a snapshot of the DB (see corpus_snapshot.py):
+    the one in snapshot_dir when given, which never reloads, otherwise the
+    versioned snapshot under SNAPSHOT_ROOT, built first if no earlier run left
+    one for this DB state.
+    """
+    with _configure_lock:
+        _configure(db_file, vector_index_dir, snapshot_dir, reply_index_dir)
+
+
+def ensure_configured():
+    """Loads the default DB's indexes unless that already happened. Cheap once it has."""
+    if not configured.is_set():
+        with _configure_lock:
+            if not configured.is_set():
+                _configure(DB_FILE, VECTOR_INDEX_DIR, None, REPLY_INDEX_DIR)
+
+
+def _configure(db_file, vector_index_dir, snapshot_dir, reply_index_dir):
+    global router, fuzzy_index, vector_index, reply_index, alias_index
+    # The index modules pull in numpy and rapidfuzz, so they load here rather than at import
+    from alias_index import AliasIndex
+    from corpus_snapshot import SNAPSHOT_DIR, CorpusSnapshot
+    from fuzzy_index import FuzzyIndex
+    from reply_index import ReplyIndex
+    from vector_index import VectorIndex
+
+    if router is not None:
+        router.close()
+
+    # One read-only connection per server thread and shard, reused across requests
+    router = ShardRouter(db_file)
+
+    # Every character's lines, preprocessed for fuzzy matching and mapped from disk (shared between processes)
+    snapshot_root = SNAPSHOT_ROOT if SNAPSHOT_ROOT is not None else os.path.join(os.path.dirname(db_file), SNAPSHOT_DIR)
+    if snapshot_dir:
+        fuzzy_index = CorpusSnapshot(snapshot_dir)
+    elif snapshot_root:
+        try:
+            fuzzy_index = CorpusSnapshot.for_db(db_file, snapshot_root)
+        except Exception as e:
+            print(f"⚠️ No corpus snapshot for {db_file} ({e}), building the fuzzy index in memory")
+            fuzzy_index = FuzzyIndex(db_file)
+    else:
+        fuzzy_index = FuzzyIndex(db_file)
+
+    # Requested names ("Jessep", "SMITH in The Matrix") -> stored character names
+    alias_index = AliasIndex(db_file)
+
+    # Offline vector index for semantic matches and RAG context (built with `python vector_index.py`)
+    vector_index = _load_current(VectorIndex, vector_index_dir, db_file)
+
+    # Offline cue -> reply index, so the character answers the message instead of echoing it (`python reply_index.py`)
+    reply_index = _load_current(ReplyIndex, reply_index_dir, db_file)
+    configured.set()
+
+
+def _load_current(index_class, index_dir, db_file):
+    """
+    The offline index in index_dir, or None when it was not built or was built
+    before db_file's last write (its stored line ids may name other lines now).
+    """
+    index = index_class.load_if_exists(index_dir) if index_dir else None
+    if index is not None and not index.is_current(db_file):
+        print(f"⚠️ {index_dir} is older than {db_file}, ignoring it until it is rebuilt")
+        return None
+    return index
+
+
+def _drop_stale_indexes():
+    """Disables the offline indexes the DB has changed under."""
+    global vector_index, reply_index
+    if vector_index is not None and not vector_index.is_current(router.db_file):
+        print(f"⚠️ {router.db_file} changed, the semantic tier is off until the vector index is rebuilt")
+        vector_index = None
+    if reply_index is not None and not reply_index.is_current(router.db_file):
+        print(f"⚠️ {router.db_file} changed, the reply tier is off until the reply index is rebuilt")
+        reply_index = None
+
+
+def close():
+    """Closes the pooled connections."""
+    if router is not None:
+        router.close()
+
+
+def refresh_indexes():
+    """Rebuilds the in-memory indexes if the DB changed (checked at most every few seconds)."""
+    if fuzzy_index.maybe_reload():
+        alias_index.reload()
+        _drop_stale_indexes()
+
+
+def resolve_character(character, script=None):
+    """
+    Resolves a requested character name to the stored one (see alias_index.py).
+    In-memory only once configured, so it is cheap enough to run on an event loop.
+    """
+    ensure_configured()
+    return alias_index.resolve(character, script)
+
+
+def clean_text(text):
+    """Removes unwanted characters and formatting from dialogues."""
+    text = re.sub(r"\s+", " ", text)  # Replace multiple spaces/newlines with a single space
+    text = text.strip()  # Trim leading/trailing spaces
+    return text
+
+
+def fetch_dialogue(character, user_message, script=None):
+    """
+    Fetches the closest matching dialogue for the character from SQLite. With a
+    script (the scope of "JOHN in Titanic"), every tier answers from that script only.
+    """
+    ensure_configured()
+    script_lines = fetch_script_lines(character, script) if script else None
+
+    # What the character said back to a line like this one, when the reply index is built
+    if reply_index is not None:
+        with track_stage("db_reply"):
+            reply = fetch_reply(character, user_message, script_lines)
+        record_tier("db_reply", reply)
+        if reply:
+            return reply
+
+    with track_stage("db_exact"):
+        exact_match = fetch_exact(character, user_message, script)
+    record_tier("db_exact", exact_match)
+
+    # If exact match found, return it
+    if exact_match:
+        return exact_match
+
+    # If no exact match, perform fuzzy search over the preloaded lines
+    refresh_indexes()
+    with track_stage("db_fuzzy"):
+        fuzzy_match = fuzzy_search(character, user_message, script_lines)
+    fuzzy_hit = fuzzy_match is not None and fuzzy_match[1] > FUZZY_MATCH_THRESHOLD
+    record_tier("db_fuzzy", fuzzy_hit)
+
+    # If match confidence is high enough, return it
+    if fuzzy_hit:
+        return clean_text(fuzzy_match[0])
+
+    # Last try: a line that says the same thing in other words
+    semantic_index = vector_index  # refresh_indexes() may drop it from another thread
+    if semantic_index is not None:
+        texts = []
+        with track_stage("db_semantic"):
+            semantic_match = semantic_index.search(user_message, k=1, character=character, line_ids=script_lines)
+            if semantic_match and semantic_match[0][1] >= VECTOR_MATCH_THRESHOLD:
+                texts = router.fetch_line_texts([semantic_match[0][0]])
+        record_tier("db_semantic", texts)
+        if texts:
+            return clean_text(texts[0])
+
+    if request_log is not None:
+        request_log.record(character, user_message)
+    return None  # No suitable match found
+
+
+def fetch_dialogues_batch(pairs):
+    """
+    fetch_dialogue for many (character, user_message) pairs at once; a pair may carry a
+    third item, the script to answer from. The exact tier is answered with one set-based
+    query; only the misses go on to the in-memory tiers.
+    Returns a list aligned with pairs, holding None where nothing matched.
+    """
+    ensure_configured()
+    # Each scoped pair's script lines, read once per (character, script)
+    scopes = [(pair[0], pair[2]) if len(pair) > 2 and pair[2] else None for pair in pairs]
+    loaded = {scope: fetch_script_lines(*scope) for scope in set(scopes) if scope is not None}
+    script_lines = [loaded.get(scope) for scope in scopes]
+
+    replies = fetch_replies(pairs, script_lines)
+    with track_stage("db_exact"):
+        pending = [index for index in range(len(pairs)) if index not in replies]
+        exact_matches = {
+            pending[position]: line
+            for position, line in fetch_exact_batch([pairs[index] for index in pending]).items()
+        }
+
+    refresh_indexes()
+    results = []
+    for index, (character, user_message, *_) in enumerate(pairs):
+        if index in replies:
+            results.append(replies[index])
+            continue
+
+        record_tier("db_exact", index in exact_matches)
+        if index in exact_matches:
+            results.append(clean_text(exact_matches[index]))
+            continue
+
+        with track_stage("db_fuzzy"):
+            fuzzy_match = fuzzy_search(character, user_message, script_lines[index])
+        fuzzy_hit = fuzzy_match is not None and fuzzy_match[1] > FUZZY_MATCH_THRESHOLD
+        record_tier("db_fuzzy", fuzzy_hit)
+        if fuzzy_hit:
+            results.append(clean_text(fuzzy_match[0]))
+            continue
+
+        results.append(None)
+
+    # Semantic tier: a single DB round trip fetches every line it picks
+    semantic_index = vector_index
+    if semantic_index is not None:
+        semantic_ids = {}
+        for index, (character, user_message, *_) in enumerate(pairs):
+            if results[index] is None:
+                semantic_match = semantic_index.search(user_message, k=1, character=character,
+                                                       line_ids=script_lines[index])
+                if semantic_match and semantic_match[0][1] >= VECTOR_MATCH_THRESHOLD:
+                    semantic_ids[index] = semantic_match[0][0]
+        if semantic_ids:
+            texts = dict(zip(semantic_ids.values(), router.fetch_line_texts(list(semantic_ids.values()))))
+            for index, line_id in semantic_ids.items():
+                if line_id in texts:
+                    results[index] = clean_text(texts[line_id])
+
+    if request_log is not None:
+        for (character, user_message, *_), result in zip(pairs, results):
+            if result is None:
+                request_log.record(character, user_message)
+    return results
+
+
+def fetch_script_lines(character, script):
+    """
+    {line id: text} for the character's lines in one script, which a scoped lookup's
+    in-memory tiers are narrowed to. Legacy blob DBs have no line ids, so theirs are numbered.
+    """
+    if not router.sharded:
+        with router.connection() as conn:
+            if not has_line_index(conn):
+                row = conn.execute(
+                    "SELECT dialogues FROM movie_dialogues WHERE character_name = ? AND script_name = ?", (character, script)
+                ).fetchone()
+                return dict(enumerate(row[0].split(" | "))) if row else {}
+    return router.fetch_script_lines(character, script)
+
+
+def fuzzy_search(character, user_message, script_lines=None):
+    """The fuzzy index's (line, score) for the character, or the same scoring over script_lines when scoped."""
+    if script_lines is None:
+        return fuzzy_index.search(character, user_message)
+    from fuzzy_index import search_lines
+    return search_lines(list(script_lines.values()), user_message)
+
+
+def fetch_reply(character, user_message, script_lines=None):
+    """
+    The character's reply to the stored cue closest to the message (see reply_index.py), or None.
+    script_lines (from fetch_script_lines) keeps the reply within one script.
+    """
+    ensure_configured()
+    index = reply_index  # refresh_indexes() may drop it from another thread
+    if index is None:
+        return None
+    match = index.search(user_message, character, REPLY_MATCH_THRESHOLD, script_lines)
+    texts = router.fetch_line_texts([match[0]]) if match else []
+    return clean_text(texts[0]) if texts else None
+
+
+def fetch_replies(pairs, script_lines=None):
+    """fetch_reply for many pairs: {index into pairs: reply}, the replies read in one DB round trip."""
+    replies_index = reply_index
+    if replies_index is None:
+        return {}
+    script_lines = script_lines or [None] * len(pairs)
+    with track_stage("db_reply"):
+        reply_ids = {}
+        for index, (character, user_message, *_) in enumerate(pairs):
+            match = replies_index.search(user_message, character, REPLY_MATCH_THRESHOLD, script_lines[index])
+            if match:
+                reply_ids[index] = match[0]
+        texts = router.fetch_line_texts_by_id(list(set(reply_ids.values())))
+
+    replies = {index: clean_text(texts[line_id]) for index, line_id in reply_ids.items() if line_id in texts}
+    for index in range(len(pairs)):
+        record_tier("db_reply", index in replies)
+    return replies
+
+
+def fetch_exact(character, user_message, script=None):
+    """Exact tier through the shard router. Legacy blob DBs are never sharded, so they keep the single-file path."""
+    if router.sharded:
+        best_line = router.find_best_line(character, user_message, script)
+        return clean_text(best_line) if best_line else None
+    with router.connection() as conn:
+        return fetch_exact_dialogue(conn, character, user_message, script)
+
+
+def fetch_exact_batch(pairs):
+    """fetch_exact for many pairs, optionally scoped like fetch_dialogues_batch's: {index into pairs: line}."""
+    if router.sharded:
+        return router.find_best_lines(pairs)
+    with router.connection() as conn:
+        return fetch_exact_dialogues(conn, pairs)
+
+
+def fetch_exact_dialogues(conn, pairs):
+    """Exact tier for many pairs: {index into pairs: line}."""
+    if has_line_index(conn):
+        return find_best_lines(conn, pairs)
+
+    # Legacy blobs: one correlated LIKE per pair, still a single statement
+    rows = conn.execute("""
+        WITH batch AS (
+            SELECT CAST(key AS INTEGER) AS idx,
+                   json_extract(value, '$[0]') AS character_name,
+                   json_extract(value, '$[1]') AS pattern,
+                   json_extract(value, '$[2]') AS script_name
+            FROM json_each(?)
+        )
+        SELECT idx, (
+            SELECT dialogues FROM movie_dialogues AS m
+            WHERE m.character_name = batch.character_name AND m.dialogues LIKE batch.pattern
+              AND (batch.script_name IS NULL OR m.script_name = batch.script_name)
+            ORDER BY LENGTH(dialogues) ASC
+            LIMIT 1
+        ) FROM batch
+    """, (json.dumps([[character, f"% {user_message} %", *script] for character, user_message, *script in pairs]),)).fetchall()
+    return {idx: text for idx, text in rows if text is not None}
+
+
+def fetch_exact_dialogue(conn, character, user_message, script=None):
+    """Looks for a stored line that contains the message word for word."""
+    cursor = conn.cursor()
+
+    # Try to find an **exact** dialogue match first, through the FTS index when the DB has one
+    if has_line_index(conn):
+        best_line = find_best_line(conn, character, user_message, script)
+        if best_line:
+            return clean_text(best_line)
+    else:
+        cursor.execute("""
+            SELECT dialogues FROM movie_dialogues
+            WHERE character_name = ? AND dialogues LIKE ? AND (? IS NULL OR script_name = ?)
+            ORDER BY LENGTH(dialogues) ASC
+            LIMIT 1
+        """, (character, f"% {user_message} %", script, script))  # Space-padding ensures better matching
+
+        result = cursor.fetchone()
+        if result:
+            return clean_text(result[0])
+
+    return None
+
+
+def retrieve_context(character, user_message, k=3):
+    """The character's lines closest to the message, for grounding the Gemini prompt."""
+    ensure_configured()
+    semantic_index = vector_index
+    if semantic_index is None:
+        return []
+
+    line_ids = [line_id for line_id, _ in semantic_index.search(user_message, k=k, character=character)]
+    return [clean_text(text) for text in router.fetch_line_texts(line_ids)]
+
+
+atexit.register(close)
@@ -0,0 +1,313 @@
+import json
+import re
+import sqlite3
+import sys
+
+DB_FILE = "movie_dialogues.db"
+
+# The original one-row-per-character store: every line of a character in a script, ' | '-joined
+LEGACY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS movie_dialogues (
+    script_name TEXT NOT NULL,
+    character_name TEXT NOT NULL,
+    dialogues TEXT NOT NULL,
+    PRIMARY KEY (script_name, character_name)
+);
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialogue_lines (
+    id INTEGER PRIMARY KEY,
+    script_name TEXT NOT NULL,
+    character_name TEXT NOT NULL,
+    line_no INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (script_name, character_name, line_no)
+);
+
+CREATE INDEX IF NOT EXISTS idx_dialogue_lines_character
+    ON dialogue_lines (character_name);
+
+-- External-content FTS index: stores only the inverted index, text lives in dialogue_lines
+CREATE VIRTUAL TABLE IF NOT EXISTS dialogue_lines_fts USING fts5(
+    character_name,
+    text,
+    content='dialogue_lines',
+    content_rowid='id',
+    tokenize='unicode61'
+);
+
+-- (cue -> reply) pairs: a line and the line another character spoke just before it
+CREATE TABLE IF NOT EXISTS dialogue_replies (
+    script_name TEXT NOT NULL,
+    character_name TEXT NOT NULL,
+    line_no INTEGER NOT NULL,  -- The reply, the dialogue_lines row with the same three columns
+    cue_character TEXT NOT NULL,
+    cue TEXT NOT NULL,
+    PRIMARY KEY (script_name, character_name, line_no)
+);
+
+CREATE TRIGGER IF NOT EXISTS dialogue_lines_ai AFTER INSERT ON dialogue_lines BEGIN
+    INSERT INTO dialogue_lines_fts (rowid, character_name, text)
+    VALUES (new.id, new.character_name, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS dialogue_lines_ad AFTER DELETE ON dialogue_lines BEGIN
+    INSERT INTO dialogue_lines_fts (dialogue_lines_fts, rowid, character_name, text)
+    VALUES ('delete', old.id, old.character_name, old.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS dialogue_lines_au AFTER UPDATE ON dialogue_lines BEGIN
+    INSERT INTO dialogue_lines_fts (dialogue_lines_fts, rowid, character_name, text)
+    VALUES ('delete', old.id, old.character_name, old.text);
+    INSERT INTO dialogue_lines_fts (rowid, character_name, text)
+    VALUES (new.id, new.character_name, new.text);
+END;
+"""
+
+# bm25 ranks lines where the phrase is a larger share of the text first; ties go to the shorter line.
+# The rank and length come back too, so results from several shards can be merged the same way.
+# A NULL script searches every script the character appears in
+BEST_LINE_QUERY = """
+    SELECT f.rank, LENGTH(l.text), l.text
+    FROM dialogue_lines_fts AS f
+    JOIN dialogue_lines AS l ON l.id = f.rowid
+    WHERE dialogue_lines_fts MATCH ?1 AND l.character_name = ?2 AND (?3 IS NULL OR l.script_name = ?3)
+    ORDER BY f.rank, LENGTH(l.text)
+    LIMIT 1
+"""
+
+# Same ranking for many (character, message) pairs in one statement. The pairs arrive as one
+# JSON parameter, so no temp table is needed on read-only connections. CROSS JOIN pins the
+# join order: one FTS lookup per pair, then a rowid fetch, instead of probing FTS per line.
+BEST_LINES_BATCH_QUERY = """
+    WITH batch AS (
+        SELECT CAST(key AS INTEGER) AS idx,
+               json_extract(value, '$[0]') AS character_name,
+               json_extract(value, '$[1]') AS match_expr,
+               json_extract(value, '$[2]') AS script_name
+        FROM json_each(?)
+    ),
+    ranked AS (
+        SELECT b.idx, f.rank, LENGTH(l.text) AS length, l.text,
+               ROW_NUMBER() OVER (PARTITION BY b.idx ORDER BY f.rank, LENGTH(l.text)) AS position
+        FROM batch AS b
+        CROSS JOIN dialogue_lines_fts AS f
+        CROSS JOIN dialogue_lines AS l
+        WHERE f.dialogue_lines_fts MATCH b.match_expr
+          AND l.id = f.rowid
+          AND l.character_name = b.character_name
+          AND (b.script_name IS NULL OR l.script_name = b.script_name)
+    )
+    SELECT idx, rank, length, text FROM ranked WHERE position = 1
+"""
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def create_schema(conn):
+    """Creates the per-line dialogue table, its FTS5 index and sync triggers."""
+    conn.executescript(SCHEMA)
+
+
+def create_dialogue_tables(conn):
+    """create_schema plus the legacy movie_dialogues table the ingest script still fills."""
+    conn.executescript(LEGACY_SCHEMA)
+    create_schema(conn)
+
+
+def drop_fts_triggers(conn):
+    """
+    Stops syncing the FTS index row by row, for bulk loads. Much faster than
+    per-row triggers, but the index is stale until rebuild_fts_index runs.
+    """
+    for trigger in ("dialogue_lines_ai", "dialogue_lines_ad", "dialogue_lines_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+def rebuild_fts_index(conn):
+    """Re-indexes every dialogue_lines row in one pass and restores the sync triggers."""
+    conn.execute("INSERT INTO dialogue_lines_fts (dialogue_lines_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO dialogue_lines_fts (dialogue_lines_fts) VALUES ('optimize')")
+    create_schema(conn)
+
+
+def has_line_index(conn):
+    """True if the database already carries the dialogue_lines FTS index."""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dialogue_lines_fts'"
+    ).fetchone()
+    return row is not None
+
+
+def fts_phrase(text, column=None):
+    """
+    Turns free text into a safe FTS5 phrase query, e.g. 'You can't!' -> "you can t".
+    Returns None when the text has no searchable tokens.
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if not tokens:
+        return None
+    phrase = '"' + " ".join(tokens) + '"'
+    return f"{column} : {phrase}" if column else phrase
+
+
+def find_ranked_line(conn, character, user_message, script=None):
+    """(rank, length, line) for the best line where the character says the message (in script, if given), or None."""
+    message_phrase = fts_phrase(user_message, "text")
+    character_phrase = fts_phrase(character, "character_name")
+    if message_phrase is None or character_phrase is None:
+        return None
+
+    return conn.execute(
+        BEST_LINE_QUERY, (f"{character_phrase} AND {message_phrase}", character, script)
+    ).fetchone()
+
+
+def find_best_line(conn, character, user_message, script=None):
+    """Returns the single best-ranked line where the character says the message, or None."""
+    ranked = find_ranked_line(conn, character, user_message, script)
+    return ranked[2] if ranked else None
+
+
+def find_ranked_lines(conn, pairs):
+    """
+    Batch version of find_ranked_line: {index into pairs: (rank, length, line)} for every pair that matched.
+    A pair may carry a third item, the script to search in.
+    """
+    batch = []
+    for index, (character, user_message, *script) in enumerate(pairs):
+        message_phrase = fts_phrase(user_message, "text")
+        character_phrase = fts_phrase(character, "character_name")
+        if message_phrase and character_phrase:
+            batch.append((index, [character, f"{character_phrase} AND {message_phrase}", *script]))
+    if not batch:
+        return {}
+
+    # json_each keys are positions in the JSON array, so map them back to the caller's indexes
+    rows = conn.execute(BEST_LINES_BATCH_QUERY, (json.dumps([entry for _, entry in batch]),)).fetchall()
+    return {batch[position][0]: (rank, length, text) for position, rank, length, text in rows}
+
+
+def find_best_lines(conn, pairs):
+    """Batch version of find_best_line: {index into pairs: line} for every (character, message) that matched."""
+    return {index: ranked[2] for index, ranked in find_ranked_lines(conn, pairs).items()}
+
+
+def fetch_script_lines(conn, character, script):
+    """{id: text} for every line the character speaks in one script."""
+    return dict(conn.execute(
+        "SELECT id, text FROM dialogue_lines WHERE character_name = ? AND script_name = ?", (character, script)
+    ).fetchall())
+
+
+def fetch_line_texts_by_id(conn, line_ids):
+    """{id: text} for the dialogue_lines ids that exist."""
+    if not line_ids:
+        return {}
+    placeholders = ",".join("?" * len(line_ids))
+    return dict(conn.execute(f"SELECT id, text FROM dialogue_lines WHERE id IN ({placeholders})", line_ids).fetchall())
+
+
+def fetch_line_texts(conn, line_ids):
+    """Maps dialogue_lines ids to their text, keeping the given order."""
+    rows = fetch_line_texts_by_id(conn, line_ids)
+    return [rows[line_id] for line_id in line_ids if line_id in rows]
+
+
+def find_cues(records):
+    """
+    {line_no: (cue_character, cue)} for (character, line_no, text) records of a
+    whole script: each line's cue is the line right before it, when someone
+    else spoke it. Migrated databases number lines per character rather than
+    per script, so their repeated line_no values yield no cues.
+    """
+    ordered = sorted(records, key=lambda record: record[1])
+    if len({record[1] for record in ordered}) != len(ordered):
+        return {}
+    return {
+        line_no: (cue_character, cue)
+        for (cue_character, _, cue), (character, line_no, _) in zip(ordered, ordered[1:])
+        if character != cue_character
+    }
+
+
+def replace_script_lines(conn, script_name, records, cues=None):
+    """
+    Replaces every stored line for a script with the given (character, line_no, text) records,
+    and the (cue -> reply) pairs of those lines. cues is find_cues() of the whole script, for
+    callers that store only part of it (a shard); by default it is found from the records.
+    Runs inside the caller's transaction.
+    """
+    if cues is None:
+        cues = find_cues(records)
+    conn.execute("DELETE FROM dialogue_lines WHERE script_name = ?", (script_name,))
+    conn.execute("DELETE FROM dialogue_replies WHERE script_name = ?", (script_name,))
+    conn.executemany(
+        "INSERT INTO dialogue_lines (script_name, character_name, line_no, text) VALUES (?, ?, ?, ?)",
+        ((script_name, character, line_no, text) for character, line_no, text in records),
+    )
+    conn.executemany(
+        """
+        INSERT INTO dialogue_replies (script_name, character_name, line_no, cue_character, cue)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        ((script_name, character, line_no) + cues[line_no]
+         for character, line_no, _ in records if line_no in cues),
+    )
+
+
+def store_script(conn, script_name, lines, cues=None):
+    """
+    Stores a parsed script's (character, line_no, text) lines: the per-line rows, their
+    (cue -> reply) pairs and the legacy per-character blobs. Runs inside the caller's transaction.
+    """
+    dialogues = {}
+    for character, _, text in lines:
+        dialogues.setdefault(character, []).append(text)
+    conn.executemany(
+        """
+        INSERT INTO movie_dialogues (script_name, character_name, dialogues)
+        VALUES (?, ?, ?)
+        ON CONFLICT(script_name, character_name) DO UPDATE SET dialogues=excluded.dialogues
+        """,
+        ((script_name, character, " | ".join(texts)) for character, texts in dialogues.items()),
+    )
+    replace_script_lines(conn, script_name, lines, cues)
+
+
+def migrate_from_movie_dialogues(conn):
+    """
+    Splits the legacy ' | '-joined blobs in movie_dialogues into dialogue_lines rows.
+    The blobs lost the script-wide order, so line_no is the position within the character's blob.
+    Rows that were already migrated are left alone. Returns the number of lines inserted.
+    """
+    create_schema(conn)
+    count_query = "SELECT COUNT(*) FROM dialogue_lines"
+    before = conn.execute(count_query).fetchone()[0]
+
+    rows = conn.execute("SELECT script_name, character_name, dialogues FROM movie_dialogues")
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO dialogue_lines (script_name, character_name, line_no, text)
+        VALUES (?, ?, ?, ?)
+        """,
+        (
+            (script_name, character_name, line_no, text)
+            for script_name, character_name, dialogues in rows.fetchall()
+            for line_no, text in enumerate(dialogues.split(" | "))
+            if text.strip()
+        ),
+    )
+    conn.commit()
+    return conn.execute(count_query).fetchone()[0] - before
+
+
+if __name__ == "__main__":
+    db_file = sys.argv[1] if len(sys.argv) > 1 else DB_FILE
+    conn = sqlite3.connect(db_file)
+    inserted = migrate_from_movie_dialogues(conn)
+    conn.execute("INSERT INTO dialogue_lines_fts (dialogue_lines_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    print(f"✅ Migrated {inserted} dialogue lines into dialogue_lines in {db_file}")
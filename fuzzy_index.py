@@ -0,0 +1,285 @@
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from rapidfuzz import fuzz, process, utils
+
+from db_pool import connect_readonly
+from dialogue_schema import has_line_index
+from shards import is_manifest, storage_files
+
+DB_FILE = "movie_dialogues.db"
+
+SCORE_CUTOFF = 80  # Same confidence bar fetch_dialogue has always used
+# Lines shorter than this fraction of the message never match. partial_ratio scores a line 100 when it is a
+# substring of the message, so short stock lines ("Yes, sir.") would answer every message containing them.
+# The old blob scan had no such floor; FUZZY_MIN_LENGTH_RATIO=0 restores that behaviour
+MIN_LENGTH_RATIO = float(os.environ.get("FUZZY_MIN_LENGTH_RATIO", "0.8"))
+MIN_TOKEN_LENGTH = 3  # Ignore "a", "to", "I" etc. when looking up candidate lines
+PREFILTER_TOKENS = 3  # Candidate lines must contain one of the message's rarest few tokens
+CDIST_THRESHOLD = 2000  # Above this many candidates, score in parallel with cdist
+SCAN_CHUNK_LINES = 64  # Lines a full scan scores as one string; fewer, longer strings are cheaper for partial_ratio
+# When a message's rarest tokens are common words, the candidates can be most of the character's lines, and
+# scoring them one by one is slower than chunk_scan(). Above this share of the lines the search scans instead
+# (the two cost about the same at 45-50% on the 20k-line benchmark corpus)
+SCAN_FALLBACK_RATIO = 0.4
+RELOAD_CHECK_INTERVAL = 5.0  # Seconds between DB change checks in maybe_reload()
+
+
+class CharacterCorpus:
+    """All lines for one character, preprocessed once, plus a token -> line postings map."""
+
+    __slots__ = ("lines", "processed", "lengths", "postings", "chunks", "by_length", "sorted_lengths")
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.processed = [utils.default_process(line) for line in lines]
+        self.lengths = [len(text) for text in self.processed]
+        # For scan(): runs of lines joined together, and line numbers in length order
+        self.chunks = [
+            "".join(self.processed[start:start + SCAN_CHUNK_LINES]) for start in range(0, len(lines), SCAN_CHUNK_LINES)
+        ]
+        self.by_length = sorted(range(len(lines)), key=self.lengths.__getitem__)
+        self.sorted_lengths = [self.lengths[i] for i in self.by_length]
+        self.postings = defaultdict(list)
+        for i, text in enumerate(self.processed):
+            for token in set(text.split()):
+                if len(token) >= MIN_TOKEN_LENGTH:
+                    self.postings[token].append(i)
+
+    def candidates(self, query, prefilter=True):
+        """Indexes of lines worth scoring against an already preprocessed query."""
+        min_length = len(query) * MIN_LENGTH_RATIO
+        if not prefilter:
+            return [i for i, length in enumerate(self.lengths) if length >= min_length]
+
+        tokens = prefilter_tokens(query)
+        if not tokens:
+            # Nothing distinctive to look up, e.g. "Hi!" - score every line instead
+            return self.candidates(query, prefilter=False)
+
+        # Common words ("the", "you") would pull in most of the corpus, so only look up the rarest ones
+        postings = sorted((self.postings.get(token, ()) for token in tokens), key=len)
+        seen = set()
+        for posting in postings[:PREFILTER_TOKENS]:
+            seen.update(posting)
+        return [i for i in sorted(seen) if self.lengths[i] >= min_length]
+
+    def scan(self, query, score_cutoff=SCORE_CUTOFF):
+        """(line index, score) of the closest line, or None below score_cutoff. Exact, see chunk_scan()."""
+        def best_line(chunk, cutoff):
+            start = chunk * SCAN_CHUNK_LINES
+            end = min(start + SCAN_CHUNK_LINES, len(self.lines))
+            rows = [i for i in range(start, end) if self.lengths[i] >= len(query)]
+            match = best_match(query, [self.processed[i] for i in rows], cutoff) if rows else None
+            return None if match is None else (rows[match[0]], match[1])
+
+        best = chunk_scan(query, self.chunks, best_line, score_cutoff)
+        if best is not None and best[1] == 100:
+            return best
+
+        # Lines shorter than the query, scored one by one; in length order they are one slice
+        low = bisect_left(self.sorted_lengths, len(query) * MIN_LENGTH_RATIO)
+        rows = self.by_length[low:bisect_left(self.sorted_lengths, len(query))]
+        cutoff = score_cutoff if best is None else best[1]
+        match = best_match(query, [self.processed[i] for i in rows], cutoff) if rows else None
+        if match is not None and (best is None or match[1] > best[1]):
+            best = rows[match[0]], match[1]
+        return best
+
+
+def prefilter_tokens(query):
+    """The tokens of a preprocessed query that candidate lines are looked up by."""
+    return [token for token in set(query.split()) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+def load_character_lines(db_file=DB_FILE):
+    """
+    Reads {character: [line, ...]} from dialogue_lines, or from the legacy blobs if not migrated.
+    A sharded store is read shard by shard.
+    """
+    lines = defaultdict(list)
+    for path in storage_files(db_file):
+        conn = connect_readonly(path)
+        try:
+            if has_line_index(conn):
+                rows = conn.execute(
+                    "SELECT character_name, text FROM dialogue_lines ORDER BY character_name, script_name, line_no"
+                )
+                for character, text in rows:
+                    lines[character].append(text)
+            else:
+                rows = conn.execute("SELECT character_name, dialogues FROM movie_dialogues")
+                for character, dialogues in rows:
+                    lines[character].extend(text for text in dialogues.split(" | ") if text.strip())
+        finally:
+            conn.close()
+    return lines
+
+
+def db_signature(db_file=DB_FILE):
+    """mtime/size of the DB and its WAL, which change on every committed write."""
+    if is_manifest(db_file):
+        # Resharding rewrites the manifest; writes to any shard change that shard's signature
+        return (os.stat(db_file).st_mtime_ns,) + tuple(db_signature(path) for path in storage_files(db_file))
+    signature = []
+    for path in (db_file, db_file + "-wal"):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        # The first reader of a WAL database creates an empty -wal: nothing was written yet
+        signature.append((stat.st_mtime_ns, stat.st_size) if stat.st_size or path == db_file else None)
+    return tuple(signature)
+
+
+def best_match(query, choices, score_cutoff=SCORE_CUTOFF):
+    """(position, score) of the closest preprocessed choice, or None below score_cutoff."""
+    if len(choices) >= CDIST_THRESHOLD:
+        scores = process.cdist([query], choices, scorer=fuzz.partial_ratio, score_cutoff=score_cutoff, workers=-1)[0]
+        best = int(scores.argmax())
+        if scores[best] < score_cutoff:
+            return None
+        return best, float(scores[best])
+
+    # extractOne stops early on a perfect score and skips work below the cutoff
+    match = process.extractOne(query, choices, scorer=fuzz.partial_ratio, processor=None, score_cutoff=score_cutoff)
+    if match is None:
+        return None
+    _, score, position = match
+    return position, score
+
+
+def search_lines(lines, user_message, score_cutoff=SCORE_CUTOFF):
+    """
+    FuzzyIndex.search over a handful of lines given by the caller (e.g. one
+    character's lines in one script), with the same length floor. Returns
+    (line, score) or None.
+    """
+    query = utils.default_process(user_message)
+    if not query:
+        return None
+    processed = [utils.default_process(line) for line in lines]
+    min_length = len(query) * MIN_LENGTH_RATIO
+    candidates = [i for i, text in enumerate(processed) if len(text) >= min_length]
+    match = best_match(query, [processed[i] for i in candidates], score_cutoff) if candidates else None
+    return None if match is None else (lines[candidates[match[0]]], match[1])
+
+
+def chunk_bound(score):
+    """
+    The least a chunk scores if one of its lines at least as long as the query
+    scores score. A full window inside the line is one of the chunk's too; a
+    window cut short by the line's end, of length k, scores 2*LCS / (m + k)
+    for a query of length m, while the chunk's full window over it scores at
+    least LCS / m, and a high score needs k close to m. In percent.
+    """
+    return 100 * score / (200 - score)
+
+
+def chunk_scan(query, chunks, best_line, score_cutoff=SCORE_CUTOFF):
+    """
+    Full scan for a query with nothing to prefilter on. Scoring every line is
+    several times slower than the old per-script blob scan, because
+    partial_ratio also tries the alignments that run off either end of each
+    string. So chunks (SCAN_CHUNK_LINES consecutive lines joined together)
+    are scored first, best first, and only the chunks that could hold a line
+    beating the best so far (see chunk_bound()) are opened:
+    best_line(chunk, cutoff) -> (line, score) or None, over the chunk's lines
+    at least as long as the query. The bound does not hold for shorter lines,
+    so the caller scores those itself, with the best score found here as the cutoff.
+    """
+    best = None
+    ranked = process.extract(query, chunks, scorer=fuzz.partial_ratio, processor=None,
+                             score_cutoff=chunk_bound(score_cutoff), limit=None)
+    for _, chunk_score, chunk in ranked:
+        if chunk_score < chunk_bound(score_cutoff if best is None else best[1]):
+            break
+        match = best_line(chunk, score_cutoff if best is None else best[1])
+        if match is not None and (best is None or match[1] > best[1]):
+            best = match
+            if best[1] == 100:
+                break  # Nothing scores higher; common words can leave every chunk at 100
+    return best
+
+
+class FuzzyIndex:
+    """
+    Startup-built fuzzy-match corpus: character -> preprocessed individual lines.
+
+    A lookup only scores the lines that share one of the message's rarest
+    tokens (prefilter=True), so its cost follows the candidate count instead
+    of the size of the character's whole corpus. Without the prefilter, with
+    no token to look up, or with so common tokens that more than
+    SCAN_FALLBACK_RATIO of the lines are candidates, it falls back to
+    chunk_scan(). Either way, lines
+    shorter than MIN_LENGTH_RATIO times the message are left out, which the
+    old scan over whole blobs did not do. Call reload() (or
+    maybe_reload() on the request path) after movie_dialogues.db changes.
+    """
+
+    def __init__(self, db_file=DB_FILE, prefilter=True):
+        self.db_file = db_file
+        self.prefilter = prefilter
+        self._corpora = {}
+        self._signature = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Rebuilds the corpus from the DB and swaps it in atomically."""
+        signature = db_signature(self.db_file)
+        try:
+            character_lines = load_character_lines(self.db_file)
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Fuzzy index not built from {self.db_file}: {e}")
+            character_lines = {}
+
+        self._corpora = {character: CharacterCorpus(lines) for character, lines in character_lines.items()}
+        self._signature = signature
+
+    def maybe_reload(self):
+        """Reloads if the DB changed since the last build, checking at most every few seconds."""
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return False
+        with self._lock:
+            if now - self._last_check < RELOAD_CHECK_INTERVAL:
+                return False
+            self._last_check = now
+            if db_signature(self.db_file) == self._signature:
+                return False
+            self.reload()
+            return True
+
+    def num_candidates(self, character, user_message):
+        """How many lines the prefilter leaves for this message (search() scans instead above SCAN_FALLBACK_RATIO)."""
+        corpus = self._corpora.get(character)
+        if corpus is None:
+            return 0
+        return len(corpus.candidates(utils.default_process(user_message), self.prefilter))
+
+    def search(self, character, user_message, score_cutoff=SCORE_CUTOFF):
+        """Returns (line, score) for the character's closest line, or None below score_cutoff."""
+        corpus = self._corpora.get(character)
+        query = utils.default_process(user_message)
+        if corpus is None or not query:
+            return None
+
+        candidates = corpus.candidates(query) if self.prefilter and prefilter_tokens(query) else None
+        if candidates is None or len(candidates) > len(corpus.lines) * SCAN_FALLBACK_RATIO:
+            match = corpus.scan(query, score_cutoff)
+            return None if match is None else (corpus.lines[match[0]], match[1])
+
+        if not candidates:
+            return None
+        match = best_match(query, [corpus.processed[i] for i in candidates], score_cutoff)
+        if match is None:
+            return None
+        position, score = match
+        return corpus.lines[candidates[position]], score
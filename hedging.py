@@ -0,0 +1,129 @@
+"""
+Hedged LLM calls for the ASGI app's latency mode (LATENCY_MODE=1).
+
+A call that has not answered within the hedge delay gets a duplicate sent on
+a different API key; whichever answers first is used and the other is
+cancelled. The delay is either fixed or the p95 of recent call latencies, so
+about one call in twenty is duplicated: the slow tail pays for a second
+request, the rest cost nothing extra.
+
+snapshot() reports how often calls were hedged and won by the hedge, and the
+quota overhead: provider requests whose reply nobody used (losing calls,
+whether still running, failed or finished second, retries after a failure,
+and speculative calls cancelled because the DB answered), per request that
+was used.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+HEDGE_WINDOW = 500  # Recent call latencies the p95 delay is taken from
+HEDGE_MIN_SAMPLES = 20  # No p95 (and so no hedging) before this many calls
+
+
+def parse_hedge_delay(value):
+    """HEDGE_DELAY_MS: "p95" (adaptive), a number of milliseconds, or "off"."""
+    value = (value or "p95").strip().lower()
+    if value in ("p95", "off"):
+        return value
+    return float(value)
+
+
+def _retrieve(task):
+    """Marks a losing call's error as seen, so asyncio does not log it as never retrieved."""
+    if not task.cancelled():
+        task.exception()
+
+
+class Hedger:
+    """Sends an LLM call, and a duplicate on another key if the first one is slow."""
+
+    def __init__(self, llm, delay_ms="p95", window=HEDGE_WINDOW, min_samples=HEDGE_MIN_SAMPLES):
+        self.llm = llm
+        self.delay_ms = delay_ms
+        self.min_samples = min_samples
+        self.latencies_ms = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.stats = {
+            "generations": 0, "calls": 0, "wasted_calls": 0, "cancelled": 0,
+            "hedges": 0, "hedge_wins": 0, "hedges_skipped": 0,
+        }
+
+    def delay(self):
+        """Seconds to wait before hedging, or None when this call should not be hedged."""
+        if self.delay_ms == "off" or len(self.llm.keys) < 2:
+            return None
+        if self.delay_ms != "p95":
+            return self.delay_ms / 1000
+        samples = sorted(self.latencies_ms)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(0.95 * len(samples)) - 1)] / 1000
+
+    async def generate(self, prompt):
+        """The reply to prompt from whichever of the call and its hedge answers first."""
+        start = time.perf_counter()
+        primary_keys, hedge_keys = [], []
+        primary = asyncio.ensure_future(self.llm.agenerate(prompt, on_key=primary_keys.append))
+        hedge = winner = None
+        cancelled = False
+        try:
+            delay = self.delay()
+            done = (await asyncio.wait({primary}, timeout=delay))[0] if delay is not None else set()
+            # Still waiting on quota for the first call: a duplicate would only queue behind it
+            if not done and delay is not None and primary_keys:
+                hedge = asyncio.ensure_future(self.llm.agenerate(
+                    prompt, exclude=primary_keys[-1:], on_key=hedge_keys.append, quota_timeout=0,
+                ))
+
+            tasks = {primary} if hedge is None else {primary, hedge}
+            while tasks and winner is None:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+            if winner is None:
+                raise primary.exception() or hedge.exception()
+            return winner.result()
+        except asyncio.CancelledError:
+            cancelled = True  # A speculative call whose request the DB answered meanwhile
+            raise
+        finally:
+            # Only the winner's reply is used: every other request was spent for nothing
+            for task in (primary, hedge):
+                if task is None or task is winner:
+                    continue
+                if task.done():
+                    _retrieve(task)
+                else:
+                    task.cancel()  # Lost, or nobody wants it any more
+                    task.add_done_callback(_retrieve)
+            calls = len(primary_keys) + len(hedge_keys)
+            wasted = calls - 1 if winner is not None else calls
+            self._record(start, winner, hedge, len(primary_keys), len(hedge_keys), wasted, cancelled)
+
+    def _record(self, start, winner, hedge, primary_calls, hedge_calls, wasted, cancelled):
+        with self._lock:
+            self.stats["calls"] += primary_calls + hedge_calls
+            self.stats["wasted_calls"] += wasted
+            self.stats["cancelled"] += cancelled
+            if hedge is not None:
+                # A hedge only reports a key once one had quota (it never waits for one)
+                self.stats["hedges" if hedge_calls else "hedges_skipped"] += 1
+            if winner is not None:
+                self.stats["generations"] += 1
+                self.stats["hedge_wins"] += winner is hedge
+                # A primary beaten by its hedge was at least this slow, so the sample still counts toward the p95
+                self.latencies_ms.append((time.perf_counter() - start) * 1000)
+
+    def snapshot(self):
+        """Hedge and waste counters, rates and the current hedge delay."""
+        with self._lock:
+            stats = dict(self.stats)
+        used_calls = stats["calls"] - stats["wasted_calls"]
+        stats["hedge_rate"] = round(stats["hedges"] / stats["generations"], 4) if stats["generations"] else 0.0
+        stats["hedge_win_rate"] = round(stats["hedge_wins"] / stats["hedges"], 4) if stats["hedges"] else 0.0
+        stats["quota_overhead"] = round(stats["wasted_calls"] / used_calls, 4) if used_calls > 0 else 0.0
+        delay = self.delay()
+        stats["hedge_delay_ms"] = round(delay * 1000, 1) if delay is not None else None
+        return stats
@@ -0,0 +1,193 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from rate_limiter import DEFAULT_RPM, DEFAULT_TPM, KeyScheduler, QuotaUnavailable, estimate_tokens, rate_limit_info
+
+GEMINI_MODEL = "gemini-2.0-flash"
+
+STUB_LATENCY_MS = 800
+STUB_JITTER_MS = 200
+STUB_TOKEN_INTERVAL_MS = 20  # Gap between streamed words after the first one
+STUB_SLOW_RATE = 0.0  # Share of stub calls that take STUB_SLOW_MS longer, for a latency tail
+STUB_SLOW_MS = 0
+
+
+def genai_client(api_key):
+    # google.genai takes most of a second to import, so it loads with the first client
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+
+class GeminiBackend:
+    """
+    Gemini through google-genai, with both the blocking and the asyncio client.
+    Every call goes through a KeyScheduler, which spreads the load over api_keys
+    within each key's requests/tokens per minute quota (see rate_limiter.py).
+    Clients are created on first use of their key, or all at once by warm_up().
+    """
+
+    def __init__(self, api_keys, model=GEMINI_MODEL, scheduler=None, client_factory=None, attempts=3):
+        if isinstance(api_keys, str):
+            api_keys = [api_keys]
+        self.model = model
+        self.attempts = attempts
+        self._client_factory = client_factory or genai_client
+        # Scheduled by label, so the keys themselves never show up in stats or logs
+        self._api_keys = {f"key-{i + 1}": api_key for i, api_key in enumerate(api_keys)}
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self.scheduler = scheduler or KeyScheduler(
+            list(self._api_keys),
+            rpm=int(os.environ.get("GEMINI_RPM", DEFAULT_RPM)),
+            tpm=int(os.environ.get("GEMINI_TPM", DEFAULT_TPM)),
+        )
+
+    @property
+    def keys(self):
+        """Labels of the API keys, as the scheduler and stats name them."""
+        return list(self._api_keys)
+
+    def client(self, key):
+        client = self._clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = self._client_factory(self._api_keys[key])
+        return client
+
+    def warm_up(self):
+        """Creates every key's client now instead of on the first request."""
+        for key in self._api_keys:
+            self.client(key)
+
+    def generate(self, prompt):
+        response = self.scheduler.call(
+            lambda key: self.client(key).models.generate_content(model=self.model, contents=prompt),
+            estimate_tokens(prompt), self.attempts,
+        )
+        return response.text
+
+    async def agenerate(self, prompt, exclude=(), on_key=None, quota_timeout=None):
+        """
+        exclude keeps the call off some keys and on_key(key) is told each key it is sent on,
+        both for hedged duplicates (see hedging.py). quota_timeout bounds the wait for quota.
+        """
+        def send(key):
+            if on_key is not None:
+                on_key(key)
+            return self.client(key).aio.models.generate_content(model=self.model, contents=prompt)
+
+        response = await self.scheduler.acall(send, estimate_tokens(prompt), self.attempts, quota_timeout, exclude)
+        return response.text
+
+    async def astream(self, prompt):
+        """Yields text chunks as Gemini produces them."""
+        # Opening the stream is retried like any call; once text has been yielded it cannot be
+        for attempt in range(1, self.attempts + 1):
+            lease = await self.scheduler.aacquire(estimate_tokens(prompt))
+            try:
+                stream = await self.client(lease.key).aio.models.generate_content_stream(model=self.model, contents=prompt)
+                break
+            except asyncio.CancelledError:
+                lease.released()
+                raise
+            except Exception as e:
+                lease.failed(*rate_limit_info(e))
+                if attempt == self.attempts:
+                    raise
+                self.scheduler.note_retry(lease)
+
+        try:
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            lease.failed(*rate_limit_info(e))
+            raise
+        else:
+            lease.succeeded()
+        finally:
+            lease.released()  # Cancelled or closed mid-stream; no-op once an outcome was reported
+
+    def stats(self):
+        """Per-key quota, load and breaker state."""
+        return self.scheduler.snapshot()
+
+
+class StubBackend:
+    """
+    Offline stand-in for Gemini. Sleeps for a configurable latency (plus
+    uniform jitter) and echoes a canned reply, so throughput can be measured
+    without quota or network. When streaming, the latency is the time to the
+    first word and the rest follow every token_interval_ms. A slow_rate share
+    of calls takes slow_ms longer, to give hedging a tail to cut. The fake keys
+    only exist so hedged calls have a second one to go to.
+    """
+
+    def __init__(self, latency_ms=STUB_LATENCY_MS, jitter_ms=STUB_JITTER_MS, model="stub", token_interval_ms=STUB_TOKEN_INTERVAL_MS,
+                 slow_rate=STUB_SLOW_RATE, slow_ms=STUB_SLOW_MS, num_keys=1):
+        self.model = model
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_interval_ms = token_interval_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.keys = [f"key-{i + 1}" for i in range(num_keys)]
+
+    def _delay(self):
+        latency_ms = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if random.random() < self.slow_rate:
+            latency_ms += self.slow_ms
+        return max(0.0, latency_ms) / 1000
+
+    def _reply(self, prompt):
+        return f"[{self.model}] A reply in character to a {len(prompt)}-character prompt."
+
+    def generate(self, prompt):
+        time.sleep(self._delay())
+        return self._reply(prompt)
+
+    async def agenerate(self, prompt, exclude=(), on_key=None, quota_timeout=None):
+        keys = [key for key in self.keys if key not in exclude]
+        if not keys:
+            raise QuotaUnavailable("Every API key is excluded")
+        if on_key is not None:
+            on_key(random.choice(keys))
+        await asyncio.sleep(self._delay())
+        return self._reply(prompt)
+
+    async def astream(self, prompt):
+        await asyncio.sleep(self._delay())
+        words = self._reply(prompt).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_interval_ms / 1000)
+            yield word if i == 0 else " " + word
+
+
+def api_keys_from_env(*names):
+    """The Gemini keys in the given variables; API_KEYS (comma-separated) overrides them all."""
+    if os.environ.get("API_KEYS"):
+        return [key.strip() for key in os.environ["API_KEYS"].split(",") if key.strip()]
+    return [os.environ[name] for name in names]
+
+
+def create_backend(*api_key_envs):
+    """
+    Builds the backend selected by the LLM_BACKEND environment variable.
+    LLM_BACKEND=stub swaps Gemini for the local fake (latency from STUB_LLM_LATENCY_MS / STUB_LLM_JITTER_MS,
+    a slow tail from STUB_LLM_SLOW_RATE / STUB_LLM_SLOW_MS, STUB_LLM_KEYS fake keys).
+    Gemini keys come from api_keys_from_env(*api_key_envs), API_KEY by default; quotas from GEMINI_RPM / GEMINI_TPM.
+    """
+    if os.environ.get("LLM_BACKEND", "gemini") == "stub":
+        return StubBackend(
+            float(os.environ.get("STUB_LLM_LATENCY_MS", STUB_LATENCY_MS)),
+            float(os.environ.get("STUB_LLM_JITTER_MS", STUB_JITTER_MS)),
+            slow_rate=float(os.environ.get("STUB_LLM_SLOW_RATE", STUB_SLOW_RATE)),
+            slow_ms=float(os.environ.get("STUB_LLM_SLOW_MS", STUB_SLOW_MS)),
+            num_keys=int(os.environ.get("STUB_LLM_KEYS", "1")),
+        )
+    return GeminiBackend(api_keys_from_env(*(api_key_envs or ("API_KEY",))))
@@ -0,0 +1,165 @@
+"""
+Prometheus instrumentation shared by chat.py, chat_asgi.py and the Streamlit app.
+
+- dharmaiq_stage_seconds{stage}: latency histograms for db_reply, db_exact,
+  db_fuzzy, db_semantic, llm and total.
+- dharmaiq_tier_lookups_total{tier, outcome}: hit/miss per DB lookup tier.
+- dharmaiq_llm_calls_total{outcome}: LLM calls that succeeded, failed or were
+  cancelled (client gone, or a speculative call the DB made unnecessary).
+- dharmaiq_in_flight{stage}: requests and LLM calls currently running.
+- Existing stats snapshots (response cache, single-flight, per-key Gemini
+  quota with its retries and breakers) are read when /metrics is scraped,
+  via register_snapshot, so their hot paths gain nothing.
+
+Label children are bound once at import. A hook is then one histogram
+observe or counter inc: about 1-3µs, against milliseconds for the work it
+measures.
+
+With several worker processes, set PROMETHEUS_MULTIPROC_DIR (see the
+prometheus_client docs). /metrics then aggregates the histograms and counters
+over all workers. The snapshot gauges still come only from the worker that
+served the scrape, labelled with its pid, since each process keeps its own.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+    multiprocess, start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+NAMESPACE = "dharmaiq"
+STAGES = ("db_reply", "db_exact", "db_fuzzy", "db_semantic", "llm", "total")
+TIERS = ("db_reply", "db_exact", "db_fuzzy", "db_semantic")  # Response cache hits come from its own snapshot
+# From sub-millisecond dict/FTS hits up to slow Gemini replies
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds", "Time spent in each stage of answering a chat message", ["stage"],
+    namespace=NAMESPACE, buckets=LATENCY_BUCKETS,
+)
+TIER_LOOKUPS = Counter("tier_lookups", "Lookups per tier and outcome", ["tier", "outcome"], namespace=NAMESPACE)
+LLM_CALLS = Counter("llm_calls", "LLM calls by outcome (retries included)", ["outcome"], namespace=NAMESPACE)
+IN_FLIGHT = Gauge("in_flight", "Requests and LLM calls currently running", ["stage"], namespace=NAMESPACE,
+                  multiprocess_mode="livesum")
+
+# Bound once so a hook does not pay for label lookups
+stage_seconds = {stage: STAGE_SECONDS.labels(stage) for stage in STAGES}
+tier_lookups = {tier: (TIER_LOOKUPS.labels(tier, "miss"), TIER_LOOKUPS.labels(tier, "hit")) for tier in TIERS}
+llm_calls = {outcome: LLM_CALLS.labels(outcome) for outcome in ("success", "error", "cancelled")}
+in_flight = {stage: IN_FLIGHT.labels(stage) for stage in ("request", "llm")}
+
+
+def record_tier(tier, hit):
+    tier_lookups[tier][bool(hit)].inc()
+
+
+def track_stage(stage):
+    """Times the block into the stage histogram (prometheus_client's own timer, lighter than a generator)."""
+    return stage_seconds[stage].time()
+
+
+@contextmanager
+def track_request():
+    """Counts the request as in flight and times it as the total stage."""
+    gauge = in_flight["request"]
+    gauge.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds["total"].observe(time.perf_counter() - start)
+        gauge.dec()
+
+
+@contextmanager
+def track_llm():
+    """Times one LLM call, counts it as in flight, and records whether it raised or was cancelled."""
+    gauge = in_flight["llm"]
+    gauge.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        llm_calls["cancelled"].inc()
+        raise
+    except BaseException:
+        llm_calls["error"].inc()
+        raise
+    else:
+        llm_calls["success"].inc()
+    finally:
+        stage_seconds["llm"].observe(time.perf_counter() - start)
+        gauge.dec()
+
+
+class SnapshotCollector:
+    """
+    Exports a stats snapshot as gauges named <namespace>_<name>_<stat>, read at scrape time.
+    With label, the snapshot is {label value: {stat: value}} (e.g. per API key).
+    const_labels ({name: value}) are added to every sample. Non-numeric values are skipped.
+    """
+
+    def __init__(self, name, snapshot, label=None, const_labels=None):
+        self.name = name
+        self.snapshot = snapshot
+        self.label = label
+        self.const_labels = const_labels or {}
+
+    def collect(self):
+        snapshot = self.snapshot()
+        rows = snapshot.items() if self.label else [(None, snapshot)]
+        label_names = ([self.label] if self.label else []) + list(self.const_labels)
+        families = {}
+        for label_value, stats in rows:
+            label_values = ([label_value] if self.label else []) + list(self.const_labels.values())
+            for stat, value in stats.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                family = families.get(stat)
+                if family is None:
+                    family = families[stat] = GaugeMetricFamily(
+                        f"{NAMESPACE}_{self.name}_{stat}", f"{self.name} {stat}", labels=label_names or None,
+                    )
+                family.add_metric(label_values, float(value))
+        yield from families.values()
+
+
+snapshot_collectors = []
+
+
+def register_snapshot(name, snapshot, label=None):
+    """Exposes snapshot() (a callable returning a dict of numbers) on /metrics."""
+    collector = SnapshotCollector(name, snapshot, label)
+    snapshot_collectors.append(collector)
+    REGISTRY.register(collector)
+
+
+def render():
+    """(body, content type) for a /metrics response."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # The snapshots live in this process only, so they say which worker they came from
+        pid = {"pid": str(os.getpid())}
+        for collector in snapshot_collectors:
+            registry.register(SnapshotCollector(collector.name, collector.snapshot, collector.label, pid))
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """
+    Drops an exited worker's live gauges (dharmaiq_in_flight) from the multiprocess
+    /metrics, so they stop adding to the sum. Its counters and histograms are kept.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
+
+
+def start_metrics_server(port):
+    """Serves /metrics from a background thread, for processes without their own HTTP API (Streamlit)."""
+    start_http_server(port)
@@ -0,0 +1,341 @@
+"""
+Pre-fork serving for chat.py on several cores.
+
+The master builds everything once and only then forks the workers:
+
+- a memory-mapped snapshot of the fuzzy-match corpus (corpus_snapshot.py),
+  whose pages every worker shares through the page cache. It is kept on
+  disk, so the next start of the same DB maps it instead of building it;
+- the alias index, vector index and the rest of chat.py. The workers share
+  these copy-on-write; gc.freeze() keeps the garbage collector from
+  touching, and so copying, every inherited object.
+
+Workers accept on one listening socket the master bound. When
+movie_dialogues.db changes (or on SIGHUP) the master builds a new snapshot,
+forks a new set of workers on it, and only then asks the old ones to stop.
+They finish their in-flight requests first, so a reload drops nothing.
+
+The master prints each worker's RSS, its PSS (shared pages split between the
+processes mapping them, so the workers' PSS adds up to real usage) and the
+total throughput every --report-interval seconds. GET /workers/stats returns
+the same from any worker.
+
+    python prefork.py --workers 4 --port 5000
+    kill -HUP <master pid>     (reload now instead of waiting for the DB check)
+
+Set PROMETHEUS_MULTIPROC_DIR to aggregate /metrics over the workers (the stats
+snapshot gauges stay per worker, labelled with the pid of the one that answered).
+"""
+import argparse
+import gc
+import mmap
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+from corpus_snapshot import SNAPSHOT_DIR, ensure_snapshot
+from dialogue_lookup import DB_FILE
+from fuzzy_index import db_signature
+from metrics import mark_process_dead
+
+DEFAULT_WORKERS = os.cpu_count() or 2
+RELOAD_CHECK_INTERVAL = 5.0  # Seconds between DB change checks in the master
+REPORT_INTERVAL = 30.0  # Seconds between RSS/throughput lines
+GRACEFUL_TIMEOUT = 30.0  # Seconds a stopping worker gets to finish in-flight requests
+LISTEN_BACKLOG = 1024
+MASTER_TICK = 0.5
+SLOT_FIELDS = 3  # pid, generation, requests served
+
+
+def memory_usage(pid):
+    """(RSS, PSS) of a process in bytes, None where /proc does not say (non-Linux, process gone)."""
+    usage = {}
+    for path, field in ((f"/proc/{pid}/status", "VmRSS:"), (f"/proc/{pid}/smaps_rollup", "Pss:")):
+        try:
+            with open(path, encoding="ascii") as file:
+                for line in file:
+                    if line.startswith(field):
+                        usage[field] = int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return usage.get("VmRSS:"), usage.get("Pss:")
+
+
+def megabytes(value):
+    return None if value is None else round(value / 1e6, 1)
+
+
+class WorkerTable:
+    """
+    Per-worker slots (pid, generation, requests served) in an anonymous shared
+    mapping: each worker only writes its own slot, and the master or any worker
+    can read them all.
+    """
+
+    def __init__(self, num_slots):
+        self.num_slots = num_slots
+        self._map = mmap.mmap(-1, num_slots * SLOT_FIELDS * 8)
+        self._values = memoryview(self._map).cast("q")
+        self._lock = threading.Lock()  # Guards this process's own slot against its request threads
+
+    def claim(self, slot, generation):
+        """Reserves a slot before forking, so its counter starts at zero before the worker can touch it."""
+        base = slot * SLOT_FIELDS
+        self._values[base], self._values[base + 1], self._values[base + 2] = -1, generation, 0
+
+    def assign(self, slot, pid):
+        self._values[slot * SLOT_FIELDS] = pid
+
+    def release(self, slot):
+        self._values[slot * SLOT_FIELDS] = 0
+
+    def count_request(self, slot):
+        with self._lock:
+            self._values[slot * SLOT_FIELDS + 2] += 1
+
+    def free_slot(self):
+        return next(slot for slot in range(self.num_slots) if self._values[slot * SLOT_FIELDS] == 0)
+
+    def workers(self):
+        """[{"pid", "generation", "requests"}] for every live worker."""
+        rows = []
+        for slot in range(self.num_slots):
+            pid, generation, requests = self._values[slot * SLOT_FIELDS:(slot + 1) * SLOT_FIELDS]
+            if pid > 0:
+                rows.append({"pid": pid, "generation": generation, "requests": requests})
+        return rows
+
+    def snapshot(self):
+        """The worker rows with each one's memory use, plus totals."""
+        workers = []
+        for row in self.workers():
+            rss, pss = memory_usage(row["pid"])
+            workers.append({**row, "rss_mb": megabytes(rss), "pss_mb": megabytes(pss)})
+        return {
+            "workers": workers,
+            "total_requests": sum(row["requests"] for row in workers),
+            "total_pss_mb": round(sum(row["pss_mb"] or 0 for row in workers), 1),
+        }
+
+
+class CountingMiddleware:
+    """Counts requests into the worker's slot and tracks the ones still running, for a graceful stop."""
+
+    def __init__(self, app, table, slot):
+        self.app = app
+        self.table = table
+        self.slot = slot
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def _done(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.in_flight += 1
+        self.table.count_request(self.slot)
+        try:
+            # Closed once the body is fully sent, so streamed responses count as in flight until then
+            return ClosingIterator(self.app(environ, start_response), self._done)
+        except BaseException:
+            self._done()
+            raise
+
+
+class PreforkServer:
+    """The master: owns the socket, the snapshots and the workers."""
+
+    def __init__(self, host, port, num_workers, db_file=DB_FILE, snapshot_root=SNAPSHOT_DIR,
+                 report_interval=REPORT_INTERVAL):
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers
+        self.db_file = db_file
+        self.snapshot_root = snapshot_root
+        self.report_interval = report_interval
+        self.table = WorkerTable(2 * num_workers)  # Room for the old and new set during a reload
+        self.workers = {}  # pid -> (generation, slot)
+        self.generation = 0
+        self.snapshot_dir = None
+        self.signature = None
+        self.app = None
+        self.stopping = False
+        self.reload_requested = False
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(LISTEN_BACKLOG)
+        self.sock.set_inheritable(True)
+
+    def load_generation(self):
+        """Snapshots the current DB and loads the app on it. Runs in the master, before forking."""
+        signature = db_signature(self.db_file)
+        snapshot_dir = ensure_snapshot(self.db_file, self.snapshot_root)
+
+        gc.unfreeze()
+        # Configured before chat.py is imported, so its warm-up finds the indexes already loaded
+        import dialogue_lookup
+        dialogue_lookup.configure(self.db_file, snapshot_dir=snapshot_dir)
+        if self.app is None:
+            from chat import app, warmup
+            # The warm-up thread must be done before forking: only the forking thread survives in a child
+            if not warmup.wait():
+                raise RuntimeError(f"Warm-up failed: {warmup.error}")
+            app.add_url_rule("/workers/stats", "workers_stats", lambda: self.table.snapshot())
+            self.app = app
+        # Everything built so far is inherited by the workers; keep the collector from writing to it
+        gc.collect()
+        gc.freeze()
+
+        self.generation += 1
+        self.snapshot_dir, self.signature = snapshot_dir, signature
+
+    def spawn_worker(self, slot):
+        self.table.claim(slot, self.generation)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self.run_worker(slot)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                # Skip atexit and finalizers: the SQLite handles inherited from the master belong to it
+                os._exit(code)
+        self.table.assign(slot, pid)
+        self.workers[pid] = (self.generation, slot)
+
+    def run_worker(self, slot):
+        for signum in (signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_IGN)  # The master decides when workers stop
+        random.seed()  # Otherwise every worker draws the same jitter and backoff sequence
+
+        app = CountingMiddleware(self.app, self.table, slot)
+        server = make_server(self.host, self.port, app, threaded=True, fd=self.sock.fileno())
+        # shutdown() waits for serve_forever() to return, so it cannot run in the handler itself
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+        server.serve_forever()
+
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while app.in_flight > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def spawn_generation(self):
+        for _ in range(self.num_workers):
+            self.spawn_worker(self.table.free_slot())
+
+    def reload(self, reason):
+        """Starts workers on a fresh snapshot, then stops the old ones once they finish their requests."""
+        print(f"🔄 Reloading ({reason})")
+        old_workers = list(self.workers)
+        try:
+            self.load_generation()
+        except Exception as e:
+            print(f"❌ Reload failed, still serving generation {self.generation}: {e}")
+            return
+        self.spawn_generation()
+        # ensure_snapshot() already removed the old snapshot; its workers keep their mappings until they exit
+        for pid in old_workers:
+            self.stop_worker(pid)
+        print(f"✅ Generation {self.generation} serving from {self.snapshot_dir}")
+
+    def stop_worker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        """Collects exited workers and replaces any of the current generation that died."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            mark_process_dead(pid)
+            generation, slot = self.workers.pop(pid, (None, None))
+            if slot is None:
+                continue
+            self.table.release(slot)
+            if generation == self.generation and not self.stopping:
+                print(f"⚠️ Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+                self.spawn_worker(slot)
+
+    def report(self, elapsed, previous_total):
+        stats = self.table.snapshot()
+        master_rss, master_pss = memory_usage(os.getpid())
+        throughput = (stats["total_requests"] - previous_total) / elapsed if elapsed else 0.0
+        workers = ", ".join(
+            f"{row['pid']}: rss {row['rss_mb']}MB pss {row['pss_mb']}MB {row['requests']} req" for row in stats["workers"]
+        )
+        print(f"📊 {throughput:.1f} req/s over {len(stats['workers'])} workers "
+              f"(pss {stats['total_pss_mb']}MB, master rss {megabytes(master_rss)}MB pss {megabytes(master_pss)}MB) | {workers}")
+        return stats["total_requests"]
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "reload_requested", True))
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: setattr(self, "stopping", True))
+
+        self.load_generation()
+        self.spawn_generation()
+        print(f"✅ Serving on http://{self.host}:{self.port} with {self.num_workers} workers (master {os.getpid()})")
+
+        last_check = last_report = time.monotonic()
+        reported_total = 0
+        while not self.stopping:
+            time.sleep(MASTER_TICK)
+            self.reap()
+            now = time.monotonic()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload("SIGHUP")
+            elif now - last_check >= RELOAD_CHECK_INTERVAL:
+                last_check = now
+                if db_signature(self.db_file) != self.signature:
+                    self.reload(f"{self.db_file} changed")
+            if self.report_interval and now - last_report >= self.report_interval:
+                reported_total = self.report(now - last_report, reported_total)
+                last_report = now
+
+        self.shutdown()
+
+    def shutdown(self):
+        print("🛑 Stopping workers")
+        for pid in list(self.workers):
+            self.stop_worker(pid)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            os.kill(pid, signal.SIGKILL)
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--db", default=DB_FILE, help="dialogue DB or shard manifest (default: DIALOGUE_DB)")
+    parser.add_argument("--snapshot-root", default=SNAPSHOT_DIR, help="directory holding the versioned snapshots")
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL, help="seconds; 0 turns reports off")
+    args = parser.parse_args()
+
+    PreforkServer(args.host, args.port, args.workers, args.db, snapshot_root=args.snapshot_root,
+                  report_interval=args.report_interval).run()
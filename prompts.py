@@ -0,0 +1,55 @@
+import json
+
+# Bump whenever the template changes so cached replies from the old prompt are not reused
+PROMPT_VERSION = 1
+
+
+def build_prompt(character, user_message, context_lines=()):
+    """
+    Builds the in-character Gemini prompt. context_lines are the character's own
+    retrieved lines, shown as examples of how they talk.
+    """
+    prompt = f"""
+    Act exactly like {character} from the movie script. 
+    Stay in character and respond naturally, as if you were in the scene. 
+    Given this line from another character: "{user_message}", 
+    how would {character} realistically reply based on their personality and speaking style?
+    """
+
+    if context_lines:
+        examples = "\n".join(f'    - "{line}"' for line in context_lines)
+        prompt += f"""
+    Here are some things {character} actually says in the script, closest to this conversation first:
+{examples}
+    Match their voice, vocabulary and attitude.
+    """
+
+    return prompt
+
+
+def build_character_names_prompt(script_name, names):
+    """Stage 3 prompt asking Gemini which of a script's bold cues are character names."""
+    return f"""
+    Hey Gemini! I am building a project that requires extracting character names from movie scripts.
+    The script's filename is {script_name} and the character names are:
+    {names}
+    Return strictly in JSON format with the key being 'characters' and the value being the names of the characters in a list.
+    DO NOT RETURN ANYTHING ELSE OTHER THAN THE CHARACTER NAMES. STRICTLY FOLLOW ALL MY INSTRUCTIONS.
+    Please return only the names that belong to characters in the script. Exclude any non-character words.
+    """
+
+
+def build_character_names_batch_prompt(candidates):
+    """
+    Stage 3 prompt for several scripts at once. candidates is {script name: [cues]};
+    the reply must be a JSON object with the same keys.
+    """
+    payload = json.dumps(candidates, ensure_ascii=False, indent=1)
+    return f"""
+    Hey Gemini! I am building a project that requires extracting character names from movie scripts.
+    Below is a JSON object mapping each script's filename to candidate names taken from that script:
+{payload}
+    Return strictly a JSON object with exactly the same keys. The value for each key must be the list of
+    candidates from that script that are names of characters in it (an empty list if there are none).
+    Only use names from that script's own candidate list. DO NOT RETURN ANYTHING ELSE OTHER THAN THE JSON OBJECT.
+    """
@@ -0,0 +1,315 @@
+"""
+Client-side quota management for Gemini, shared by every stage and server.
+
+Each API key gets two token buckets, one for requests per minute and one for
+(estimated) tokens per minute. Every call is sent on the least-loaded key
+that has quota left right now, and waits if no key has any.
+
+- A 429 puts that key in a cooldown: the server's retry hint when it gives
+  one, exponential backoff with jitter otherwise.
+- Repeated failures open the key's circuit breaker. After breaker_timeout a
+  single probe request decides whether it closes again.
+"""
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+
+DEFAULT_RPM = 60  # Requests per minute per key
+DEFAULT_TPM = 1_000_000  # Prompt + reply tokens per minute per key
+FAILURE_THRESHOLD = 5  # Consecutive failures that open a key's breaker
+BREAKER_TIMEOUT = 30.0  # Seconds an open breaker waits before letting a probe through
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+PROBE_WAIT = 0.05  # Poll interval while a half-open key's probe is in flight
+REPLY_TOKEN_ALLOWANCE = 256  # Reply tokens reserved up front; corrected once the real usage is known
+
+RETRY_DELAY_PATTERN = re.compile(r"retry[ _-]?(?:delay|after|in)['\"]?\s*[:=]?\s*['\"]?(\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+
+class QuotaUnavailable(Exception):
+    """No key had quota within the caller's timeout."""
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) used to reserve quota before a call."""
+    return (len(text) + 3) // 4 + REPLY_TOKEN_ALLOWANCE
+
+
+def rate_limit_info(error):
+    """(is_rate_limited, retry_after seconds or None) for an exception raised by an API call."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    text = str(error)
+    rate_limited = code == 429 or "RESOURCE_EXHAUSTED" in text
+
+    retry_after = getattr(error, "retry_after", None)
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if retry_after is None and headers is not None and headers.get("retry-after"):
+        try:
+            retry_after = float(headers.get("retry-after"))
+        except ValueError:
+            pass
+    if retry_after is None and rate_limited:
+        match = RETRY_DELAY_PATTERN.search(text)  # Gemini puts e.g. "retryDelay": "23s" in the error details
+        if match:
+            retry_after = float(match.group(1))
+    return rate_limited, retry_after
+
+
+def usage_tokens(response):
+    """Total tokens a Gemini response reports using, or None."""
+    metadata = getattr(response, "usage_metadata", None)
+    return getattr(metadata, "total_token_count", None) if metadata is not None else None
+
+
+class TokenBucket:
+    """Holds up to capacity units and refills at capacity per window seconds. Not locked; KeyScheduler is."""
+
+    def __init__(self, capacity, window, now):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.level = float(capacity)
+        self.updated = now
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount units are available (requests larger than the bucket wait for a full one)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def drain(self, now):
+        self._refill(now)
+        self.level = min(self.level, 0.0)
+
+
+class KeyState:
+    """Buckets, load and health of one API key."""
+
+    def __init__(self, key, rpm, tpm, window, now):
+        self.key = key
+        self.requests = TokenBucket(rpm, window, now)
+        self.tokens = TokenBucket(tpm, window, now)
+        self.in_flight = 0
+        self.failures = 0  # Consecutive, reset by any success
+        self.rate_limit_streak = 0
+        self.cooldown_until = 0.0
+        self.breaker = "closed"  # closed -> open -> half_open -> closed
+        self.open_until = 0.0
+        self.stats = {"calls": 0, "successes": 0, "rate_limited": 0, "errors": 0, "retries": 0, "breaker_trips": 0}
+
+    def wait_time(self, tokens, now):
+        if self.breaker == "open":
+            if now < self.open_until:
+                return self.open_until - now
+            self.breaker = "half_open"
+        if self.breaker == "half_open" and self.in_flight:
+            return PROBE_WAIT  # One probe at a time
+        return max(
+            self.cooldown_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(tokens, now),
+            0.0,
+        )
+
+
+class KeyLease:
+    """
+    One call's claim on a key. Report the outcome with succeeded() or failed(),
+    or hand the slot back with released() when the call was abandoned.
+    """
+
+    def __init__(self, scheduler, state, tokens):
+        self.scheduler = scheduler
+        self.state = state
+        self.tokens = tokens
+        self.key = state.key
+        self._released = False
+
+    def succeeded(self, actual_tokens=None):
+        self.scheduler._release(self, "success", actual_tokens=actual_tokens)
+
+    def failed(self, rate_limited=False, retry_after=None):
+        self.scheduler._release(self, "rate_limited" if rate_limited else "error", retry_after=retry_after)
+
+    def released(self):
+        """Returns the slot without an outcome: failure counts and the breaker stay as they were."""
+        self.scheduler._release(self, "released")
+
+
+class KeyScheduler:
+    """Hands out API keys within their RPM/TPM quotas, least-loaded first, with backoff and breakers."""
+
+    def __init__(self, keys, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, window=60.0, failure_threshold=FAILURE_THRESHOLD,
+                 breaker_timeout=BREAKER_TIMEOUT, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF, clock=time.monotonic):
+        if not keys:
+            raise ValueError("KeyScheduler needs at least one key")
+        self.clock = clock
+        now = clock()
+        self.states = [KeyState(key, rpm, tpm, window, now) for key in keys]
+        self.failure_threshold = failure_threshold
+        self.breaker_timeout = breaker_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens=0, exclude=()):
+        """Returns (lease, 0) if a key is ready now, else (None, seconds until one should be). Keys in exclude are never picked."""
+        with self._lock:
+            now = self.clock()
+            best, shortest_wait = None, math.inf
+            for state in self.states:
+                if state.key in exclude:
+                    continue
+                wait = state.wait_time(tokens, now)
+                if wait > 0:
+                    shortest_wait = min(shortest_wait, wait)
+                # Least loaded: fewest calls in flight, then the most token quota left
+                elif best is None or (state.in_flight, -state.tokens.level) < (best.in_flight, -best.tokens.level):
+                    best = state
+            if best is None:
+                return None, shortest_wait
+
+            best.requests.take(1, now)
+            best.tokens.take(tokens, now)
+            best.in_flight += 1
+            best.stats["calls"] += 1
+            return KeyLease(self, best, tokens), 0.0
+
+    def acquire(self, tokens=0, timeout=None, exclude=()):
+        """Blocks until a key has quota for one request of about tokens tokens."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            lease, wait = self.try_acquire(tokens, exclude)
+            if lease is None and wait == math.inf:
+                raise QuotaUnavailable("Every API key is excluded")
+            if lease is not None:
+                return lease
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QuotaUnavailable(f"No API key had quota within {timeout}s")
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0, timeout=None, exclude=()):
+        """acquire() for asyncio callers."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            lease, wait = self.try_acquire(tokens, exclude)
+            if lease is None and wait == math.inf:
+                raise QuotaUnavailable("Every API key is excluded")
+            if lease is not None:
+                return lease
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QuotaUnavailable(f"No API key had quota within {timeout}s")
+                wait = min(wait, remaining)
+            await asyncio.sleep(wait)
+
+    def _release(self, lease, outcome, actual_tokens=None, retry_after=None):
+        if lease._released:
+            return
+        lease._released = True
+        state = lease.state
+
+        with self._lock:
+            now = self.clock()
+            state.in_flight -= 1
+            if outcome == "released":
+                return  # A cancelled half-open probe leaves the breaker half-open for the next one
+
+            if outcome == "success":
+                state.stats["successes"] += 1
+                state.failures = 0
+                state.rate_limit_streak = 0
+                state.breaker = "closed"
+                if actual_tokens is not None:
+                    state.tokens.take(actual_tokens - lease.tokens, now)  # Refund or charge the estimate's error
+                return
+
+            state.failures += 1
+            if outcome == "rate_limited":
+                state.stats["rate_limited"] += 1
+                state.rate_limit_streak += 1
+                # The server disagrees with our bookkeeping: stop sending on this key for a while
+                state.requests.drain(now)
+                if retry_after is None:
+                    backoff = min(self.max_backoff, self.base_backoff * 2 ** (state.rate_limit_streak - 1))
+                    retry_after = backoff * random.uniform(0.5, 1.0)
+                state.cooldown_until = max(state.cooldown_until, now + retry_after)
+            else:
+                state.stats["errors"] += 1
+
+            if state.breaker == "half_open" or state.failures >= self.failure_threshold:
+                if state.breaker != "open":
+                    state.stats["breaker_trips"] += 1
+                state.breaker = "open"
+                state.open_until = now + self.breaker_timeout
+
+    def note_retry(self, lease):
+        with self._lock:
+            lease.state.stats["retries"] += 1
+
+    def call(self, fn, tokens=0, attempts=3, timeout=None):
+        """
+        Runs fn(key) on a scheduled key and returns its result. Failures are reported
+        to the scheduler and retried (possibly on another key) up to attempts times.
+        """
+        for attempt in range(1, attempts + 1):
+            lease = self.acquire(tokens, timeout)
+            try:
+                result = fn(lease.key)
+            except Exception as e:
+                lease.failed(*rate_limit_info(e))
+                if attempt == attempts:
+                    raise
+                self.note_retry(lease)
+                continue
+            lease.succeeded(usage_tokens(result))
+            return result
+
+    async def acall(self, coro_fn, tokens=0, attempts=3, timeout=None, exclude=()):
+        """call() for coroutine functions. Keys in exclude are never used (e.g. the one a hedged call is duplicating)."""
+        for attempt in range(1, attempts + 1):
+            lease = await self.aacquire(tokens, timeout, exclude)
+            try:
+                result = await coro_fn(lease.key)
+            except asyncio.CancelledError:
+                lease.released()  # Abandoned by the caller, says nothing about the key
+                raise
+            except Exception as e:
+                lease.failed(*rate_limit_info(e))
+                if attempt == attempts:
+                    raise
+                self.note_retry(lease)
+                continue
+            lease.succeeded(usage_tokens(result))
+            return result
+
+    def snapshot(self):
+        """Per-key load, health and counters, for stats endpoints and reports."""
+        with self._lock:
+            now = self.clock()
+            return {
+                state.key: {
+                    **state.stats,
+                    "in_flight": state.in_flight,
+                    "breaker": state.breaker,
+                    "breaker_open": state.breaker != "closed",
+                    "cooling_down_s": round(max(0.0, state.cooldown_until - now), 2),
+                    "requests_left": round(state.requests.level, 1),
+                    "tokens_left": round(state.tokens.level),
+                }
+                for state in self.states
+            }
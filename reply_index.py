@@ -0,0 +1,261 @@
+"""
+Cue -> reply index: what a character said back to a line like the user's
+message, rather than the character's own line that looks like it.
+
+Ingest records every (cue -> reply) pair in dialogue_replies, the cue being
+the line someone else spoke right before the reply. build_index() takes
+the MinHash signature of each cue's word set and files the cue in BANDS LSH
+buckets (ROWS_PER_BAND signature rows each), keyed together with the
+replying character and the band. The keys of all bands sit in one sorted
+array, so a query hashes the message the same way and finds all its
+buckets with two vectorized binary searches, then scores only the cues it
+met there with rapidfuzz, instead of every cue the character has. With the
+defaults a cue sharing half its words with the message collides in some
+band ~99% of the time, one sharing a tenth ~3%.
+
+Every array is an .npy file opened with mmap_mode="r", and the cue texts
+are one packed UTF-8 file, so loading reads nothing up front and every
+process serving the index shares its pages.
+
+    python reply_index.py --db movie_dialogues.db
+    python reply_index.py --query KAFFEE "I want the truth!"
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+
+from fuzzy_index import db_signature
+from shards import global_line_id, storage_files
+
+DB_FILE = "movie_dialogues.db"
+REPLY_INDEX_DIR = "reply_index"
+
+INDEX_VERSION = 1
+NUM_PERM = 96  # MinHash functions per signature
+ROWS_PER_BAND = 3  # Signature rows per LSH band, so 32 bands
+MAX_BUCKET_CANDIDATES = 256  # Cues taken from one bucket; stop-word-only cues ("What?") share huge buckets
+SCORE_CUTOFF = 80  # token_sort_ratio the best cue must reach
+MERSENNE_PRIME = (1 << 61) - 1
+HASH_SEED = 17
+SIGNATURE_CHUNK = 50000  # Cues hashed per numpy batch while building
+FNV_PRIME = np.uint64(0x100000001B3)
+
+
+def shingles(text):
+    """The distinct words of a line, after rapidfuzz's default processing (lowercase, no punctuation)."""
+    return set(utils.default_process(text).split())
+
+
+def hash_functions(num_perm=NUM_PERM, seed=HASH_SEED):
+    """(a, b) for the h(x) = (a*x + b) mod 2^61-1 permutations; a < 2^29 keeps a*x + b inside uint64."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 29, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def signatures(texts, a, b):
+    """(len(texts), num_perm) uint64 MinHash signatures; a text without words gets all-max rows."""
+    token_hashes, owners = [], []
+    for row, text in enumerate(texts):
+        for token in shingles(text):
+            token_hashes.append(zlib.crc32(token.encode("utf-8")))
+            owners.append(row)
+    result = np.full((len(texts), len(a)), np.iinfo(np.uint64).max, dtype=np.uint64)
+    if not token_hashes:
+        return result
+
+    owners = np.asarray(owners)
+    hashed = (np.asarray(token_hashes, dtype=np.uint64)[:, None] * a + b) % np.uint64(MERSENNE_PRIME)
+    # Tokens arrive grouped by text, so each text's minimum is one reduceat segment
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    result[owners[starts]] = np.minimum.reduceat(hashed, starts, axis=0)
+    return result
+
+
+def bucket_keys(signature_rows, character_codes, rows_per_band=ROWS_PER_BAND):
+    """(n, bands) uint64 bucket keys: an FNV-style mix of the character, the band and the band's signature rows."""
+    n, num_perm = signature_rows.shape
+    bands = num_perm // rows_per_band
+    rows = signature_rows[:, :bands * rows_per_band].reshape(n, bands, rows_per_band)
+    with np.errstate(over="ignore"):  # The multiplications wrap around on purpose
+        keys = np.asarray(character_codes, dtype=np.uint64)[:, None] * np.uint64(bands) + np.arange(bands, dtype=np.uint64)
+        keys = (keys + np.uint64(0xCBF29CE484222325)) * FNV_PRIME
+        for column in range(rows_per_band):
+            keys = (keys ^ rows[:, :, column]) * FNV_PRIME
+    return keys
+
+
+def load_pairs(db_file=DB_FILE):
+    """(character, cue, reply line id) for every recorded pair; ids of a sharded store are global (see shards.py)."""
+    pairs = []
+    for shard, path in enumerate(storage_files(db_file)):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("""
+                SELECT r.character_name, r.cue, l.id
+                FROM dialogue_replies AS r
+                JOIN dialogue_lines AS l
+                  ON l.script_name = r.script_name AND l.character_name = r.character_name AND l.line_no = r.line_no
+            """)
+            pairs.extend((character, cue, global_line_id(shard, line_id)) for character, cue, line_id in rows)
+        except sqlite3.OperationalError as e:
+            raise RuntimeError(f"{path} has no cue/reply pairs ({e}); re-run stage 4 to record them") from e
+        finally:
+            conn.close()
+    return pairs
+
+
+def build_index(db_file=DB_FILE, out_dir=REPLY_INDEX_DIR, num_perm=NUM_PERM, rows_per_band=ROWS_PER_BAND):
+    """
+    Writes the index files to out_dir: bucket_keys.npy (every band's key of
+    every cue, sorted) and bucket_rows.npy (the cue each key belongs to),
+    reply_ids.npy, character_offsets.npy (rows are grouped by character),
+    cue_offsets.npy + cues.bin (the cues, preprocessed for rapidfuzz) and
+    meta.json, which records the DB signature the reply ids belong to.
+    """
+    start = time.time()
+    signature = db_signature(db_file)
+    pairs = sorted(load_pairs(db_file), key=lambda pair: pair[0])
+    if not pairs:
+        raise RuntimeError(f"No cue/reply pairs found in {db_file}")
+
+    characters = sorted({character for character, _, _ in pairs})
+    character_code = {name: code for code, name in enumerate(characters)}
+    codes = np.array([character_code[character] for character, _, _ in pairs], dtype=np.int64)
+    a, b = hash_functions(num_perm)
+    signature_rows = np.concatenate([
+        signatures([cue for _, cue, _ in pairs[chunk:chunk + SIGNATURE_CHUNK]], a, b)
+        for chunk in range(0, len(pairs), SIGNATURE_CHUNK)
+    ])
+    keys = bucket_keys(signature_rows, codes, rows_per_band).ravel()
+    order = np.argsort(keys, kind="stable")  # Stable, so a bucket lists its cues in row order
+    bands = num_perm // rows_per_band
+
+    encoded = [utils.default_process(cue).encode("utf-8") for _, cue, _ in pairs]
+    cue_offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+    np.cumsum([len(cue) for cue in encoded], out=cue_offsets[1:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "bucket_keys.npy"), keys[order])
+    np.save(os.path.join(out_dir, "bucket_rows.npy"), (order // bands).astype(np.int32))
+    np.save(os.path.join(out_dir, "reply_ids.npy"), np.array([line_id for _, _, line_id in pairs], dtype=np.int64))
+    np.save(os.path.join(out_dir, "character_offsets.npy"), np.searchsorted(codes, np.arange(len(characters) + 1)))
+    np.save(os.path.join(out_dir, "cue_offsets.npy"), cue_offsets)
+    with open(os.path.join(out_dir, "cues.bin"), "wb") as file:
+        file.write(b"".join(encoded))
+    meta = {
+        "version": INDEX_VERSION, "db_file": db_file, "count": len(pairs), "num_perm": num_perm,
+        "rows_per_band": rows_per_band, "seed": HASH_SEED, "characters": characters, "db_signature": signature,
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+
+    print(f"✅ Indexed {len(pairs)} cue/reply pairs of {len(characters)} characters "
+          f"({bands} bands) in {time.time() - start:.1f}s")
+    return meta
+
+
+class ReplyIndex:
+    """Read-only view over an index built by build_index(); everything stays memory-mapped."""
+
+    def __init__(self, index_dir=REPLY_INDEX_DIR):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as file:
+            self.meta = json.load(file)
+        if self.meta["version"] != INDEX_VERSION:
+            raise RuntimeError(f"Reply index in {index_dir} is version {self.meta['version']}, expected {INDEX_VERSION}")
+
+        self.bucket_keys = np.load(os.path.join(index_dir, "bucket_keys.npy"), mmap_mode="r")
+        self.bucket_rows = np.load(os.path.join(index_dir, "bucket_rows.npy"), mmap_mode="r")
+        self.reply_ids = np.load(os.path.join(index_dir, "reply_ids.npy"), mmap_mode="r")
+        self.character_offsets = np.load(os.path.join(index_dir, "character_offsets.npy"), mmap_mode="r")
+        self.cue_offsets = np.load(os.path.join(index_dir, "cue_offsets.npy"), mmap_mode="r")
+        # np.memmap refuses empty files, and an index always holds at least one cue
+        self.cue_bytes = np.memmap(os.path.join(index_dir, "cues.bin"), dtype=np.uint8, mode="r")
+        self.hashes = hash_functions(self.meta["num_perm"], self.meta["seed"])
+        self.character_code = {name: code for code, name in enumerate(self.meta["characters"])}
+
+    @classmethod
+    def load_if_exists(cls, index_dir=REPLY_INDEX_DIR):
+        """Returns the index, or None when it has not been built yet."""
+        if not os.path.exists(os.path.join(index_dir, "meta.json")):
+            return None
+        return cls(index_dir)
+
+    def is_current(self, db_file):
+        """False once db_file was written after the build: the reply ids may name other lines by now."""
+        return self.meta.get("db_signature") == json.loads(json.dumps(db_signature(db_file)))
+
+    def __len__(self):
+        return len(self.reply_ids)
+
+    def cue(self, row):
+        """The row's cue, as preprocessed for rapidfuzz."""
+        return bytes(self.cue_bytes[self.cue_offsets[row]:self.cue_offsets[row + 1]]).decode("utf-8")
+
+    def character_rows(self, character):
+        """range of the rows holding the character's pairs (empty if unknown)."""
+        code = self.character_code.get(character)
+        if code is None:
+            return range(0)
+        return range(int(self.character_offsets[code]), int(self.character_offsets[code + 1]))
+
+    def candidates(self, user_message, character):
+        """Rows of the character's cues that share an LSH bucket with the message."""
+        code = self.character_code.get(character)
+        if code is None or not shingles(user_message):
+            return np.empty(0, dtype=np.int32)
+        keys = bucket_keys(signatures([user_message], *self.hashes), [code], self.meta["rows_per_band"])[0]
+        starts = np.searchsorted(self.bucket_keys, keys, side="left")
+        ends = np.minimum(np.searchsorted(self.bucket_keys, keys, side="right"), starts + MAX_BUCKET_CANDIDATES)
+        found = [self.bucket_rows[start:end] for start, end in zip(starts, ends) if end > start]
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int32)
+
+    def search(self, user_message, character, score_cutoff=SCORE_CUTOFF, line_ids=None):
+        """
+        (reply line id, score, cue) for the character's reply to the closest cue, or None.
+        line_ids, when given, limits the replies to those lines (e.g. one script's).
+        """
+        rows = self.candidates(user_message, character)
+        if line_ids is not None and len(rows):
+            rows = rows[np.isin(self.reply_ids[rows], np.fromiter(line_ids, dtype=np.int64))]
+        if not len(rows):
+            return None
+        cues = [self.cue(row) for row in rows]
+        best = process.extractOne(utils.default_process(user_message), cues, scorer=fuzz.token_sort_ratio,
+                                  processor=None, score_cutoff=score_cutoff)
+        if best is None:
+            return None
+        row = int(rows[best[2]])
+        return int(self.reply_ids[row]), best[1], self.cue(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DB_FILE, help="dialogue DB or shard manifest")
+    parser.add_argument("--out", default=REPLY_INDEX_DIR)
+    parser.add_argument("--perm", type=int, default=NUM_PERM, help="MinHash functions per signature")
+    parser.add_argument("--rows", type=int, default=ROWS_PER_BAND, help="signature rows per LSH band")
+    parser.add_argument("--query", nargs=2, metavar=("CHARACTER", "MESSAGE"), help="look up a reply instead of building")
+    args = parser.parse_args()
+
+    if args.query:
+        from shards import ShardRouter
+
+        index = ReplyIndex(args.out)
+        start = time.perf_counter()
+        match = index.search(args.query[1], args.query[0])
+        elapsed = (time.perf_counter() - start) * 1000
+        if match is None:
+            print(f"❌ No cue close enough ({elapsed:.2f}ms)")
+        else:
+            reply = ShardRouter(args.db, persistent=False).fetch_line_texts([match[0]])
+            print(f"💬 Cue ({match[1]:.0f}): {match[2]}\n🗣️ Reply: {reply[0] if reply else '?'} ({elapsed:.2f}ms)")
+    else:
+        build_index(args.db, args.out, args.perm, args.rows)
@@ -0,0 +1,45 @@
+import json
+import os
+import time
+
+# JSON lines of the requests the DB could not answer, mined by warm_cache.py; unset turns logging off
+REQUEST_LOG = os.environ.get("REQUEST_LOG")
+MAX_LINE_BYTES = 4096  # Longer requests are not logged; warm_cache.py has no use for one-off essays
+
+
+class RequestLog:
+    """
+    Appends one {"ts", "character", "user_message"} line per request. Each
+    line is a single os.write() on an O_APPEND descriptor, so lines from
+    several threads or worker processes land whole on a local file system
+    instead of being split where a buffered file would flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    @classmethod
+    def from_env(cls):
+        return cls(REQUEST_LOG) if REQUEST_LOG else None
+
+    def record(self, character, user_message):
+        line = json.dumps({"ts": round(time.time(), 3), "character": character, "user_message": user_message})
+        data = (line + "\n").encode("utf-8")
+        if len(data) <= MAX_LINE_BYTES:
+            os.write(self._fd, data)
+
+    def close(self):
+        os.close(self._fd)
+
+
+def read_requests(path):
+    """(character, user_message) per line of a request log. Bare /chat request bodies work too; bad lines are skipped."""
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(entry, dict) and entry.get("character") and entry.get("user_message"):
+                yield entry["character"], entry["user_message"]
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DB_FILE = "response_cache.db"
+MEMORY_MAX_ENTRIES = 10000
+MEMORY_TTL = 15 * 60  # Seconds an entry lives in the in-process tier
+DISK_TTL = 7 * 24 * 60 * 60  # Seconds an entry lives in the shared SQLite tier
+PRECOMPUTED_CHECK_INTERVAL = 5.0  # Seconds between checks for a new warm_cache.py run
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def normalize_message(text):
+    """Case, whitespace and punctuation-insensitive form of a message: 'Hello,  AI!' -> 'hello ai'."""
+    return " ".join(TOKEN_PATTERN.findall(text.casefold()))
+
+
+def cache_key(character, user_message, model, prompt_version):
+    """Stable key for one (character, message, model, prompt version) combination."""
+    parts = [character.strip().casefold(), normalize_message(user_message), model, str(prompt_version)]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=MEMORY_MAX_ENTRIES, ttl=MEMORY_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        expires_at = min(expires_at or float("inf"), time.time() + self.ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def create_precomputed_table(conn):
+    """Replies bulk-loaded by warm_cache.py, keyed like response_cache so a new model or prompt version never matches."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS precomputed_responses (
+        key TEXT PRIMARY KEY,
+        character_name TEXT NOT NULL,
+        user_message TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        response TEXT NOT NULL,
+        requests INTEGER NOT NULL,
+        generated_at REAL NOT NULL
+    )
+    """)
+    conn.commit()
+
+
+class PrecomputedReplies:
+    """
+    In-memory copy of the precomputed_responses table (a few hundred hot
+    pairs), so a lookup is a dict get. Reloaded when a warm_cache.py run
+    changes the table, checked at most every few seconds.
+    """
+
+    def __init__(self, connection, check_interval=PRECOMPUTED_CHECK_INTERVAL):
+        self._connection = connection
+        self.check_interval = check_interval
+        self._replies = {}
+        self._signature = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.maybe_reload()
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            if now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            conn = self._connection()
+            signature = conn.execute("SELECT count(*), max(generated_at) FROM precomputed_responses").fetchone()
+            if signature != self._signature:
+                self._replies = dict(conn.execute("SELECT key, response FROM precomputed_responses"))
+                self._signature = signature
+
+    def get(self, key):
+        self.maybe_reload()
+        return self._replies.get(key)
+
+    def __len__(self):
+        return len(self._replies)
+
+
+class ResponseCache:
+    """
+    Two-tier cache for generated replies: an in-process LRU in front of a
+    SQLite table that survives restarts and is shared by every worker process
+    on the host (WAL mode, so readers never block the writer). Replies
+    precomputed by warm_cache.py for hot pairs are checked before either.
+    """
+
+    def __init__(self, db_file=CACHE_DB_FILE, max_entries=MEMORY_MAX_ENTRIES, memory_ttl=MEMORY_TTL, disk_ttl=DISK_TTL):
+        self.db_file = db_file
+        self.disk_ttl = disk_ttl
+        self.memory = LRUCache(max_entries, memory_ttl)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {"precomputed_hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+        self._create_table()
+        self.precomputed = PrecomputedReplies(self._connection)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_table(self):
+        conn = self._connection()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            character_name TEXT NOT NULL,
+            user_message TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """)
+        conn.commit()
+        create_precomputed_table(conn)
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def note_bypass(self):
+        """Counts a request that skipped the lookup on purpose."""
+        self._count("bypassed")
+
+    def get(self, character, user_message, model, prompt_version):
+        """Returns the cached reply or None, checking the precomputed replies, then memory, then SQLite."""
+        key = cache_key(character, user_message, model, prompt_version)
+
+        response = self.precomputed.get(key)
+        if response is not None:
+            self._count("precomputed_hits")
+            return response
+
+        response = self.memory.get(key)
+        if response is not None:
+            self._count("memory_hits")
+            return response
+
+        row = self._connection().execute(
+            "SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+
+        # Promote to the memory tier, but never past the disk entry's own expiry
+        self.memory.set(key, row[0], row[1])
+        self._count("disk_hits")
+        return row[0]
+
+    def set(self, character, user_message, model, prompt_version, response):
+        """Stores a reply in both tiers."""
+        key = cache_key(character, user_message, model, prompt_version)
+        now = time.time()
+        self.memory.set(key, response)
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO response_cache
+                    (key, character_name, user_message, model, prompt_version, response, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    response = excluded.response, created_at = excluded.created_at, expires_at = excluded.expires_at
+                """,
+                (key, character, user_message, model, str(prompt_version), response, now, now + self.disk_ttl),
+            )
+        self._count("stores")
+
+    def get_or_generate(self, character, user_message, model, prompt_version, generate, bypass=False, flight=None):
+        """
+        Returns a cached reply, or calls generate() and caches what it returns.
+        bypass=True skips the lookup but still stores the fresh reply.
+        generate() may return None to signal a failure that must not be cached.
+        With a SingleFlight, concurrent misses for the same key share one generate() call.
+        """
+        if bypass:
+            self.note_bypass()
+        else:
+            response = self.get(character, user_message, model, prompt_version)
+            if response is not None:
+                return response
+
+        def generate_and_store():
+            response = generate()
+            if response is not None:
+                self.set(character, user_message, model, prompt_version, response)
+            return response
+
+        if flight is None:
+            return generate_and_store()
+
+        # Stored before the flight ends, so a worker process waiting on the same key finds it on recheck
+        return flight.do(
+            cache_key(character, user_message, model, prompt_version), generate_and_store,
+            recheck=lambda: self.get(character, user_message, model, prompt_version),
+        )
+
+    def purge_expired(self):
+        """Deletes expired rows from the SQLite tier. Returns how many were removed."""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def snapshot(self):
+        """Counters plus hit rate, for the stats endpoint."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        hits = stats["precomputed_hits"] + stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        stats["precomputed_entries"] = len(self.precomputed)
+        return stats
@@ -0,0 +1,106 @@
+"""
+Single-pass parser for the <pre> screenplays saved by stage 2.
+
+A speaker block is a cue line (usually <b>-wrapped, always just the name,
+possibly with an extension like "(V.O.)" or "(CONT'D)") followed by indented
+dialogue lines up to the next blank line. Cues are matched against the
+script's character names with set lookups, so the cost is linear in the
+script size no matter how many characters it has, and names mentioned in
+action lines are never taken for speakers.
+"""
+import html
+import re
+
+TAG_PATTERN = re.compile(r"<[^>]*>")
+EXTENSION_PATTERN = re.compile(r"\s*\([^)]*\)\s*$")  # "KAFFEE (CONT'D)" -> "KAFFEE"
+SPACES_PATTERN = re.compile(r"\s+")
+
+
+def normalize_cue(text):
+    """Upper-cased, whitespace-collapsed form used to compare cues with character names."""
+    return SPACES_PATTERN.sub(" ", text).strip().upper()
+
+
+def build_cue_lookup(character_names):
+    """{normalized name: name as given} for the script's characters."""
+    return {normalize_cue(name): name for name in character_names if name.strip()}
+
+
+def match_cue(cue, lookup):
+    """The character a cue line names, or None. Tries the cue as written, then without extensions."""
+    cue = normalize_cue(cue)
+    while cue:
+        character = lookup.get(cue)
+        if character is not None:
+            return character
+        stripped = EXTENSION_PATTERN.sub("", cue)
+        if stripped == cue:
+            return None
+        cue = stripped
+    return None
+
+
+def indentation(line):
+    return len(line) - len(line.lstrip())
+
+
+def join_block(block):
+    """One dialogue string from a block's stripped lines."""
+    return SPACES_PATTERN.sub(" ", html.unescape(" ".join(block)))
+
+
+def pre_content(text):
+    """The <pre> body of a saved script page, or the whole text when there is none."""
+    start = text.find("<pre>")
+    if start == -1:
+        return text
+    end = text.rfind("</pre>")
+    return text[start + len("<pre>"):end if end > start else len(text)]
+
+
+def parse_screenplay(text, character_names):
+    """
+    Yields (character, line_no, dialogue) for every speaker block in a script, in script order.
+    line_no counts the yielded records from 0.
+    """
+    lookup = build_cue_lookup(character_names)
+    if not lookup:
+        return
+
+    line_no = 0
+    speaker = None  # Character whose block is being read
+    block = []
+    block_indent = 0
+
+    for raw_line in pre_content(text).splitlines():
+        bold = "<b>" in raw_line
+        line = TAG_PATTERN.sub("", raw_line) if "<" in raw_line else raw_line
+
+        if speaker is not None:
+            stripped = line.strip()
+            if stripped.startswith("(") and stripped.endswith(")") and not bold:
+                continue  # Parenthetical direction such as "(beat)", not spoken
+            # A blank line, a less indented line or a new bold cue ends the block
+            if stripped and not bold and (not block or indentation(line) >= block_indent):
+                if not block:
+                    block_indent = indentation(line)
+                block.append(stripped)
+                continue
+            if block:
+                yield speaker, line_no, join_block(block)
+                line_no += 1
+            speaker, block = None, []
+
+        # Cue lines are short and hold nothing but the name
+        if line and (bold or line.isupper()):
+            speaker = match_cue(html.unescape(line), lookup)
+
+    if speaker is not None and block:
+        yield speaker, line_no, join_block(block)
+
+
+def iter_dialogue_lines(script_file, character_names):
+    """parse_screenplay over a saved script file."""
+    with open(script_file, "r", encoding="utf-8") as file:
+        script_text = file.read()
+    yield from parse_screenplay(script_text, character_names)
@@ -0,0 +1,327 @@
+"""
+Asyncio engine behind 2_moviescraper_script_parallelized.py.
+
+One pooled keep-alive httpx client fetches every script, with a cap per
+host. Bodies are streamed and only the <pre> block is written, via a .part
+file so a crash never leaves a truncated script behind.
+
+Every URL has a row in a SQLite manifest holding its ETag/Last-Modified,
+outcome and retry state:
+- Scripts already on disk are revalidated with conditional GETs, so
+  unchanged ones come back as 304 and are skipped.
+- Transient failures (timeouts, 429, 5xx) are retried with backoff, and
+  after MAX_ATTEMPTS they are marked failed.
+- A run that dies part-way is resumed by the next one, which only visits the
+  URLs it had not reached yet.
+"""
+import asyncio
+import os
+import sqlite3
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+from tqdm import tqdm
+
+from script_store import ScriptStore
+
+SCRIPT_FOLDER = "movie_scripts"
+MANIFEST_DB = "scrape_manifest.db"
+MAX_CONNECTIONS = 32  # Pooled connections across all hosts
+PER_HOST_LIMIT = 8  # Requests in flight per host, to stay polite
+REQUEST_TIMEOUT = 10
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2.0  # Seconds; doubled after every failed attempt
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+USER_AGENT = "DharmaIQ-script-scraper/1.0"
+
+
+def safe_filename(title):
+    """Script filename for a movie title, same rule as before (invalid characters become '_')."""
+    safe_title = "".join(c if c.isalnum() or c in " _-" else "_" for c in title)
+    return f"{safe_title}.txt"
+
+
+class ScrapeManifest:
+    """
+    SQLite record of every script URL: validators for conditional GETs, the
+    last outcome, and retry state. Each row is committed as soon as it
+    changes, which is what makes runs resumable.
+    """
+
+    def __init__(self, db_file=MANIFEST_DB):
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS scrape_runs (
+            id INTEGER PRIMARY KEY,
+            started_at REAL NOT NULL,
+            finished_at REAL
+        );
+
+        CREATE TABLE IF NOT EXISTS scrape_manifest (
+            url TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            checked_run INTEGER,
+            updated_at REAL
+        );
+        """)
+        self.conn.commit()
+
+    def begin_run(self):
+        """Returns (run_id, resumed): the unfinished run if the last one crashed, else a new one."""
+        row = self.conn.execute("SELECT id, finished_at FROM scrape_runs ORDER BY id DESC LIMIT 1").fetchone()
+        if row is not None and row[1] is None:
+            return row[0], True
+
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO scrape_runs (started_at) VALUES (?)", (time.time(),))
+            # A new run gives previously failed scripts a fresh set of attempts
+            self.conn.execute("UPDATE scrape_manifest SET attempts = 0, next_attempt_at = 0 WHERE status IN ('retry', 'failed')")
+        return cursor.lastrowid, False
+
+    def finish_run(self, run_id):
+        with self.conn:
+            self.conn.execute("UPDATE scrape_runs SET finished_at = ? WHERE id = ?", (time.time(), run_id))
+
+    def add_targets(self, movies):
+        """Registers (title, url) pairs; known URLs keep their validators and state."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO scrape_manifest (url, title, filename) VALUES (?, ?, ?)",
+                ((url, title, safe_filename(title)) for title, url in movies),
+            )
+
+    def pending(self, run_id, urls):
+        """The given URLs this run still has to visit, in order: unvisited ones plus queued retries."""
+        rows = self.conn.execute(
+            """
+            SELECT url, title, filename, etag, last_modified, attempts, next_attempt_at
+            FROM scrape_manifest
+            WHERE checked_run IS NOT ? OR status = 'retry'
+            """,
+            (run_id,),
+        ).fetchall()
+        by_url = {row[0]: row for row in rows}
+        return [by_url[url] for url in dict.fromkeys(urls) if url in by_url]
+
+    def record(self, url, run_id, status, etag=None, last_modified=None, error=None, next_attempt_at=0.0, attempts=None):
+        """Stores the outcome of one fetch. Validators are only replaced when new ones are given."""
+        with self.conn:
+            self.conn.execute(
+                """
+                UPDATE scrape_manifest SET
+                    status = ?,
+                    etag = COALESCE(?, etag),
+                    last_modified = COALESCE(?, last_modified),
+                    last_error = ?,
+                    next_attempt_at = ?,
+                    attempts = COALESCE(?, attempts),
+                    checked_run = ?,
+                    updated_at = ?
+                WHERE url = ?
+                """,
+                (status, etag, last_modified, error, next_attempt_at, attempts, run_id, time.time(), url),
+            )
+
+    def summary(self):
+        """{status: count} over the whole manifest."""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM scrape_manifest GROUP BY status").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+class PreExtractor:
+    """Incrementally cuts the first <pre>...</pre> block out of streamed HTML."""
+
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self._tail = ""  # Unconsumed text that may hold a tag split across chunks
+
+    def feed(self, chunk):
+        """Returns the part of chunk that belongs to the <pre> block (tags included)."""
+        if self.done:
+            return ""
+        text = self._tail + chunk
+        self._tail = ""
+
+        if not self.started:
+            start = text.lower().find("<pre")
+            if start == -1:
+                self._tail = text[-4:]
+                return ""
+            self.started = True
+            text = text[start:]
+
+        end = text.lower().find("</pre>")
+        if end != -1:
+            self.done = True
+            return text[:end + len("</pre>")]
+
+        # Hold back a possible partial "</pre>" for the next chunk
+        keep = max(0, len(text) - 5)
+        self._tail = text[keep:]
+        return text[:keep]
+
+
+def retry_delay(attempts, response=None):
+    """Seconds before the next attempt: the server's Retry-After when given, else exponential backoff."""
+    if response is not None and "retry-after" in response.headers:
+        value = response.headers["retry-after"]
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return RETRY_BASE_DELAY * 2 ** (attempts - 1)
+
+
+class ScriptScraper:
+    """Fetches (title, url) pairs into script_folder, driven by a ScrapeManifest."""
+
+    def __init__(self, script_folder=SCRIPT_FOLDER, manifest_db=MANIFEST_DB, max_connections=MAX_CONNECTIONS,
+                 per_host_limit=PER_HOST_LIMIT, timeout=REQUEST_TIMEOUT, max_attempts=MAX_ATTEMPTS, store_dir=None):
+        self.script_folder = script_folder
+        # Scripts already moved into a packed store still count as local copies for revalidation
+        self.store = ScriptStore.load_if_exists(store_dir) if store_dir else None
+        self.manifest = ScrapeManifest(manifest_db)
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self._host_slots = {}
+        os.makedirs(script_folder, exist_ok=True)
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_slots[host]
+
+    async def fetch(self, client, run_id, row):
+        """Fetches one script. Returns the outcome recorded in the manifest."""
+        url, title, filename, etag, last_modified, attempts, _ = row
+        path = os.path.join(self.script_folder, filename)
+
+        # Validators only help if the copy they describe is still on disk
+        headers = {}
+        if os.path.exists(path) or (self.store is not None and filename in self.store):
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        attempts += 1
+        try:
+            async with self._host_slot(url):
+                async with client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304:
+                        self.manifest.record(url, run_id, "unchanged", response.headers.get("etag"),
+                                             response.headers.get("last-modified"), attempts=0)
+                        return "unchanged"
+                    if response.status_code in RETRYABLE_STATUS:
+                        return self._retry(url, run_id, attempts, f"HTTP {response.status_code}", response)
+                    if response.status_code != 200:
+                        self.manifest.record(url, run_id, "not_found", error=f"HTTP {response.status_code}", attempts=0)
+                        return "not_found"
+
+                    found = await self._save_pre(response, path)
+                    new_etag = response.headers.get("etag")
+                    new_last_modified = response.headers.get("last-modified")
+        except httpx.HTTPError as e:
+            return self._retry(url, run_id, attempts, f"{type(e).__name__}: {e}")
+
+        status = "saved" if found else "no_script"
+        self.manifest.record(url, run_id, status, new_etag, new_last_modified, attempts=0)
+        return status
+
+    async def _save_pre(self, response, path):
+        """Streams the body, writing only the <pre> block to path. Returns False if there was none."""
+        extractor = PreExtractor()
+        part_path = path + ".part"
+        with open(part_path, "w", encoding="utf-8") as file:
+            # Read to the end even after </pre> so the connection goes back to the pool
+            async for chunk in response.aiter_text():
+                piece = extractor.feed(chunk)
+                if piece:
+                    file.write(piece)
+
+        if not extractor.started:
+            os.remove(part_path)
+            return False
+        os.replace(part_path, path)
+        return True
+
+    def _retry(self, url, run_id, attempts, error, response=None):
+        if attempts >= self.max_attempts:
+            self.manifest.record(url, run_id, "failed", error=error, attempts=attempts)
+            return "failed"
+        next_attempt_at = time.time() + retry_delay(attempts, response)
+        self.manifest.record(url, run_id, "retry", error=error, next_attempt_at=next_attempt_at, attempts=attempts)
+        return "retry"
+
+    async def run(self, movies, progress=True):
+        """Scrapes every (title, url) pair. Returns a Counter of outcomes for this run."""
+        self.manifest.add_targets(movies)
+        run_id, resumed = self.manifest.begin_run()
+        urls = [url for _, url in movies]
+        if resumed:
+            print(f"⚠️ Resuming unfinished scrape run {run_id}")
+
+        outcomes = Counter()
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        # No pool timeout: the per-host slots already bound how many requests wait for a connection
+        timeout = httpx.Timeout(self.timeout, pool=None)
+        async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True,
+                                     headers={"User-Agent": USER_AGENT}) as client:
+            rows = self.manifest.pending(run_id, urls)
+            bar = tqdm(desc="Scraping Scripts", total=len(rows), ncols=100, disable=not progress)
+
+            # Each round fetches everything due; retries are picked up again from the manifest
+            while rows:
+                wait = max(0.0, min(row[6] for row in rows) - time.time())
+                if wait:
+                    await asyncio.sleep(wait)
+                due = [row for row in rows if row[6] <= time.time()]
+
+                for fetched in asyncio.as_completed([self.fetch(client, run_id, row) for row in due]):
+                    result = await fetched
+                    if result == "retry":
+                        outcomes["retries"] += 1
+                    else:
+                        outcomes[result] += 1
+                        bar.update()
+
+                rows = self.manifest.pending(run_id, urls)
+            bar.close()
+
+        self.manifest.finish_run(run_id)
+        return outcomes
+
+    def close(self):
+        self.manifest.close()
+        if self.store is not None:
+            self.store.close()
+
+
+def scrape(movies, script_folder=SCRIPT_FOLDER, manifest_db=MANIFEST_DB, **options):
+    """Blocking entry point: scrapes (title, url) pairs and returns a Counter of outcomes."""
+    scraper = ScriptScraper(script_folder, manifest_db, **options)
+    try:
+        return asyncio.run(scraper.run(movies))
+    finally:
+        scraper.close()
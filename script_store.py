@@ -0,0 +1,284 @@
+"""
+Packed, content-addressed store for the downloaded scripts.
+
+    script_store/
+        pack.bin     append-only compressed documents, each stored once per content hash
+        index.npy    fixed-width entries sorted by name hash: offset, length, size, codec, digest
+        names.json   script names, aligned with index.npy rows
+
+The index is memory-mapped and binary-searched, so a lookup touches a few
+pages instead of scanning a directory. Documents are zstd-compressed when
+the zstandard package is installed and zlib-compressed otherwise; the codec
+is recorded per document, so stores written either way stay readable.
+
+    python script_store.py import              (pack movie_scripts/, incremental)
+    python script_store.py import --remove     (and delete the packed originals)
+    python script_store.py stats
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SCRIPT_FOLDER = "movie_scripts"
+SCRIPT_STORE_DIR = "script_store"
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 12
+
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+ENTRY_DTYPE = np.dtype([
+    ("key", "<u8"),  # First 8 bytes of blake2b(name)
+    ("offset", "<u8"),  # Start of the compressed document in pack.bin
+    ("length", "<u4"),  # Compressed length
+    ("size", "<u4"),  # Decompressed length
+    ("codec", "u1"),
+    ("digest", "S32"),  # sha256 of the decompressed document
+])
+
+
+def name_key(name):
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def compress(raw):
+    """(codec, compressed bytes), preferring zstd when available."""
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return CODEC_ZLIB, zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress(codec, data, size):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("This script store was written with zstd; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    return zlib.decompress(data)
+
+
+def load_index(store_dir):
+    """(entries, names) as stored; empty for a new store."""
+    index_file = os.path.join(store_dir, "index.npy")
+    if not os.path.exists(index_file):
+        return np.zeros(0, dtype=ENTRY_DTYPE), []
+    with open(os.path.join(store_dir, "names.json"), encoding="utf-8") as file:
+        names = json.load(file)
+    return np.load(index_file, mmap_mode="r"), names
+
+
+class ScriptStore:
+    """Read-only view of a packed store. Pickles by path, so it can be handed to worker processes."""
+
+    def __init__(self, store_dir=SCRIPT_STORE_DIR):
+        self.store_dir = store_dir
+        self.entries, self._names = load_index(store_dir)
+        self.keys = self.entries["key"]
+
+        self._pack = None
+        pack_file = os.path.join(store_dir, "pack.bin")
+        if os.path.getsize(pack_file):
+            with open(pack_file, "rb") as file:
+                self._pack = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def load_if_exists(cls, store_dir=SCRIPT_STORE_DIR):
+        """The store at store_dir, or None if it was never built."""
+        if not os.path.exists(os.path.join(store_dir, "index.npy")):
+            return None
+        return cls(store_dir)
+
+    def __reduce__(self):
+        return self.__class__, (self.store_dir,)
+
+    def _position(self, name):
+        key = np.uint64(name_key(name))
+        position = int(np.searchsorted(self.keys, key))
+        # Same 64-bit key for two names is unlikely but possible, so confirm the name
+        while position < len(self.keys) and self.keys[position] == key:
+            if self._names[position] == name:
+                return position
+            position += 1
+        return None
+
+    def __contains__(self, name):
+        return self._position(name) is not None
+
+    def __len__(self):
+        return len(self._names)
+
+    def names(self):
+        return sorted(self._names)
+
+    def read_bytes(self, name):
+        """The stored document as bytes, or None if the name is unknown."""
+        position = self._position(name)
+        if position is None:
+            return None
+        entry = self.entries[position]
+        offset, length = int(entry["offset"]), int(entry["length"])
+        return decompress(int(entry["codec"]), self._pack[offset:offset + length], int(entry["size"]))
+
+    def read(self, name):
+        """The stored script text, or None if the name is unknown."""
+        raw = self.read_bytes(name)
+        return raw.decode("utf-8") if raw is not None else None
+
+    def stats(self):
+        """Document counts and on-disk size against the original size."""
+        unique = np.unique(self.entries["digest"], return_index=True)[1] if len(self.entries) else []
+        return {
+            "scripts": len(self._names),
+            "unique_documents": len(unique),
+            "raw_bytes": int(self.entries["size"].sum()),
+            "pack_bytes": os.path.getsize(os.path.join(self.store_dir, "pack.bin")),
+        }
+
+    def close(self):
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+
+class ScriptStoreWriter:
+    """
+    Adds scripts to a store. Identical documents are stored once; a name whose
+    content changed is pointed at the new document. Nothing becomes visible to
+    readers until commit(), which swaps the index files atomically.
+    """
+
+    def __init__(self, store_dir=SCRIPT_STORE_DIR):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        entries, names = load_index(store_dir)
+        self.by_name = {name: entry.copy() for name, entry in zip(names, entries)}
+        self.by_digest = {bytes(entry["digest"]): entry.copy() for entry in self.by_name.values()}
+        self._pack = open(os.path.join(store_dir, "pack.bin"), "ab")
+
+    def add(self, name, text):
+        """Stores one script. Returns 'added', 'updated', 'deduplicated' or 'unchanged'."""
+        raw = text.encode("utf-8")
+        digest = hashlib.sha256(raw).digest()
+        digest_key = digest.rstrip(b"\0")  # numpy drops trailing NULs when reading "S32" fields back
+
+        previous = self.by_name.get(name)
+        if previous is not None and bytes(previous["digest"]) == digest_key:
+            return "unchanged"
+
+        entry = self.by_digest.get(digest_key)
+        outcome = "deduplicated"
+        if entry is None:
+            codec, data = compress(raw)
+            entry = np.zeros((), dtype=ENTRY_DTYPE)
+            entry["offset"] = self._pack.tell()
+            entry["length"], entry["size"], entry["codec"], entry["digest"] = len(data), len(raw), codec, digest
+            self._pack.write(data)
+            self.by_digest[digest_key] = entry
+            outcome = "updated" if previous is not None else "added"
+
+        entry = entry.copy()
+        entry["key"] = name_key(name)
+        self.by_name[name] = entry
+        return outcome
+
+    def commit(self):
+        """Flushes the pack and publishes the new index."""
+        self._pack.flush()
+        os.fsync(self._pack.fileno())
+
+        names = sorted(self.by_name, key=lambda name: (name_key(name), name))
+        entries = np.array([self.by_name[name] for name in names], dtype=ENTRY_DTYPE)
+
+        index_tmp = os.path.join(self.store_dir, "index.tmp.npy")
+        names_tmp = os.path.join(self.store_dir, "names.tmp.json")
+        np.save(index_tmp, entries)
+        with open(names_tmp, "w", encoding="utf-8") as file:
+            json.dump(names, file, ensure_ascii=False)
+        # Names first: a reader pairing new names with the old index would only miss new scripts
+        os.replace(names_tmp, os.path.join(self.store_dir, "names.json"))
+        os.replace(index_tmp, os.path.join(self.store_dir, "index.npy"))
+
+    def close(self):
+        self._pack.close()
+
+
+class ScriptSource:
+    """
+    Where stages 3 and 4 read scripts from: movie_scripts/ for anything
+    downloaded since the last import, the packed store for the rest.
+    """
+
+    def __init__(self, script_folder=SCRIPT_FOLDER, store_dir=SCRIPT_STORE_DIR):
+        self.script_folder = script_folder
+        self.store = ScriptStore.load_if_exists(store_dir)
+
+    def names(self):
+        """Every script name, sorted."""
+        names = set(self.store.names()) if self.store is not None else set()
+        if os.path.isdir(self.script_folder):
+            names.update(name for name in os.listdir(self.script_folder) if name.endswith(".txt"))
+        return sorted(names)
+
+    def read(self, name):
+        """The script text, or None if neither the folder nor the store has it."""
+        path = os.path.join(self.script_folder, name)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                return file.read()
+        return self.store.read(name) if self.store is not None else None
+
+    def __contains__(self, name):
+        return os.path.exists(os.path.join(self.script_folder, name)) or (self.store is not None and name in self.store)
+
+
+def import_folder(script_folder=SCRIPT_FOLDER, store_dir=SCRIPT_STORE_DIR, remove=False):
+    """Packs every .txt script in script_folder into the store. Returns a count per outcome."""
+    outcomes = {"added": 0, "updated": 0, "deduplicated": 0, "unchanged": 0}
+    writer = ScriptStoreWriter(store_dir)
+    packed = []
+    try:
+        for name in sorted(os.listdir(script_folder)):
+            if not name.endswith(".txt"):
+                continue
+            with open(os.path.join(script_folder, name), "r", encoding="utf-8") as file:
+                outcomes[writer.add(name, file.read())] += 1
+            packed.append(name)
+        writer.commit()
+    finally:
+        writer.close()
+
+    # Only after the index that covers them is on disk
+    if remove:
+        for name in packed:
+            os.remove(os.path.join(script_folder, name))
+    return outcomes
+
+
+def print_stats(store_dir):
+    stats = ScriptStore(store_dir).stats()
+    ratio = stats["raw_bytes"] / stats["pack_bytes"] if stats["pack_bytes"] else 0
+    print(f"📦 {stats['scripts']} scripts ({stats['unique_documents']} unique), "
+          f"{stats['raw_bytes'] / 1e6:.1f} MB raw -> {stats['pack_bytes'] / 1e6:.1f} MB packed ({ratio:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack downloaded scripts into a compressed, indexed store.")
+    parser.add_argument("command", choices=["import", "stats"])
+    parser.add_argument("--folder", default=SCRIPT_FOLDER)
+    parser.add_argument("--store", default=SCRIPT_STORE_DIR)
+    parser.add_argument("--remove", action="store_true", help="delete the originals once they are packed")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        outcomes = import_folder(args.folder, args.store, args.remove)
+        print("✅ " + ", ".join(f"{count} {outcome}" for outcome, count in outcomes.items()))
+    print_stats(args.store)
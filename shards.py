@@ -0,0 +1,428 @@
+"""
+Sharded dialogue storage: the corpus split across N SQLite files by a hash
+of the character or the script name, described by a JSON manifest.
+
+Anywhere a dialogue DB path is accepted (DIALOGUE_DB, --db, prefork), a
+manifest path works too. Reads go through ShardRouter: a lookup for one
+character goes to the shard that holds it when the store is keyed by
+character, and fans out to every shard (in parallel) otherwise, with the
+results merged. Writes go through ShardWriter, one writer thread and
+connection per shard, so ingest is not limited to one SQLite writer. A plain
+DB file is a store with a single shard, so the same code serves both.
+
+Line ids are global: the shard number sits above the low LINE_ID_BITS bits,
+which hold the shard's own dialogue_lines.id. Writing a script renumbers
+its lines, and reshard() writes every script again, so the offline vector
+and reply indexes must be rebuilt after it. They record the signature of
+the DB they were built from, and the servers ignore them when it differs.
+
+    python shards.py create movie_dialogues.shards.json --shards 4 --key character
+    python shards.py reshard movie_dialogues.db movie_dialogues.shards.json --shards 4
+    python shards.py info movie_dialogues.shards.json
+"""
+import argparse
+import heapq
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+
+from db_pool import ReadOnlyConnectionPool, connect_readonly
+from dialogue_schema import (
+    create_dialogue_tables, drop_fts_triggers, fetch_line_texts_by_id, fetch_script_lines, find_cues, find_ranked_line,
+    find_ranked_lines, has_line_index, rebuild_fts_index, store_script,
+)
+
+DB_FILE = "movie_dialogues.db"
+MANIFEST_VERSION = 1
+SHARD_KEYS = ("character", "script")
+DEFAULT_SHARDS = 4
+LINE_ID_BITS = 40  # Room for 10^12 lines per shard
+WRITER_QUEUE_SIZE = 64  # Scripts buffered per shard before the producer waits
+BULK_COMMIT_SCRIPTS = 200  # Scripts written per transaction in bulk mode
+
+
+def is_manifest(db_file):
+    return db_file.endswith(".json")
+
+
+def load_manifest(path):
+    """The manifest with its shard paths made absolute (they are stored relative to the manifest)."""
+    with open(path, encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("key") not in SHARD_KEYS:
+        raise ValueError(f"{path} is not a version {MANIFEST_VERSION} shard manifest")
+    base = os.path.dirname(os.path.abspath(path))
+    manifest["shards"] = [os.path.join(base, shard) for shard in manifest["shards"]]
+    return manifest
+
+
+def write_manifest(path, key, shard_files):
+    """Writes the manifest atomically, so a reader sees the old shard set or the new one."""
+    base = os.path.dirname(os.path.abspath(path))
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "key": key,
+        "shards": [os.path.relpath(os.path.abspath(shard), base) for shard in shard_files],
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def storage_files(db_file=DB_FILE):
+    """Every SQLite file of a store: the shards of a manifest, or just the DB file."""
+    return load_manifest(db_file)["shards"] if is_manifest(db_file) else [db_file]
+
+
+def shard_for(value, num_shards):
+    """Stable across processes and Python versions, unlike hash()."""
+    return zlib.crc32(value.encode("utf-8")) % num_shards
+
+
+def global_line_id(shard, line_id):
+    return (shard << LINE_ID_BITS) | line_id
+
+
+def split_line_id(line_id):
+    """(shard, the shard's dialogue_lines.id) for a global line id."""
+    return line_id >> LINE_ID_BITS, line_id & ((1 << LINE_ID_BITS) - 1)
+
+
+def partition_lines(key, num_shards, script_name, lines):
+    """
+    {shard: lines} for one script. Keyed by character, every shard gets an
+    entry (maybe empty), so a re-ingested script also loses the lines of
+    characters it no longer has on the other shards.
+    """
+    if num_shards == 1:
+        return {0: lines}
+    if key == "script":
+        return {shard_for(script_name, num_shards): lines}
+    parts = {shard: [] for shard in range(num_shards)}
+    for line in lines:
+        parts[shard_for(line[0], num_shards)].append(line)
+    return parts
+
+
+class ShardRouter:
+    """
+    Read side of a (possibly) sharded store: one ReadOnlyConnectionPool per
+    shard, lookups sent to the shard that can answer them, the rest fanned
+    out on a small thread pool and merged.
+
+    bm25 ranks are computed per shard, so when a lookup fans out the merged
+    order is close to, but not exactly, the one a single file would give.
+    """
+
+    def __init__(self, db_file=DB_FILE, persistent=True):
+        self.db_file = db_file
+        self.key = load_manifest(db_file)["key"] if is_manifest(db_file) else None
+        self.pools = [ReadOnlyConnectionPool(path, persistent) for path in storage_files(db_file)]
+        self._executor = ThreadPoolExecutor(len(self.pools), thread_name_prefix="shard") if self.sharded else None
+
+    @property
+    def sharded(self):
+        return len(self.pools) > 1
+
+    def shards_for(self, character=None, script=None):
+        """The shards that can hold rows for the character (or script); every shard if the key doesn't say."""
+        if not self.sharded:
+            return [0]
+        value = {"character": character, "script": script}[self.key]
+        return [shard_for(value, len(self.pools))] if value is not None else list(range(len(self.pools)))
+
+    def connection(self, shard=0):
+        return self.pools[shard].connection()
+
+    def map(self, fn, shards=None):
+        """[(shard, fn(shard, conn))] for each shard, run in parallel when there are several."""
+        shards = list(range(len(self.pools))) if shards is None else shards
+
+        def run(shard):
+            with self.pools[shard].connection() as conn:
+                return shard, fn(shard, conn)
+
+        if len(shards) <= 1:
+            return [run(shard) for shard in shards]
+        return list(self._executor.map(run, shards))
+
+    def find_best_line(self, character, user_message, script=None):
+        """dialogue_schema.find_best_line over the shards that can hold the character (in script, if given)."""
+        results = self.map(lambda shard, conn: find_ranked_line(conn, character, user_message, script),
+                           self.shards_for(character, script))
+        ranked = [result for _, result in results if result is not None]
+        return min(ranked)[2] if ranked else None
+
+    def find_best_lines(self, pairs):
+        """dialogue_schema.find_best_lines, each pair sent only to the shards that can hold its character."""
+        by_shard = defaultdict(list)  # shard -> indexes into pairs
+        for index, (character, _, *script) in enumerate(pairs):
+            for shard in self.shards_for(character, *script):
+                by_shard[shard].append(index)
+
+        def lookup(shard, conn):
+            return find_ranked_lines(conn, [pairs[index] for index in by_shard[shard]])
+
+        best = {}
+        for shard, ranked in self.map(lookup, list(by_shard)):
+            for position, entry in ranked.items():
+                index = by_shard[shard][position]
+                if index not in best or entry < best[index]:
+                    best[index] = entry
+        return {index: entry[2] for index, entry in best.items()}
+
+    def fetch_script_lines(self, character, script):
+        """dialogue_schema.fetch_script_lines with global line ids."""
+        lines = {}
+        for shard, rows in self.map(lambda shard, conn: fetch_script_lines(conn, character, script),
+                                    self.shards_for(character, script)):
+            lines.update((global_line_id(shard, local_id), text) for local_id, text in rows.items())
+        return lines
+
+    def fetch_line_texts(self, line_ids):
+        """dialogue_schema.fetch_line_texts for global line ids, keeping the given order."""
+        texts = self.fetch_line_texts_by_id(line_ids)
+        return [texts[line_id] for line_id in line_ids if line_id in texts]
+
+    def fetch_line_texts_by_id(self, line_ids):
+        """{global line id: text} for the ids that exist."""
+        by_shard = defaultdict(list)  # shard -> its own ids
+        for line_id in line_ids:
+            shard, local_id = split_line_id(line_id)
+            if shard < len(self.pools):
+                by_shard[shard].append(local_id)
+
+        texts = {}
+        for shard, rows in self.map(lambda shard, conn: fetch_line_texts_by_id(conn, by_shard[shard]), list(by_shard)):
+            texts.update((global_line_id(shard, local_id), text) for local_id, text in rows.items())
+        return texts
+
+    def search_dialogue(self, keyword):
+        """(script, character, dialogues) rows whose dialogues contain the keyword, from every shard."""
+        def search(shard, conn):
+            return conn.execute(
+                "SELECT script_name, character_name, dialogues FROM movie_dialogues WHERE dialogues LIKE ?",
+                (f"%{keyword}%",),
+            ).fetchall()
+
+        return [row for _, rows in self.map(search) for row in rows]
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class ShardWriter:
+    """
+    Write side: one thread and connection per shard, each fed whole scripts
+    through a bounded queue, so the shards are written (and re-indexed) in
+    parallel; sqlite3 releases the GIL while SQLite works.
+
+    bulk=True applies bulk_ingest's setup to every shard (WAL,
+    synchronous=OFF, FTS triggers dropped while loading) and rebuilds each
+    shard's FTS index at close(), again in parallel, also after a failure.
+    """
+
+    def __init__(self, db_file=DB_FILE, bulk=False, commit_every=1):
+        files = storage_files(db_file)
+        self.key = load_manifest(db_file)["key"] if is_manifest(db_file) else None
+        self.bulk = bulk
+        self.commit_every = commit_every
+        self.errors = []
+        self.queues = [queue.Queue(WRITER_QUEUE_SIZE) for _ in files]
+        self.threads = [
+            threading.Thread(target=self._run, args=(path, jobs), name=f"shard-writer-{shard}", daemon=True)
+            for shard, (path, jobs) in enumerate(zip(files, self.queues))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write_script(self, script_name, lines):
+        """Queues a parsed script's (character, line_no, text) lines for the shards that hold them."""
+        self._raise_errors()
+        cues = find_cues(lines)  # A reply's cue may sit on another shard, so they come from the whole script
+        for shard, shard_lines in partition_lines(self.key, len(self.queues), script_name, lines).items():
+            self.queues[shard].put((script_name, shard_lines, cues))
+
+    def close(self):
+        """Waits for every shard to commit (and re-index, in bulk mode)."""
+        for jobs in self.queues:
+            jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self._raise_errors()
+
+    def _raise_errors(self):
+        if self.errors:
+            raise RuntimeError(f"Shard writer failed: {self.errors[0]}") from self.errors[0]
+
+    def _run(self, path, jobs):
+        conn = None
+        try:
+            conn = sqlite3.connect(path)
+            conn.execute("PRAGMA journal_mode = WAL")
+            create_dialogue_tables(conn)
+            if self.bulk:
+                conn.execute("PRAGMA synchronous = OFF")
+                conn.execute("PRAGMA cache_size = -262144")  # 256 MiB page cache for the load
+                conn.execute("PRAGMA temp_store = MEMORY")
+                drop_fts_triggers(conn)
+
+            written = 0
+            while (job := jobs.get()) is not None:
+                store_script(conn, *job)
+                written += 1
+                if written % self.commit_every == 0:
+                    conn.commit()
+            conn.commit()
+        except Exception as e:
+            self.errors.append(e)
+            while jobs.get() is not None:  # Keep the producer from blocking on a full queue
+                pass
+        finally:
+            if conn is not None:
+                self._finish(conn)
+
+    def _finish(self, conn):
+        """
+        Rolls back a failed load's open transaction, then (in bulk mode) restores
+        the FTS triggers and index over what was committed, so the shard stays
+        searchable whether or not the load finished.
+        """
+        try:
+            conn.rollback()
+            if self.bulk:
+                rebuild_fts_index(conn)
+                conn.commit()
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            conn.close()
+
+
+def read_scripts(db_file=DB_FILE):
+    """(script_name, lines) for every script of a store, in script_name order, its lines gathered from every shard."""
+    conns = [connect_readonly(path) for path in storage_files(db_file)]
+    for path, conn in zip(storage_files(db_file), conns):
+        if not has_line_index(conn):
+            for conn in conns:
+                conn.close()
+            raise RuntimeError(f"{path} has no dialogue_lines table; run `python dialogue_schema.py {path}` first")
+    return _merge_scripts(conns)
+
+
+def _merge_scripts(conns):
+    try:
+        streams = [
+            conn.execute("SELECT script_name, line_no, character_name, text FROM dialogue_lines "
+                         "ORDER BY script_name, line_no, character_name")
+            for conn in conns
+        ]
+        # SQLite's BINARY collation and Python's str order agree, so the sorted streams merge directly
+        for script_name, rows in groupby(heapq.merge(*streams), key=itemgetter(0)):
+            yield script_name, [(character, line_no, text) for _, line_no, character, text in rows]
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def create_store(manifest_path, num_shards=DEFAULT_SHARDS, key="character", stem=None):
+    """Creates empty shard files next to manifest_path and writes the manifest. Returns the shard files."""
+    stem = stem or os.path.splitext(manifest_path)[0]
+    generation = time.strftime("%Y%m%d%H%M%S")
+    shard_files = [f"{stem}.{generation}.{shard:02d}.db" for shard in range(num_shards)]
+    for path in shard_files:
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        create_dialogue_tables(conn)
+        conn.commit()
+        conn.close()
+    write_manifest(manifest_path, key, shard_files)
+    return shard_files
+
+
+def reshard(source, manifest_path, num_shards=DEFAULT_SHARDS, key="character", commit_every=BULK_COMMIT_SCRIPTS):
+    """
+    Copies every script of source (a DB file or a manifest, which may be
+    manifest_path itself) into a fresh set of shards, then points
+    manifest_path at them. Servers keep reading the old files until they
+    reload; those are left for the caller to delete. Line ids are not kept,
+    so the vector and reply indexes need a rebuild. Returns (scripts, lines).
+    """
+    source_scripts = read_scripts(source)  # Fails before any shard is created if the source can't be copied
+    stem = os.path.splitext(manifest_path)[0]
+    staging = f"{stem}.staging.json"
+    create_store(staging, num_shards, key, stem)
+    scripts = lines = 0
+    with ShardWriter(staging, bulk=True, commit_every=commit_every) as writer:
+        for script_name, script_lines in source_scripts:
+            writer.write_script(script_name, script_lines)
+            scripts += 1
+            lines += len(script_lines)
+            if scripts % commit_every == 0:
+                print(f"Copied {scripts} scripts...")
+    os.replace(staging, manifest_path)  # Shard paths are relative to the same directory, so they stay valid
+    return scripts, lines
+
+
+def describe(db_file):
+    """(path, lines, MiB) per shard."""
+    rows = []
+    for path in storage_files(db_file):
+        conn = connect_readonly(path)
+        try:
+            count = conn.execute("SELECT COUNT(*) FROM dialogue_lines").fetchone()[0] if has_line_index(conn) else None
+        finally:
+            conn.close()
+        rows.append((path, count, os.path.getsize(path) / (1024 * 1024)))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="create an empty sharded store to ingest into")
+    create.add_argument("manifest")
+    rebuild = commands.add_parser("reshard", help="copy a DB or sharded store into a new set of shards")
+    rebuild.add_argument("source", help="DB file or shard manifest")
+    rebuild.add_argument("manifest", help="manifest to write (may be the source)")
+    for command in (create, rebuild):
+        command.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+        command.add_argument("--key", choices=SHARD_KEYS, default="character",
+                             help="character: one shard per character lookup; script: re-ingesting a script touches one shard")
+    info = commands.add_parser("info", help="lines and size per shard")
+    info.add_argument("manifest")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        shard_files = create_store(args.manifest, args.shards, args.key)
+        print(f"✅ Created {len(shard_files)} shards keyed by {args.key}, listed in {args.manifest}")
+    elif args.command == "reshard":
+        old_files = storage_files(args.source)
+        start = time.perf_counter()
+        scripts, lines = reshard(args.source, args.manifest, args.shards, args.key)
+        print(f"✅ Copied {scripts} scripts, {lines} lines into {args.shards} shards keyed by {args.key} "
+              f"in {time.perf_counter() - start:.1f}s ({args.manifest})")
+        print(f"⚠️ The old copy in {', '.join(old_files)} is left in place; delete it once no server reads it")
+        print(f"🔄 Line ids changed: rebuild the vector and reply indexes with --db {args.manifest}")
+    else:
+        manifest = load_manifest(args.manifest) if is_manifest(args.manifest) else {"key": None}
+        print(f"📦 {args.manifest}: keyed by {manifest['key']}")
+        for path, count, size in describe(args.manifest):
+            print(f"   {path}: {count} lines, {size:.1f} MiB")
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import os
+import threading
+
+try:
+    import fcntl  # POSIX only; cross-process coalescing is skipped elsewhere
+except ImportError:
+    fcntl = None
+
+
+class _Call:
+    """One in-flight upstream call and everyone waiting on it."""
+
+    __slots__ = ("event", "result", "error", "async_waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.async_waiters = []  # (loop, future) pairs for asyncio followers
+
+
+def _resolve(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key (the
+    leader) runs the function, every caller that arrives while it is running
+    gets the leader's result. Threads use do(), asyncio tasks use ado(), and
+    both can follow a leader of either kind.
+
+    With lock_dir set, leaders in different processes also serialise on a
+    per-key lock file. A leader that had to wait for another process calls
+    recheck() first (typically a shared-cache lookup) before doing the work
+    itself, so only one process pays for the upstream call.
+    """
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0, "process_waits": 0, "process_hits": 0}
+
+    def _join(self, key):
+        """Returns (call, is_leader)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats["coalesced"] += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.stats["leaders"] += 1
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+            call.result, call.error = result, error
+            call.event.set()
+            waiters, call.async_waiters = call.async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def _lock_path(self, key):
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.lock_dir, f"{digest}.lock")
+
+    def _run_with_process_lock(self, key, fn, recheck):
+        """Runs fn while holding the key's lock file; reuses another process's result via recheck()."""
+        with open(self._lock_path(key), "a+") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                with self._lock:
+                    self.stats["process_waits"] += 1
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                result = recheck() if recheck is not None else None
+                if result is not None:
+                    with self._lock:
+                        self.stats["process_hits"] += 1
+                    return result
+            try:
+                return fn()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def do(self, key, fn, recheck=None):
+        """Runs fn() once per key across concurrent callers and returns its result to all of them."""
+        call, leader = self._join(key)
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if self.lock_dir:
+                result = self._run_with_process_lock(key, fn, recheck)
+            else:
+                result = fn()
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result=result)
+        return result
+
+    async def ado(self, key, coro_fn, recheck=None):
+        """
+        Async do(): awaits coro_fn() once per key. The shared work runs as its own
+        task, so cancelling the leader's request does not cancel it for the followers.
+        """
+        loop = asyncio.get_running_loop()
+        call, leader = self._join(key)
+        if not leader:
+            future = loop.create_future()
+            with self._lock:
+                if call.event.is_set():
+                    _resolve(future, call.result, call.error)
+                else:
+                    call.async_waiters.append((loop, future))
+            return await future
+
+        async def lead():
+            try:
+                if self.lock_dir:
+                    # The lock file wait blocks, so it runs off the event loop
+                    result = await asyncio.to_thread(
+                        self._run_with_process_lock, key,
+                        lambda: asyncio.run_coroutine_threadsafe(coro_fn(), loop).result(), recheck,
+                    )
+                else:
+                    result = await coro_fn()
+            except BaseException as e:
+                self._finish(key, call, error=e)
+                raise
+            self._finish(key, call, result=result)
+            return result
+
+        return await asyncio.shield(asyncio.ensure_future(lead()))
+
+    def snapshot(self):
+        """Counters for the stats endpoint."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = len(self._calls)
+        calls = stats["leaders"] + stats["coalesced"]
+        stats["coalesced_rate"] = round(stats["coalesced"] / calls, 4) if calls else 0.0
+        return stats
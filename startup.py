@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class Warmup:
+    """
+    Runs the slow part of starting a server on a background thread: loading
+    the lookup indexes, importing google.genai and creating the Gemini
+    clients. The server can listen while this runs; requests that need an index
+    wait for it, and /ready answers 503 until every step is done.
+
+    Steps are (name, callable) pairs run in order. If one raises, the process
+    never becomes ready and the error is reported by snapshot().
+    """
+
+    def __init__(self, *steps):
+        self.steps = steps
+        self.timings_ms = {}
+        self.error = None
+        self.ready = threading.Event()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for name, step in self.steps:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                self.error = f"{name}: {e}"
+                print(f"❌ Warm-up failed at {name}: {e}")
+                return
+            self.timings_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+        self.timings_ms["total"] = round((time.perf_counter() - self._started) * 1000, 1)
+        self.ready.set()
+        print(f"✅ Warm in {self.timings_ms['total']:.0f}ms ({self.timings_ms})")
+
+    def wait(self, timeout=None):
+        """Blocks until warm; False if it timed out or a step failed."""
+        self._thread.join(timeout)
+        return self.ready.is_set()
+
+    def snapshot(self):
+        return {"ready": self.ready.is_set(), "error": self.error, "steps_ms": dict(self.timings_ms)}
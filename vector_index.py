@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+
+from dialogue_schema import has_line_index
+from fuzzy_index import db_signature
+from shards import global_line_id, storage_files
+
+DB_FILE = "movie_dialogues.db"
+VECTOR_INDEX_DIR = "vector_index"
+
+INDEX_VERSION = 1
+EMBEDDING_DIM = 1024  # Hash buckets; collisions stay rare for the few thousand distinct words in a script corpus
+DEFAULT_NLIST = 0  # IVF partitions; 0 means brute force only
+DEFAULT_NPROBE = 8  # IVF partitions scanned per query
+KMEANS_ITERATIONS = 12
+KMEANS_SAMPLE = 50000  # Rows used to train the coarse quantizer
+SEARCH_CHUNK_ROWS = 65536  # Rows scored per matmul, bounds peak memory on large indexes
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercase word unigrams plus adjacent-word bigrams."""
+    words = TOKEN_PATTERN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def hash_token(token, dim=EMBEDDING_DIM):
+    """Stable (bucket, sign) for a token; crc32 does not change between processes like hash() does."""
+    h = zlib.crc32(token.encode("utf-8"))
+    return h % dim, 1.0 if (h >> 31) & 1 else -1.0
+
+
+class HashingEmbedder:
+    """
+    Local TF-IDF embedder: hashed unigram/bigram counts, sublinear tf, IDF
+    weights learned from the corpus, L2-normalised. Needs no network or model files.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, idf=None):
+        self.dim = dim
+        self.idf = idf if idf is not None else np.ones(dim, dtype=np.float32)
+
+    def _counts(self, text):
+        counts = {}
+        for token in tokenize(text):
+            bucket, sign = hash_token(token, self.dim)
+            counts[bucket] = counts.get(bucket, 0.0) + sign
+        return counts
+
+    def fit_idf(self, texts):
+        """Learns smoothed IDF weights per hash bucket."""
+        document_frequency = np.zeros(self.dim, dtype=np.float64)
+        num_docs = 0
+        for text in texts:
+            document_frequency[list(self._counts(text))] += 1
+            num_docs += 1
+        self.idf = (np.log((1 + num_docs) / (1 + document_frequency)) + 1).astype(np.float32)
+        return self
+
+    def embed(self, texts):
+        """Returns an (n, dim) float32 matrix of unit vectors (zero rows for empty texts)."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, count in self._counts(text).items():
+                matrix[row, bucket] = np.sign(count) * (1 + np.log(abs(count))) if count else 0.0
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def train_coarse_quantizer(vectors, nlist, seed=0):
+    """Spherical k-means on a sample of rows; returns (nlist, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                centroids[c] = sample[rng.integers(len(sample))]  # Re-seed empty clusters
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    return centroids.astype(np.float32)
+
+
+def load_lines(db_file=DB_FILE):
+    """Reads (id, character_name, text) for every dialogue line; ids of a sharded store are global (see shards.py)."""
+    rows = []
+    for shard, path in enumerate(storage_files(db_file)):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            if not has_line_index(conn):
+                raise RuntimeError(f"{path} has no dialogue_lines table; run `python dialogue_schema.py {path}` first")
+            rows.extend(
+                (global_line_id(shard, line_id), character, text)
+                for line_id, character, text in conn.execute(
+                    "SELECT id, character_name, text FROM dialogue_lines ORDER BY id"
+                )
+            )
+        finally:
+            conn.close()
+    return rows
+
+
+def build_index(db_file=DB_FILE, out_dir=VECTOR_INDEX_DIR, nlist=DEFAULT_NLIST, dim=EMBEDDING_DIM):
+    """
+    Embeds every dialogue line and writes the index files to out_dir:
+    vectors.npy (float32, rows grouped by IVF list), line_ids.npy and
+    character_codes.npy (row -> dialogue_lines.id / character), idf.npy,
+    centroids.npy + list_offsets.npy when nlist > 0, and meta.json, which
+    records the DB signature the line ids belong to (see is_current()).
+    """
+    start = time.time()
+    signature = db_signature(db_file)
+    rows = load_lines(db_file)
+    if not rows:
+        raise RuntimeError(f"No dialogue lines found in {db_file}")
+
+    line_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    characters = sorted({row[1] for row in rows})
+    character_code = {name: code for code, name in enumerate(characters)}
+    character_codes = np.array([character_code[row[1]] for row in rows], dtype=np.int32)
+    texts = [row[2] for row in rows]
+
+    embedder = HashingEmbedder(dim).fit_idf(texts)
+    vectors = embedder.embed(texts)
+
+    os.makedirs(out_dir, exist_ok=True)
+    meta = {"version": INDEX_VERSION, "dim": dim, "count": len(rows), "nlist": nlist, "characters": characters,
+            "db_signature": signature}
+
+    if nlist:
+        centroids = train_coarse_quantizer(vectors, nlist)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        # Store each list contiguously so a probe is one slice of the memory map
+        order = np.argsort(assignment, kind="stable")
+        vectors, line_ids, character_codes = vectors[order], line_ids[order], character_codes[order]
+        list_offsets = np.searchsorted(assignment[order], np.arange(nlist + 1)).astype(np.int64)
+        np.save(os.path.join(out_dir, "centroids.npy"), centroids)
+        np.save(os.path.join(out_dir, "list_offsets.npy"), list_offsets)
+
+    np.save(os.path.join(out_dir, "vectors.npy"), vectors)
+    np.save(os.path.join(out_dir, "line_ids.npy"), line_ids)
+    np.save(os.path.join(out_dir, "character_codes.npy"), character_codes)
+    np.save(os.path.join(out_dir, "idf.npy"), embedder.idf)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+
+    print(f"✅ Indexed {len(rows)} lines ({vectors.nbytes / 1e6:.1f} MB, nlist={nlist}) in {time.time() - start:.1f}s")
+    return meta
+
+
+def top_k(scores, k):
+    """Row-wise (indexes, scores) of the k largest entries, best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def top_k_merge(rows_a, scores_a, rows_b, scores_b, k):
+    """Merges two per-query top-k result sets into one."""
+    rows = np.concatenate([rows_a, rows_b], axis=1)
+    scores = np.concatenate([scores_a, scores_b], axis=1)
+    idx, merged_scores = top_k(scores, k)
+    return np.take_along_axis(rows, idx, axis=1), merged_scores
+
+
+class VectorIndex:
+    """Read-only view over an index built by build_index(); vectors stay memory-mapped."""
+
+    def __init__(self, index_dir=VECTOR_INDEX_DIR):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as file:
+            self.meta = json.load(file)
+        if self.meta["version"] != INDEX_VERSION:
+            raise RuntimeError(f"Vector index in {index_dir} is version {self.meta['version']}, expected {INDEX_VERSION}")
+
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        self.line_ids = np.load(os.path.join(index_dir, "line_ids.npy"), mmap_mode="r")
+        self.character_codes = np.load(os.path.join(index_dir, "character_codes.npy"), mmap_mode="r")
+        self.embedder = HashingEmbedder(self.meta["dim"], np.load(os.path.join(index_dir, "idf.npy")))
+        self.character_code = {name: code for code, name in enumerate(self.meta["characters"])}
+        self._character_rows = {}
+
+        self.centroids = None
+        if self.meta["nlist"]:
+            self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+            self.list_offsets = np.load(os.path.join(index_dir, "list_offsets.npy"))
+
+    @classmethod
+    def load_if_exists(cls, index_dir=VECTOR_INDEX_DIR):
+        """Returns the index, or None when it has not been built yet."""
+        if not os.path.exists(os.path.join(index_dir, "meta.json")):
+            return None
+        return cls(index_dir)
+
+    def is_current(self, db_file):
+        """
+        False once db_file was written after the build: re-ingesting a script
+        renumbers its dialogue_lines ids, so stored ids may name other lines.
+        """
+        return self.meta.get("db_signature") == json.loads(json.dumps(db_signature(db_file)))
+
+    def __len__(self):
+        return len(self.line_ids)
+
+    def _rows_for_character(self, character):
+        rows = self._character_rows.get(character)
+        if rows is None:
+            code = self.character_code.get(character)
+            rows = np.empty(0, dtype=np.int64) if code is None else np.flatnonzero(self.character_codes == code)
+            self._character_rows[character] = rows
+        return rows
+
+    def _brute_force(self, queries, k):
+        """Exact top-k over every row, scored a chunk of rows at a time."""
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), SEARCH_CHUNK_ROWS):
+            chunk_scores = queries @ self.vectors[start:start + SEARCH_CHUNK_ROWS].T
+            rows, scores = top_k(chunk_scores, k)
+            best_rows, best_scores = top_k_merge(best_rows, best_scores, rows + start, scores, k)
+        return best_rows, best_scores
+
+    def _ivf(self, queries, k, nprobe):
+        """Approximate top-k scanning only the nprobe closest partitions per query."""
+        probes, _ = top_k(queries @ self.centroids.T, nprobe)
+        results_rows, results_scores = [], []
+        for query, lists in zip(queries, probes):
+            # Each list is a contiguous slice, so scoring it reads the memory map sequentially
+            spans = [(self.list_offsets[c], self.list_offsets[c + 1]) for c in lists]
+            scores = np.concatenate([self.vectors[start:end] @ query for start, end in spans])
+            rows = np.concatenate([np.arange(start, end) for start, end in spans])
+            idx, top_scores = top_k(scores[None, :], k)
+            results_rows.append(rows[idx[0]])
+            results_scores.append(top_scores[0])
+        return results_rows, results_scores
+
+    def search_batch(self, texts, k=5, character=None, nprobe=DEFAULT_NPROBE, exact=False, line_ids=None):
+        """
+        Top-k (line_id, score) lists for each query text, best first.
+        With character set, only that character's lines are scored (always exact),
+        and only those in line_ids when that is given too (e.g. one script's lines).
+        """
+        queries = self.embedder.embed(texts)
+
+        if character is not None:
+            rows = self._rows_for_character(character)
+            if line_ids is not None:
+                rows = rows[np.isin(self.line_ids[rows], np.fromiter(line_ids, dtype=np.int64))]
+            if not len(rows):
+                return [[] for _ in texts]
+            idx, scores = top_k(queries @ self.vectors[rows].T, k)
+            row_lists, score_lists = [rows[i] for i in idx], list(scores)
+        elif self.centroids is not None and not exact:
+            row_lists, score_lists = self._ivf(queries, k, nprobe)
+        else:
+            row_lists, score_lists = self._brute_force(queries, k)
+
+        return [
+            [(int(self.line_ids[row]), float(score)) for row, score in zip(rows, scores) if score > 0]
+            for rows, scores in zip(row_lists, score_lists)
+        ]
+
+    def search(self, text, k=5, character=None, nprobe=DEFAULT_NPROBE, exact=False, line_ids=None):
+        """Top-k (line_id, score) for a single query."""
+        return self.search_batch([text], k, character, nprobe, exact, line_ids)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the offline vector index over dialogue_lines.")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--out", default=VECTOR_INDEX_DIR)
+    parser.add_argument("--nlist", type=int, default=DEFAULT_NLIST, help="IVF partitions (about sqrt(lines) works well); 0 = brute force")
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    args = parser.parse_args()
+
+    build_index(args.db, args.out, args.nlist, args.dim)
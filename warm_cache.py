@@ -0,0 +1,220 @@
+"""
+Precomputes replies for the hottest (character, message) pairs, so /chat
+answers them without calling the LLM.
+
+Pairs come from request logs (servers started with REQUEST_LOG=path log
+every request the DB could not answer) and/or a seed CSV with
+character,user_message[,requests] columns. The top --top pairs are resolved
+to stored character names, and pairs the DB already answers are skipped.
+Replies are generated through the same prompt, context retrieval and
+rate-limited backend as /chat (LLM_BACKEND=stub for the local fake), then
+bulk-loaded into the precomputed_responses table of response_cache.db,
+which every server checks before the LLM.
+
+Refresh is incremental: a pair with a reply for the current model and
+PROMPT_VERSION is skipped unless it is older than --max-age-days. Replies
+for another model or prompt version are never served (they are keyed like
+the response cache); --prune deletes them, along with pairs that dropped
+out of the top.
+
+    REQUEST_LOG=requests.jsonl python chat.py
+    python warm_cache.py --log requests.jsonl --top 500
+    python warm_cache.py --seed openers.csv --dry-run
+"""
+import argparse
+import csv
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import dialogue_lookup
+from llm_backend import create_backend
+from prompts import PROMPT_VERSION, build_prompt
+from request_log import read_requests
+from response_cache import CACHE_DB_FILE, cache_key, create_precomputed_table, normalize_message
+
+DEFAULT_TOP = 500
+MIN_REQUESTS = 2  # A pair seen once in the logs is not hot
+WRITE_BATCH = 50  # Replies per transaction, so an interrupted run keeps what it generated
+DEFAULT_CONCURRENCY = 4  # Gemini calls in flight; the per-key quota still applies on top
+
+
+def mine_pairs(log_paths=(), seed_path=None):
+    """
+    Counts requests per (character, message), case, spacing and punctuation folded
+    the way the response cache folds them. Returns (counts, {pair: first spelling seen}).
+    """
+    counts, spellings = Counter(), {}
+
+    def add(character, user_message, requests=1):
+        pair = (character.strip().casefold(), normalize_message(user_message))
+        if not pair[1]:
+            return
+        counts[pair] += requests
+        spellings.setdefault(pair, (character.strip(), user_message.strip()))
+
+    for path in log_paths:
+        for character, user_message in read_requests(path):
+            add(character, user_message)
+    if seed_path:
+        with open(seed_path, newline="", encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                if row.get("character") and row.get("user_message"):
+                    # Seeded pairs count as hot even without log traffic
+                    add(row["character"], row["user_message"], int(row.get("requests") or MIN_REQUESTS))
+    return counts, spellings
+
+
+def hot_pairs(counts, spellings, top=DEFAULT_TOP, min_requests=MIN_REQUESTS):
+    """[(character, user_message, requests)] for the most requested pairs, stored character names resolved."""
+    pairs, seen = [], set()
+    for pair, requests in counts.most_common():
+        if len(pairs) >= top or requests < min_requests:
+            break
+        character, user_message = spellings[pair]
+        resolution = dialogue_lookup.resolve_character(character)
+        if resolution.ambiguous:
+            print(f"⚠️ Skipping '{character}': {resolution.ambiguity_report()['error']}")
+            continue
+        character = resolution.character or character
+        key = (character.casefold(), pair[1])
+        if key not in seen:  # Two spellings of one stored name
+            seen.add(key)
+            pairs.append((character, user_message, requests))
+    return pairs
+
+
+def connect(db_file=CACHE_DB_FILE):
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")  # Same mode the servers' ResponseCache uses
+    create_precomputed_table(conn)
+    return conn
+
+
+def existing_replies(conn, model):
+    """{key: generated_at} for the precomputed replies the servers would serve right now."""
+    rows = conn.execute(
+        "SELECT key, generated_at FROM precomputed_responses WHERE model = ? AND prompt_version = ?",
+        (model, str(PROMPT_VERSION)),
+    )
+    return dict(rows)
+
+
+def generate_reply(llm, character, user_message):
+    """Same prompt and context as chat.call_gemini. None on failure."""
+    prompt = build_prompt(character, user_message, dialogue_lookup.retrieve_context(character, user_message))
+    try:
+        return llm.generate(prompt)
+    except Exception as e:
+        print(f"❌ Error with Gemini API for ({character}, '{user_message}'): {e}")
+        return None
+
+
+def store_replies(conn, rows):
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO precomputed_responses
+                (key, character_name, user_message, model, prompt_version, response, requests, generated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                response = excluded.response, requests = excluded.requests, generated_at = excluded.generated_at
+            """,
+            rows,
+        )
+
+
+def prune(conn, model, keep_keys):
+    """Deletes replies for another model or prompt version, and pairs no longer in the top."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (key TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM keep")
+    conn.executemany("INSERT OR IGNORE INTO keep (key) VALUES (?)", ((key,) for key in keep_keys))
+    with conn:
+        cursor = conn.execute(
+            """
+            DELETE FROM precomputed_responses
+            WHERE model != ? OR prompt_version != ? OR key NOT IN (SELECT key FROM keep)
+            """,
+            (model, str(PROMPT_VERSION)),
+        )
+    return cursor.rowcount
+
+
+def warm(conn, pairs, llm, max_age=None, force=False, concurrency=DEFAULT_CONCURRENCY):
+    """Generates and stores replies for the pairs that need one. Returns counters for the summary."""
+    fresh_after = time.time() - max_age if max_age is not None else 0.0
+    existing = existing_replies(conn, llm.model)
+    summary = {"pairs": len(pairs), "fresh": 0, "answered_by_db": 0, "generated": 0, "failed": 0}
+
+    todo = []
+    for character, user_message, requests in pairs:
+        key = cache_key(character, user_message, llm.model, PROMPT_VERSION)
+        if not force and existing.get(key, -1.0) >= fresh_after:
+            summary["fresh"] += 1
+        elif dialogue_lookup.fetch_dialogue(character, user_message):
+            summary["answered_by_db"] += 1  # /chat never reaches the LLM for these
+        else:
+            todo.append((key, character, user_message, requests))
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(generate_reply, llm, character, user_message): (key, character, user_message, requests)
+                   for key, character, user_message, requests in todo}
+        for future in as_completed(futures):
+            key, character, user_message, requests = futures[future]
+            response = future.result()
+            if response is None:
+                summary["failed"] += 1
+                continue
+            rows.append((key, character, user_message, llm.model, str(PROMPT_VERSION), response, requests, time.time()))
+            summary["generated"] += 1
+            if len(rows) >= WRITE_BATCH:
+                store_replies(conn, rows)
+                rows = []
+                print(f"🔄 {summary['generated']}/{len(todo)} replies stored")
+    if rows:
+        store_replies(conn, rows)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", action="append", default=[], help="request log (JSON lines); repeatable")
+    parser.add_argument("--seed", help="CSV with character,user_message[,requests] columns")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="pairs to keep precomputed")
+    parser.add_argument("--min-requests", type=int, default=MIN_REQUESTS)
+    parser.add_argument("--max-age-days", type=float, help="regenerate replies older than this (default: only on a new model or prompt version)")
+    parser.add_argument("--force", action="store_true", help="regenerate every pair")
+    parser.add_argument("--prune", action="store_true", help="delete stale replies and pairs no longer in the top")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--cache-db", default=CACHE_DB_FILE)
+    parser.add_argument("--dry-run", action="store_true", help="print the hot pairs and stop")
+    args = parser.parse_args()
+
+    if not args.log and not args.seed:
+        parser.error("give at least one --log or a --seed")
+
+    load_dotenv()
+    dialogue_lookup.request_log = None  # The job's own lookups are not traffic
+
+    counts, spellings = mine_pairs(args.log, args.seed)
+    pairs = hot_pairs(counts, spellings, args.top, args.min_requests)
+    print(f"📊 {sum(counts.values())} requests, {len(counts)} distinct pairs, {len(pairs)} hot")
+    if args.dry_run:
+        for character, user_message, requests in pairs:
+            print(f"{requests:6d}  {character}: {user_message}")
+        raise SystemExit
+
+    llm = create_backend()
+    conn = connect(args.cache_db)
+    start = time.time()
+    max_age = args.max_age_days * 24 * 60 * 60 if args.max_age_days is not None else None
+    summary = warm(conn, pairs, llm, max_age, args.force, args.concurrency)
+    if args.prune:
+        keep = [cache_key(character, user_message, llm.model, PROMPT_VERSION) for character, user_message, _ in pairs]
+        summary["pruned"] = prune(conn, llm.model, keep)
+    conn.close()
+    print(f"✅ {summary} in {time.time() - start:.1f}s")